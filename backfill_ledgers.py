@@ -0,0 +1,246 @@
+import argparse
+import asyncio
+import logging
+import os
+import sys
+from functools import partial
+
+from prometheus_client import CollectorRegistry, start_http_server
+
+from ekspiper.builder.pipeline import PipelineBuilder
+from ekspiper.connect.rpc import RateLimitedClient, get_json_rpc_client
+from ekspiper.metric.prom import ShardedRunnerMetrics
+from ekspiper.runner.sharded import (
+    ShardProgress,
+    ShardProgressProcessor,
+    ShardedProcessRunner,
+)
+from ekspiper.util.endpoints import endpoints
+from ekspiper.util.rate_limit import TokenBucketRateLimiter, get_rate_limiter
+from ekspiper.util.xrplpy_patches import get_latest_validated_ledger_sequence
+
+logger = logging.getLogger(__name__)
+
+# ledgers re-emitted on restart to cover what was still in the queues
+RESUME_MARGIN_LEDGERS = 100
+
+
+def build_shard_spec(
+        start_index: int,
+        end_index: int,
+        shard_index: int,
+        shard_size: int,
+) -> dict:
+    return {
+        "queues": {
+            "ledger_records": {"type": "queue", "maxsize": 100},
+            "txn_records": {"type": "queue", "maxsize": 10_000},
+            "formatted_ledgers": {"type": "queue", "maxsize": 100},
+        },
+        "sources": {
+            "ledger_indices": {
+                "type": "counter",
+                "starting_count": start_index,
+                "end_count": end_index,
+                "shard_index": shard_index,
+                "shard_size": shard_size,
+                "incr_by": -1,
+                "maxsize": 100,
+            },
+        },
+        "flows": {
+            "ledger_details": {
+                "source": "ledger_indices",
+                # one round trip per 10 ledgers
+                "max_in_flight": 2,
+                "max_batch_size": 10,
+                "max_linger_s": 0.05,
+                "stages": [{
+                    "processor": {"type": "batch_fetch_ledger_details"},
+                    "collectors": [{"type": "data_sink", "sink": "ledger_records"}],
+                }],
+            },
+            "ledger_to_txns_brk": {
+                "source": "ledger_records",
+                "stages": [{
+                    "processor": {"type": "extract_transactions"},
+                    "collectors": [{"type": "data_sink", "sink": "txn_records"}],
+                }, {
+                    "processor": {"type": "ledger_record"},
+                    "collectors": [{"type": "data_sink", "sink": "formatted_ledgers"}],
+                }],
+            },
+            "txn_record": {
+                "source": "txn_records",
+                "max_batch_size": 50,
+                "max_linger_s": 0.05,
+                "stages": [{
+                    "processor": {"type": "etl", "schema": "transaction"},
+                    "collectors": [{"type": "fluent", "tag": "transactions"}],
+                }],
+            },
+            "ledger_record": {
+                "source": "formatted_ledgers",
+                "stages": [{
+                    "processor": {"type": "etl", "schema": "ledger"},
+                    "collectors": [{"type": "fluent", "tag": "ledgers"}],
+                }, {
+                    "name": "progress",
+                    "processor": {"type": "progress"},
+                }],
+            },
+        },
+    }
+
+
+async def abackfill_shard(
+        shard_index: int,
+        shard_size: int,
+        progress: ShardProgress,
+        fluent_tag: str = "mainnet",
+        fluent_host: str = "0.0.0.0",
+        fluent_port: int = 25225,
+        start_index: int = None,
+        end_index: int = 1,
+):
+    logging.basicConfig(level=logging.INFO)
+
+    # resume behind the last ledger written by the previous run of the shard
+    if progress.checkpoint.value:
+        start_index = min(start_index, progress.checkpoint.value + RESUME_MARGIN_LEDGERS)
+        logger.info("[BackfillLedgers] shard %d resuming from %d", shard_index, start_index)
+
+    # the endpoint rate limit is split between the shard processes
+    rate_limiter = get_rate_limiter(endpoints[fluent_tag])
+    rpc_client = RateLimitedClient(
+        get_json_rpc_client(endpoints[fluent_tag]),
+        TokenBucketRateLimiter(
+            rate_per_s=rate_limiter.rate_per_s / shard_size,
+            burst=max(rate_limiter.burst // shard_size, 1),
+        ),
+    )
+
+    pipeline_builder = PipelineBuilder(
+        network=fluent_tag,
+        rpc_client=rpc_client,
+        fluent_host=fluent_host,
+        fluent_port=fluent_port,
+    ).register_processor(
+        "progress",
+        lambda spec: ShardProgressProcessor(progress, incr_by=-1),
+    )
+    pipeline = pipeline_builder.build(build_shard_spec(
+        start_index=start_index,
+        end_index=end_index,
+        shard_index=shard_index,
+        shard_size=shard_size,
+    ))
+
+    for source in pipeline.sources.values():
+        source.start()
+    pipeline.start_flows()
+
+    # the counter ends the source; let the rest of the pipeline drain
+    await pipeline.flow_tasks["ledger_details"]
+    await pipeline.adrain()
+
+
+async def alatest_ledger_index(fluent_tag: str) -> int:
+    rpc_client = RateLimitedClient(get_json_rpc_client(endpoints[fluent_tag]))
+    return await get_latest_validated_ledger_sequence(rpc_client) - 1
+
+
+def parse_arguments() -> argparse.Namespace:
+    arg_parser = argparse.ArgumentParser()
+
+    arg_parser.add_argument(
+        "-ft",
+        "--fluent_tag",
+        help="specify the network and the name to tag the FluentD/Bit entries",
+        type=str,
+        default="mainnet",
+    )
+    arg_parser.add_argument(
+        "-fh",
+        "--fluent_host",
+        help="specify the FluentD/Bit host",
+        type=str,
+        default="0.0.0.0",
+    )
+    arg_parser.add_argument(
+        "-fp",
+        "--fluent_port",
+        help="specify the FluentD/Bit port",
+        type=int,
+        default=25225,
+    )
+    arg_parser.add_argument(
+        "-s",
+        "--start_index",
+        help="ledger index to start the backfill from; defaults to the latest validated ledger",
+        type=int,
+        default=None,
+    )
+    arg_parser.add_argument(
+        "-e",
+        "--end_index",
+        help="ledger index to backfill down to (inclusive)",
+        type=int,
+        default=1,
+    )
+    arg_parser.add_argument(
+        "-n",
+        "--shard_size",
+        help="number of worker processes",
+        type=int,
+        default=os.cpu_count(),
+    )
+    arg_parser.add_argument(
+        "-r",
+        "--max_restart_count",
+        help="number of times a crashed shard is restarted",
+        type=int,
+        default=5,
+    )
+    arg_parser.add_argument(
+        "-mp",
+        "--metrics_port",
+        help="serve the Prometheus metrics on this port",
+        type=int,
+        default=None,
+    )
+
+    return arg_parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = parse_arguments()
+    if args.fluent_tag not in endpoints:
+        raise RuntimeError("[BackfillLedgers] Could not recognize fluent tag: " + str(args.fluent_tag))
+
+    start_index = args.start_index
+    if start_index is None:
+        start_index = asyncio.run(alatest_ledger_index(args.fluent_tag))
+    logger.info("[BackfillLedgers] backfilling ledgers %d to %d with %d shard(s)",
+                start_index, args.end_index, args.shard_size)
+
+    registry = CollectorRegistry()
+    if args.metrics_port:
+        start_http_server(args.metrics_port, registry=registry)
+
+    runner = ShardedProcessRunner(
+        shard_main=partial(
+            abackfill_shard,
+            fluent_tag=args.fluent_tag,
+            fluent_host=args.fluent_host,
+            fluent_port=args.fluent_port,
+            start_index=start_index,
+            end_index=args.end_index,
+        ),
+        shard_size=args.shard_size,
+        name="backfill_ledgers",
+        max_restart_count=args.max_restart_count,
+        metrics=ShardedRunnerMetrics(registry, "backfill_ledgers"),
+    )
+    sys.exit(0 if runner.run() else 1)
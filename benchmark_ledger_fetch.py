@@ -0,0 +1,116 @@
+import argparse
+import asyncio
+import json
+import logging
+import time
+
+import aiohttp
+from xrpl.asyncio.clients.utils import request_to_json_rpc
+
+from ekspiper.connect.rpc import RateLimitedClient, get_json_rpc_client
+from ekspiper.processor.fetch_transactions import build_ledger_request
+from ekspiper.util.endpoints import endpoints
+from ekspiper.util.ledger_codec import decode_binary_ledger
+from ekspiper.util.rate_limit import get_rate_limiter
+from ekspiper.util.xrplpy_patches import get_latest_validated_ledger_sequence
+
+logger = logging.getLogger(__name__)
+
+
+class _Totals:
+    def __init__(self):
+        self.byte_count = 0
+        self.fetch_s = 0.0
+        self.decode_cpu_s = 0.0
+        self.transaction_count = 0
+
+
+async def afetch(session: aiohttp.ClientSession,
+                 url: str,
+                 ledger_index: int,
+                 is_binary: bool,
+                 totals: _Totals,
+                 ):
+    await get_rate_limiter(url).acquire()
+
+    start_time = time.monotonic()
+    async with session.post(url, json=request_to_json_rpc(build_ledger_request(ledger_index, is_binary))) as response:
+        body = await response.read()
+    totals.fetch_s += time.monotonic() - start_time
+    totals.byte_count += len(body)
+
+    start_cpu_s = time.process_time()
+    result = json.loads(body)["result"]
+    if is_binary:
+        result = decode_binary_ledger(result)
+    totals.decode_cpu_s += time.process_time() - start_cpu_s
+    totals.transaction_count += len(result["ledger"]["transactions"])
+
+
+async def amain(fluent_tag: str,
+                start_index: int,
+                ledger_count: int,
+                ):
+    url = endpoints[fluent_tag]
+    if start_index is None:
+        start_index = await get_latest_validated_ledger_sequence(RateLimitedClient(get_json_rpc_client(url))) - 1
+
+    json_totals = _Totals()
+    binary_totals = _Totals()
+    # sequential, so that neither mode competes with the other
+    async with aiohttp.ClientSession(headers={"Accept-Encoding": "identity"}) as session:
+        for ledger_index in range(start_index, start_index - ledger_count, -1):
+            await afetch(session, url, ledger_index, False, json_totals)
+            await afetch(session, url, ledger_index, True, binary_totals)
+
+    print("ledgers %d to %d (%d transactions)" % (
+        start_index - ledger_count + 1,
+        start_index,
+        json_totals.transaction_count,
+    ))
+    print("%-8s %14s %12s %16s" % ("mode", "bytes", "fetch (s)", "decode CPU (s)"))
+    for mode, totals in [("json", json_totals), ("binary", binary_totals)]:
+        print("%-8s %14d %12.2f %16.3f" % (mode, totals.byte_count, totals.fetch_s, totals.decode_cpu_s))
+    print("binary is %.1fx smaller, %.1fx the decode CPU" % (
+        json_totals.byte_count / max(binary_totals.byte_count, 1),
+        binary_totals.decode_cpu_s / max(json_totals.decode_cpu_s, 1e-9),
+    ))
+
+
+def parse_arguments() -> argparse.Namespace:
+    arg_parser = argparse.ArgumentParser(
+        description="Compare the bytes transferred and decode CPU of the JSON and binary ledger fetches",
+    )
+
+    arg_parser.add_argument(
+        "-ft",
+        "--fluent_tag",
+        help="specify the network",
+        type=str,
+        default="mainnet",
+    )
+    arg_parser.add_argument(
+        "-s",
+        "--start_index",
+        help="ledger index to start from, going down; defaults to the latest validated ledger",
+        type=int,
+        default=None,
+    )
+    arg_parser.add_argument(
+        "-n",
+        "--ledger_count",
+        help="number of ledgers to fetch in each mode",
+        type=int,
+        default=50,
+    )
+
+    return arg_parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    args = parse_arguments()
+    if args.fluent_tag not in endpoints:
+        raise RuntimeError("[BenchmarkLedgerFetch] Could not recognize fluent tag: " + str(args.fluent_tag))
+
+    asyncio.run(amain(args.fluent_tag, args.start_index, args.ledger_count))
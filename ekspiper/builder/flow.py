@@ -2,6 +2,7 @@ from __future__ import annotations
 
 import asyncio
 import logging
+from typing import List
 
 from fluent.asyncsender import FluentSender
 
@@ -12,17 +13,23 @@ from ekspiper.collector.output import (
     QueueCollector,
     DataSinkCollector, BigQueryCollector,
 )
+from ekspiper.collector.ledger_range import LedgerRangeCompletionCollector
+from ekspiper.connect.data import DataSink
+from ekspiper.metric.prom import FlowMetrics
 from ekspiper.processor.base import EntryProcessor
 from ekspiper.template.processor import (
     ProcessCollectorsMap,
     TemplateFlow,
 )
+from ekspiper.util.callable import RetryWrapper
+from ekspiper.util.concurrency import AIMDConcurrencyController
 
 
 class ProcessCollectorsMapBuilder:
     def __init__(self):
         self.processor: EntryProcessor = None
         self.output_collectors: List[OutputCollector] = []
+        self.name: str = None
 
     def with_processor(self,
                        processor: EntryProcessor,
@@ -32,6 +39,12 @@ class ProcessCollectorsMapBuilder:
         self.processor = processor
         return self
 
+    def with_name(self,
+                  name: str,
+                  ) -> ProcessCollectorsMapBuilder:
+        self.name = name
+        return self
+
     def add_async_queue_output_collector(self,
                                          async_queue: asyncio.Queue,
                                          name: str = None,
@@ -66,6 +79,13 @@ class ProcessCollectorsMapBuilder:
         self.output_collectors.append(BigQueryCollector(project=project, dataset=dataset, table=table))
         return self
 
+    def add_ledger_range_completion_collector(self,
+                                              collector: LedgerRangeCompletionCollector,
+                                              ) -> ProcessCollectorsMapBuilder:
+        # shared by the flows writing the ledger records and the transactions
+        self.output_collectors.append(collector)
+        return self
+
     def with_stdout_output_collector(self,
                                      tag_name: str = "",
                                      is_simplified: bool = False,
@@ -80,12 +100,21 @@ class ProcessCollectorsMapBuilder:
         return ProcessCollectorsMap(
             processor=self.processor,
             collectors=self.output_collectors,
+            name=self.name,
         )
 
 
 class TemplateFlowBuilder:
     def __init__(self):
         self.process_collectors_maps = []
+        self.max_in_flight = 1
+        self.max_batch_size = 1
+        self.max_linger_s = 0.0
+        self.name = ""
+        self.metrics: FlowMetrics = None
+        self.dead_letter_sink: DataSink = None
+        self.retry_wrapper: RetryWrapper = None
+        self.concurrency_controller: AIMDConcurrencyController = None
 
     def add_process_collectors_map(self,
                                    process_collectors_map: ProcessCollectorsMap,
@@ -93,7 +122,59 @@ class TemplateFlowBuilder:
         self.process_collectors_maps.append(process_collectors_map)
         return self
 
+    def with_max_in_flight(self,
+                           max_in_flight: int,
+                           ) -> TemplateFlowBuilder:
+        self.max_in_flight = max_in_flight
+        return self
+
+    def with_name(self,
+                  name: str,
+                  ) -> TemplateFlowBuilder:
+        self.name = name
+        return self
+
+    def with_metrics(self,
+                     metrics: FlowMetrics,
+                     ) -> TemplateFlowBuilder:
+        self.metrics = metrics
+        return self
+
+    def with_dead_letter_sink(self,
+                              dead_letter_sink: DataSink,
+                              ) -> TemplateFlowBuilder:
+        self.dead_letter_sink = dead_letter_sink
+        return self
+
+    def with_retry_wrapper(self,
+                           retry_wrapper: RetryWrapper,
+                           ) -> TemplateFlowBuilder:
+        self.retry_wrapper = retry_wrapper
+        return self
+
+    def with_concurrency_controller(self,
+                                    concurrency_controller: AIMDConcurrencyController,
+                                    ) -> TemplateFlowBuilder:
+        self.concurrency_controller = concurrency_controller
+        return self
+
+    def with_micro_batching(self,
+                            max_batch_size: int,
+                            max_linger_s: float = 0.0,
+                            ) -> TemplateFlowBuilder:
+        self.max_batch_size = max_batch_size
+        self.max_linger_s = max_linger_s
+        return self
+
     def build(self) -> TemplateFlow:
         return TemplateFlow(
             process_collectors_maps=self.process_collectors_maps,
+            max_in_flight=self.max_in_flight,
+            max_batch_size=self.max_batch_size,
+            max_linger_s=self.max_linger_s,
+            name=self.name,
+            metrics=self.metrics,
+            dead_letter_sink=self.dead_letter_sink,
+            retry_wrapper=self.retry_wrapper,
+            concurrency_controller=self.concurrency_controller,
         )
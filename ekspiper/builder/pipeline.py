@@ -0,0 +1,662 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Set
+
+from fluent.asyncsender import FluentSender
+from prometheus_client import CollectorRegistry
+from xrpl.asyncio.clients.async_client import AsyncClient
+
+from ekspiper.builder.flow import (
+    ProcessCollectorsMapBuilder,
+    TemplateFlowBuilder,
+)
+from ekspiper.connect.counter import PartitionedCounterDataSource
+from ekspiper.connect.dead_letter import DeadLetterLog
+from ekspiper.connect.endpoint_pool import EndpointPoolClient
+from ekspiper.connect.hedge import HedgedClient
+from ekspiper.connect.file_data_source import FileDataSource
+from ekspiper.connect.queue import QueueSourceSink
+from ekspiper.connect.reorder import ReorderSourceSink
+from ekspiper.connect.rpc import RateLimitedClient, get_json_rpc_client
+from ekspiper.connect.singleflight import SingleflightClient
+from ekspiper.connect.websocket_rpc import MultiplexedWebsocketClient
+from ekspiper.connect.xrpledger import LedgerCreationDataSource, TransactionStreamDataSource
+from ekspiper.metric.prom import (
+    BookOffersCacheMetrics,
+    BookOffersFetchMetrics,
+    CircuitBreakerMetrics,
+    ConcurrencyMetrics,
+    ConnectionMetrics,
+    EndpointPoolMetrics,
+    FlowMetrics,
+    HedgeMetrics,
+    LedgerCacheMetrics,
+    LedgerGapMetrics,
+    QueueMetrics,
+    RateLimiterMetrics,
+    ReorderBufferMetrics,
+    SingleflightMetrics,
+    TransactionStreamMetrics,
+)
+from ekspiper.processor.base import EntryProcessor, PassthruProcessor
+from ekspiper.processor.cache import CachingLedgerFetchProcessor
+from ekspiper.processor.etl import (
+    ETLTemplateProcessor,
+    GenericValidator,
+    ProcessPoolETLProcessor,
+    XRPLGenericTransformer,
+)
+from ekspiper.processor.fetch_book_offers import (
+    BuildBookOfferRequestsProcessor,
+    CachingBookOffersFetchProcessor,
+    XRPLFetchBookOffersProcessor,
+)
+from ekspiper.processor.fetch_transactions import (
+    LedgerIndexProcessor,
+    PaymentTransactionSummaryProcessor,
+    XRPLBatchFetchLedgerDetailsProcessor,
+    XRPLExtractTransactionsFromLedgerProcessor,
+    XRPLFetchLedgerDetailsProcessor,
+    XRPLLedgerProcessor,
+    read_last_ledger_index,
+)
+from ekspiper.schema.xrp import (
+    XRPLLedgerSchema,
+    XRPLObjectSchema,
+    XRPLTransactionSchema,
+)
+from ekspiper.template.processor import TemplateFlow
+from ekspiper.util.callable import CircuitBreaker, RetryBudget, RetryWrapper
+from ekspiper.util.concurrency import AIMDConcurrencyController
+from ekspiper.util.endpoints import endpoint_pools, endpoints, wss_endpoints
+
+logger = logging.getLogger(__name__)
+
+SCHEMAS = {
+    "transaction": XRPLTransactionSchema.SCHEMA,
+    "ledger": XRPLLedgerSchema.SCHEMA,
+    "object": XRPLObjectSchema.SCHEMA,
+}
+
+
+class Pipeline:
+    """
+    The compiled topology: the named queues, sources and flows.
+    Every flow reads from either a source or a queue.
+    """
+
+    def __init__(self):
+        self.queues: Dict[str, Any] = {}
+        self.sources: Dict[str, Any] = {}
+        self.flows: Dict[str, TemplateFlow] = {}
+        self.flow_iterators: Dict[str, Any] = {}
+        # name of the source or queue each flow reads from
+        self.flow_sources: Dict[str, str] = {}
+        self.flow_tasks: Dict[str, asyncio.Task] = {}
+        # names of the flows writing into each queue
+        self.queue_writers: Dict[str, Set[str]] = {}
+        self.dead_letter_sink: DeadLetterLog = None
+        # pools of worker processes, shut down along with the pipeline
+        self.executors: List[Executor] = []
+
+    def downstream_flows(self,
+                         name: str,
+                         ) -> List[str]:
+        """
+        The flows fed, through the queues, by the given flow, transitively.
+        """
+        reached = {name}
+        pending = [name]
+        while pending:
+            writer = pending.pop()
+            for flow_name, source_name in self.flow_sources.items():
+                if flow_name not in reached and writer in self.queue_writers.get(source_name, set()):
+                    reached.add(flow_name)
+                    pending.append(flow_name)
+        reached.discard(name)
+        return [n for n in self.flows if n in reached]
+
+    def start_flows(self,
+                    names: List[str] = None,
+                    ) -> Dict[str, asyncio.Task]:
+        """
+        Start the given flows, all of them by default. The queues written
+        only by the flows left out are stopped by `adrain`.
+        """
+        for name in (self.flows if names is None else names):
+            self.flow_tasks[name] = asyncio.create_task(self.flows[name].aexecute(
+                message_iterator=self.flow_iterators[name],
+            ))
+        return self.flow_tasks
+
+    def stop(self):
+        # stopping the sources and queues lets the flows drain out
+        for source in self.sources.values():
+            source.stop()
+        for queue in self.queues.values():
+            queue.stop()
+
+    async def await_flows(self):
+        await asyncio.gather(*self.flow_tasks.values())
+
+    def shutdown(self):
+        """
+        Release the worker processes, once the flows are done.
+        """
+        for executor in self.executors:
+            executor.shutdown()
+        self.executors = []
+
+    async def adrain(self):
+        """
+        Stop the sources, then stop every queue once all the flows writing
+        into it are done, so that whatever is in flight reaches the end.
+        """
+        for source in self.sources.values():
+            source.stop()
+
+        pending_queues = dict(self.queues)
+        while pending_queues:
+            for name, queue in list(pending_queues.items()):
+                writer_tasks = [self.flow_tasks[w] for w in self.queue_writers.get(name, set()) if w in self.flow_tasks]
+                if all(t.done() for t in writer_tasks):
+                    queue.stop()
+                    del pending_queues[name]
+
+            running_tasks = [t for t in self.flow_tasks.values() if not t.done()]
+            if not running_tasks:
+                for queue in pending_queues.values():
+                    queue.stop()
+                break
+
+            await asyncio.wait(running_tasks, return_when=asyncio.FIRST_COMPLETED)
+
+        await self.await_flows()
+
+
+class PipelineBuilder:
+    """
+    Compiles a pipeline spec (ie. loaded from YAML) into TemplateFlows.
+
+        dead_letter_path: /app/persistent_data/dead_letters.jsonl
+        rpc_transport: http  # or websocket, or pool
+        singleflight: {memo_ttl_s: 2.0}
+        queues:
+          ledger_records: {type: reorder, max_buffer_size: 100}
+          txn_records: {type: queue, maxsize: 10000}
+          ledger_backfill: {type: queue, maxsize: 1000}
+        sources:
+          ledger_creation: {type: ledger_creation, backfill_sink: ledger_backfill, reorder_sink: ledger_records}
+        flows:
+          ledger_details:
+            source: ledger_creation
+            max_in_flight: 10
+            retry: {endpoint: mainnet, failure_threshold: 5, reset_timeout_s: 30, budget_ratio: 0.2}
+            concurrency: {initial_limit: 10, max_limit: 50, target_latency_s: 2.0}
+            stages:
+              - processor: {type: fetch_ledger_details, hedge: {percentile: 0.95, max_hedge_ratio: 0.1}}
+                collectors:
+                  - {type: data_sink, sink: ledger_records}
+          ledger_backfill:
+            source: ledger_backfill
+            max_in_flight: 4
+            stages:
+              - processor: {type: fetch_ledger_details}
+                collectors:
+                  - {type: data_sink, sink: ledger_records}
+
+    Flows with the same retry `endpoint` share one circuit breaker and
+    retry budget. With a `singleflight` spec, identical requests in flight
+    share one call. The ledger fetches with a `hedge` spec share one hedged client,
+    which goes around the coalescing (a duplicate would only join its original);
+    with `binary: true` they are fetched in binary and decoded in a pool of
+    `decode_process_pool_size` processes (2 by default; the default thread
+    pool when 0, where the decoding holds the GIL), and with
+    `cache: {dir: ...}` kept on disk for the next runs. The book offers
+    fetches follow the markers `page_size` offers at a time (one message
+    per book, or per page with `stream_pages: true`), and with a `cache`
+    spec reuse an order book snapshot for `min_refetch_interval_ledgers`.
+    The fetches given the same `ledger_index_path` (ie. the live and the
+    backfill flows) keep one low watermark of the fetched ledgers in it;
+    the backfilled ledgers reach a reorder queue after newer ones and are
+    released out of order.
+    A `transaction_stream` source emits the ledgers with their transactions
+    straight from the websocket, in place of a ledger source and fetch flow;
+    with `fetch_header: true` it fetches the rest of each ledger's header.
+    Processor types can be extended through `register_processor`.
+    """
+
+    def __init__(self,
+                 network: str = "mainnet",
+                 rpc_client: AsyncClient = None,
+                 fluent_host: str = "0.0.0.0",
+                 fluent_port: int = 25225,
+                 prom_registry: CollectorRegistry = None,
+                 rpc_transport: str = "http",
+                 ):
+        self.network = network
+        self.rpc_client = rpc_client
+        self.transport_client = rpc_client
+        self.rpc_transport = rpc_transport
+        self.singleflight_spec: Dict[str, Any] = None
+        self.fluent_host = fluent_host
+        self.fluent_port = fluent_port
+        self.prom_registry = prom_registry
+        self.flow_metrics = FlowMetrics(prom_registry) if prom_registry else None
+        self.retry_wrappers: Dict[str, RetryWrapper] = {}
+        self.hedged_client: HedgedClient = None
+        # one per index file, shared by the flows fetching into it
+        self.ledger_index_processors: Dict[str, LedgerIndexProcessor] = {}
+        # one per pool size, shared by the binary ledger fetches
+        self.decode_executors: Dict[int, ProcessPoolExecutor] = {}
+        # one per ETL processor running in worker processes
+        self.etl_executors: List[ProcessPoolExecutor] = []
+
+        self.processor_factories: Dict[str, Callable[[Dict[str, Any]], EntryProcessor]] = {
+            "passthru": lambda spec: PassthruProcessor(),
+            "fetch_ledger_details": self._build_fetch_ledger_details_processor,
+            "batch_fetch_ledger_details": self._build_batch_fetch_ledger_details_processor,
+            "extract_transactions": lambda spec: XRPLExtractTransactionsFromLedgerProcessor(
+                is_include_ledger_index=spec.get("is_include_ledger_index", True),
+            ),
+            "ledger_record": lambda spec: XRPLLedgerProcessor(),
+            "payment_summary": lambda spec: PaymentTransactionSummaryProcessor(),
+            "etl": self._build_etl_processor,
+            "book_offer_requests": lambda spec: BuildBookOfferRequestsProcessor(),
+            "fetch_book_offers": self._build_fetch_book_offers_processor,
+        }
+
+    def register_processor(self,
+                           type_name: str,
+                           factory: Callable[[Dict[str, Any]], EntryProcessor],
+                           ) -> PipelineBuilder:
+        self.processor_factories[type_name] = factory
+        return self
+
+    def get_rpc_client(self) -> AsyncClient:
+        if self.rpc_client:
+            return self.rpc_client
+
+        self.rpc_client = self.get_transport_client()
+        if self.singleflight_spec is not None:
+            self.rpc_client = SingleflightClient(
+                self.rpc_client,
+                memo_ttl_s=self.singleflight_spec.get("memo_ttl_s", 2.0),
+                max_memo_size=self.singleflight_spec.get("max_memo_size", 1000),
+                metrics=SingleflightMetrics(self.prom_registry, self.network) if self.prom_registry else None,
+            )
+        return self.rpc_client
+
+    def _rate_limited(self,
+                      rpc_client: AsyncClient,
+                      ) -> RateLimitedClient:
+        return RateLimitedClient(
+            rpc_client,
+            metrics=RateLimiterMetrics(self.prom_registry, rpc_client.url) if self.prom_registry else None,
+        )
+
+    def get_transport_client(self) -> AsyncClient:
+        if self.transport_client:
+            return self.transport_client
+
+        metrics = ConnectionMetrics(self.prom_registry, self.network) if self.prom_registry else None
+        if self.rpc_transport == "http":
+            self.transport_client = self._rate_limited(get_json_rpc_client(endpoints[self.network], metrics=metrics))
+        elif self.rpc_transport == "websocket":
+            self.transport_client = self._rate_limited(
+                MultiplexedWebsocketClient(wss_endpoints[self.network], metrics=metrics)
+            )
+        elif self.rpc_transport == "pool":
+            # every node of the pool keeps its own rate limit
+            self.transport_client = EndpointPoolClient(
+                [
+                    self._rate_limited(get_json_rpc_client(url, metrics=metrics))
+                    for url in endpoint_pools.get(self.network, [endpoints[self.network]])
+                ],
+                name=self.network,
+                metrics=EndpointPoolMetrics(self.prom_registry, self.network) if self.prom_registry else None,
+            )
+        else:
+            raise ValueError("[PipelineBuilder] unknown rpc transport: %s" % self.rpc_transport)
+        return self.transport_client
+
+    def get_hedged_client(self,
+                          hedge_spec: Dict[str, Any],
+                          ) -> HedgedClient:
+        if not self.hedged_client:
+            self.hedged_client = HedgedClient(
+                self.get_transport_client(),
+                percentile=hedge_spec.get("percentile", 0.95),
+                initial_delay_s=hedge_spec.get("initial_delay_s", 1.0),
+                max_hedge_ratio=hedge_spec.get("max_hedge_ratio", 0.1),
+                metrics=HedgeMetrics(self.prom_registry, self.network) if self.prom_registry else None,
+            )
+        return self.hedged_client
+
+    def get_ledger_index_processor(self,
+                                   index_file_path: str,
+                                   ) -> LedgerIndexProcessor:
+        if index_file_path not in self.ledger_index_processors:
+            self.ledger_index_processors[index_file_path] = LedgerIndexProcessor(index_file_path)
+        return self.ledger_index_processors[index_file_path]
+
+    def get_decode_executor(self,
+                            max_workers: int,
+                            ) -> ProcessPoolExecutor:
+        if max_workers not in self.decode_executors:
+            self.decode_executors[max_workers] = ProcessPoolExecutor(max_workers=max_workers)
+        return self.decode_executors[max_workers]
+
+    def get_retry_wrapper(self,
+                          retry_spec: Dict[str, Any],
+                          ) -> RetryWrapper:
+        endpoint = retry_spec.get("endpoint", self.network)
+        if endpoint not in self.retry_wrappers:
+            metrics = CircuitBreakerMetrics(self.prom_registry, endpoint) if self.prom_registry else None
+            self.retry_wrappers[endpoint] = RetryWrapper(
+                circuit_breaker=CircuitBreaker(
+                    name=endpoint,
+                    failure_threshold=retry_spec.get("failure_threshold", 5),
+                    reset_timeout_s=retry_spec.get("reset_timeout_s", 30),
+                    half_open_max_probes=retry_spec.get("half_open_max_probes", 1),
+                    metrics=metrics,
+                ),
+                retry_budget=RetryBudget(
+                    ratio=retry_spec.get("budget_ratio", 0.2),
+                    min_retries_per_s=retry_spec.get("min_retries_per_s", 1.0),
+                    metrics=metrics,
+                ),
+            )
+        return self.retry_wrappers[endpoint]
+
+    def build(self,
+              spec: Dict[str, Any],
+              ) -> Pipeline:
+        pipeline = Pipeline()
+        self.rpc_transport = spec.get("rpc_transport", self.rpc_transport)
+        if "singleflight" in spec:
+            self.singleflight_spec = spec["singleflight"] or {}
+        if spec.get("dead_letter_path"):
+            pipeline.dead_letter_sink = DeadLetterLog(spec["dead_letter_path"])
+
+        for name, queue_spec in (spec.get("queues") or {}).items():
+            pipeline.queues[name] = self._build_queue(name, queue_spec or {})
+
+        for name, source_spec in (spec.get("sources") or {}).items():
+            pipeline.sources[name] = self._build_source(name, source_spec or {}, pipeline)
+
+        for name, flow_spec in (spec.get("flows") or {}).items():
+            source_name = flow_spec.get("source")
+            message_iterator = pipeline.sources.get(source_name) or pipeline.queues.get(source_name)
+            if not message_iterator:
+                raise ValueError("[PipelineBuilder] flow '%s' has an unknown source: %s" % (name, source_name))
+
+            pipeline.flows[name] = self._build_flow(name, flow_spec, pipeline)
+            pipeline.flow_iterators[name] = message_iterator
+            pipeline.flow_sources[name] = source_name
+
+        pipeline.executors.extend(self.decode_executors.values())
+        pipeline.executors.extend(self.etl_executors)
+        return pipeline
+
+    def _build_queue(self,
+                     name: str,
+                     queue_spec: Dict[str, Any],
+                     ):
+        queue_type = queue_spec.get("type", "queue")
+        if queue_type == "queue":
+            return QueueSourceSink(
+                name=name,
+                maxsize=queue_spec.get("maxsize", 0),
+                max_bytes=queue_spec.get("max_bytes", 0),
+                low_watermark_ratio=queue_spec.get("low_watermark_ratio", 0.8),
+                metrics=QueueMetrics(self.prom_registry, name) if self.prom_registry else None,
+            )
+        if queue_type == "reorder":
+            return ReorderSourceSink(
+                name=name,
+                start_key=queue_spec.get("start_key"),
+                incr_by=queue_spec.get("incr_by", 1),
+                max_buffer_size=queue_spec.get("max_buffer_size", 1000),
+                gap_timeout_s=queue_spec.get("gap_timeout_s", 30),
+                metrics=ReorderBufferMetrics(self.prom_registry, name) if self.prom_registry else None,
+            )
+
+        raise ValueError("[PipelineBuilder] unknown queue type: %s" % queue_type)
+
+    def _build_source(self,
+                      name: str,
+                      source_spec: Dict[str, Any],
+                      pipeline: Pipeline,
+                      ):
+        source_type = source_spec.get("type")
+        if source_type == "ledger_creation":
+            backfill_sink_name = source_spec.get("backfill_sink")
+            if backfill_sink_name and backfill_sink_name not in pipeline.queues:
+                raise ValueError("[PipelineBuilder] source '%s' has an unknown backfill sink: %s" % (
+                    name,
+                    backfill_sink_name,
+                ))
+
+            # the fetched ledgers are released in order from the first one emitted
+            reorder_sink_name = source_spec.get("reorder_sink")
+            if reorder_sink_name and not isinstance(pipeline.queues.get(reorder_sink_name), ReorderSourceSink):
+                raise ValueError("[PipelineBuilder] source '%s' has an unknown reorder sink: %s" % (
+                    name,
+                    reorder_sink_name,
+                ))
+
+            # resume after the last ledger of the previous run
+            index_file_path = source_spec.get("ledger_index_path")
+            starting_index = read_last_ledger_index(index_file_path) if index_file_path else None
+            return LedgerCreationDataSource(
+                wss_url=source_spec.get("wss_url") or wss_endpoints[self.network],
+                maxsize=source_spec.get("maxsize", 0),
+                backfill_sink=pipeline.queues[backfill_sink_name] if backfill_sink_name else None,
+                last_ledger=starting_index - 1 if starting_index is not None else None,
+                metrics=LedgerGapMetrics(self.prom_registry, name) if self.prom_registry else None,
+                first_ledger_callback=pipeline.queues[reorder_sink_name].seed if reorder_sink_name else None,
+            )
+        if source_type == "transaction_stream":
+            return TransactionStreamDataSource(
+                wss_url=source_spec.get("wss_url") or wss_endpoints[self.network],
+                rpc_client=self.get_rpc_client(),
+                maxsize=source_spec.get("maxsize", 100),
+                metrics=TransactionStreamMetrics(self.prom_registry, name) if self.prom_registry else None,
+                is_fetch_header=source_spec.get("fetch_header", False),
+                retry_wrapper=self.get_retry_wrapper(source_spec["retry"]) if source_spec.get("retry") else None,
+                dead_letter_sink=pipeline.dead_letter_sink,
+                name=name,
+            )
+        if source_type == "counter":
+            return PartitionedCounterDataSource(
+                starting_count=source_spec["starting_count"],
+                shard_index=source_spec.get("shard_index", 0),
+                shard_size=source_spec.get("shard_size", 1),
+                incr_by=source_spec.get("incr_by", -1),
+                maxsize=source_spec.get("maxsize", 0),
+                end_count=source_spec.get("end_count"),
+            )
+        if source_type == "file":
+            return FileDataSource(
+                file=source_spec["file"],
+                maxsize=source_spec.get("maxsize", 0),
+            )
+
+        raise ValueError("[PipelineBuilder] unknown source type: %s" % source_type)
+
+    def _build_flow(self,
+                    name: str,
+                    flow_spec: Dict[str, Any],
+                    pipeline: Pipeline,
+                    ) -> TemplateFlow:
+        flow_builder = TemplateFlowBuilder().with_name(name).with_max_in_flight(
+            flow_spec.get("max_in_flight", 1),
+        ).with_micro_batching(
+            max_batch_size=flow_spec.get("max_batch_size", 1),
+            max_linger_s=flow_spec.get("max_linger_s", 0.0),
+        )
+        if self.flow_metrics:
+            flow_builder.with_metrics(self.flow_metrics)
+        if pipeline.dead_letter_sink:
+            flow_builder.with_dead_letter_sink(pipeline.dead_letter_sink)
+        if flow_spec.get("retry"):
+            flow_builder.with_retry_wrapper(self.get_retry_wrapper(flow_spec["retry"]))
+        if flow_spec.get("concurrency"):
+            flow_builder.with_concurrency_controller(self._build_concurrency_controller(
+                name,
+                flow_spec["concurrency"],
+            ))
+
+        for stage_spec in flow_spec.get("stages", []):
+            processor_spec = stage_spec.get("processor") or {}
+            processor_type = processor_spec.get("type")
+            if processor_type not in self.processor_factories:
+                raise ValueError("[PipelineBuilder] unknown processor type: %s" % processor_type)
+
+            pc_map_builder = ProcessCollectorsMapBuilder().with_processor(
+                self.processor_factories[processor_type](processor_spec)
+            )
+            if stage_spec.get("name"):
+                pc_map_builder.with_name(stage_spec["name"])
+
+            for collector_spec in stage_spec.get("collectors", []):
+                self._add_collector(pc_map_builder, collector_spec, pipeline)
+                if collector_spec.get("type") == "data_sink":
+                    pipeline.queue_writers.setdefault(collector_spec["sink"], set()).add(name)
+
+            flow_builder.add_process_collectors_map(pc_map_builder.build())
+
+        return flow_builder.build()
+
+    def _build_concurrency_controller(self,
+                                      name: str,
+                                      concurrency_spec: Dict[str, Any],
+                                      ) -> AIMDConcurrencyController:
+        return AIMDConcurrencyController(
+            initial_limit=concurrency_spec.get("initial_limit", 10),
+            min_limit=concurrency_spec.get("min_limit", 1),
+            max_limit=concurrency_spec.get("max_limit", 100),
+            target_latency_s=concurrency_spec.get("target_latency_s", 1.0),
+            max_error_rate=concurrency_spec.get("max_error_rate", 0.05),
+            metrics=ConcurrencyMetrics(self.prom_registry, name) if self.prom_registry else None,
+        )
+
+    def _add_collector(self,
+                       pc_map_builder: ProcessCollectorsMapBuilder,
+                       collector_spec: Dict[str, Any],
+                       pipeline: Pipeline,
+                       ):
+        collector_type = collector_spec.get("type")
+        if collector_type == "data_sink":
+            sink_name = collector_spec.get("sink")
+            if sink_name not in pipeline.queues:
+                raise ValueError("[PipelineBuilder] unknown sink: %s" % sink_name)
+            pc_map_builder.add_data_sink_output_collector(
+                data_sink=pipeline.queues[sink_name],
+                name=sink_name,
+            )
+        elif collector_type == "fluent":
+            tag = self.network + "." + collector_spec["tag"] if collector_spec.get("tag") else self.network
+            pc_map_builder.add_fluent_output_collector(
+                fluent_sender=FluentSender(tag, host=self.fluent_host, port=self.fluent_port),
+            )
+        elif collector_type == "bigquery":
+            pc_map_builder.add_bigquery_output_collector(
+                project=collector_spec["project"],
+                dataset=collector_spec["dataset"],
+                table=collector_spec["table"],
+            )
+        elif collector_type == "stdout":
+            pc_map_builder.with_stdout_output_collector(
+                tag_name=collector_spec.get("tag_name", ""),
+                is_simplified=collector_spec.get("is_simplified", False),
+            )
+        else:
+            raise ValueError("[PipelineBuilder] unknown collector type: %s" % collector_type)
+
+    def _build_fetch_ledger_details_processor(self,
+                                              processor_spec: Dict[str, Any],
+                                              ) -> EntryProcessor:
+        index_file_path = processor_spec.get("ledger_index_path")
+        hedge_spec = processor_spec.get("hedge")
+        is_binary = processor_spec.get("binary", False)
+        decode_process_pool_size = processor_spec.get("decode_process_pool_size", 2)
+        processor = XRPLFetchLedgerDetailsProcessor(
+            rpc_client=self.get_hedged_client(hedge_spec) if hedge_spec else self.get_rpc_client(),
+            ledger_index_processor=self.get_ledger_index_processor(index_file_path) if index_file_path else None,
+            is_binary=is_binary,
+            decode_executor=self.get_decode_executor(decode_process_pool_size)
+            if is_binary and decode_process_pool_size > 0 else None,
+        )
+
+        cache_spec = processor_spec.get("cache")
+        if not cache_spec:
+            return processor
+        return CachingLedgerFetchProcessor(
+            processor,
+            cache_dir=cache_spec["dir"],
+            network=self.network,
+            max_size_bytes=cache_spec.get("max_size_bytes", 10 * 1024 ** 3),
+            is_read_through=cache_spec.get("is_read_through", True),
+            is_write_through=cache_spec.get("is_write_through", True),
+            metrics=LedgerCacheMetrics(self.prom_registry, self.network) if self.prom_registry else None,
+        )
+
+    def _build_batch_fetch_ledger_details_processor(self,
+                                                    processor_spec: Dict[str, Any],
+                                                    ) -> EntryProcessor:
+        index_file_path = processor_spec.get("ledger_index_path")
+        return XRPLBatchFetchLedgerDetailsProcessor(
+            rpc_client=self.get_rpc_client(),
+            ledger_index_processor=self.get_ledger_index_processor(index_file_path) if index_file_path else None,
+            max_kept_count=processor_spec.get("max_kept_count", 100),
+        )
+
+    def _build_fetch_book_offers_processor(self,
+                                           processor_spec: Dict[str, Any],
+                                           ) -> EntryProcessor:
+        processor = XRPLFetchBookOffersProcessor(
+            rpc_client=self.get_rpc_client(),
+            page_size=processor_spec.get("page_size"),
+            max_page_count=processor_spec.get("max_page_count", 100),
+            is_stream_pages=processor_spec.get("stream_pages", False),
+            max_concurrency=processor_spec.get("max_concurrency", 8),
+            metrics=BookOffersFetchMetrics(self.prom_registry, self.network) if self.prom_registry else None,
+        )
+
+        cache_spec = processor_spec.get("cache")
+        if not cache_spec:
+            return processor
+        return CachingBookOffersFetchProcessor(
+            processor,
+            min_refetch_interval_ledgers=cache_spec.get("min_refetch_interval_ledgers", 10),
+            max_concurrency=cache_spec.get("max_concurrency", 8),
+            max_book_count=cache_spec.get("max_book_count", 10_000),
+            metrics=BookOffersCacheMetrics(self.prom_registry, self.network) if self.prom_registry else None,
+        )
+
+    def _build_etl_processor(self,
+                             processor_spec: Dict[str, Any],
+                             ) -> EntryProcessor:
+        schema = SCHEMAS[processor_spec.get("schema", "transaction")]
+        process_pool_size = processor_spec.get("process_pool_size", 0)
+        if process_pool_size > 0:
+            processor = ProcessPoolETLProcessor(
+                etl_steps=[
+                    GenericValidator(schema),
+                    XRPLGenericTransformer(schema),
+                ],
+                max_workers=process_pool_size,
+                chunk_size=processor_spec.get("chunk_size", 50),
+            )
+            self.etl_executors.append(processor.executor)
+            return processor
+
+        return ETLTemplateProcessor(
+            validator=GenericValidator(schema),
+            transformer=XRPLGenericTransformer(schema),
+        )
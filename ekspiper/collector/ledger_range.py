@@ -0,0 +1,42 @@
+from typing import Dict, Any, Set
+
+from ekspiper.collector.output import OutputCollector
+from ekspiper.connect.counter import LedgerRangeScheduler
+from ekspiper.connect.reorder import ledger_index_key
+
+
+class LedgerRangeCompletionCollector(OutputCollector):
+    """
+    Marks the ledgers as done with the scheduler they were leased from once
+    they are written, ie. placed after the fluent collectors of the final
+    flows: a ledger is done when its ledger record (with its
+    `transaction_count`) and every one of its transactions (carrying
+    `_LedgerIndex`) went through.
+    """
+
+    def __init__(self,
+                 scheduler: LedgerRangeScheduler,
+                 ):
+        self.scheduler = scheduler
+        # ledger index -> transactions still to be written, below 0 until
+        # the ledger record tells how many there are
+        self.remaining_counts: Dict[int, int] = {}
+        self.recorded_indices: Set[int] = set()
+
+    async def acollect_output(self,
+                              entry: Dict[str, Any]
+                              ):
+        if "_LedgerIndex" in entry:
+            ledger_index = int(entry["_LedgerIndex"])
+            remaining_count = self.remaining_counts.get(ledger_index, 0) - 1
+        else:
+            ledger_index = ledger_index_key(entry)
+            remaining_count = self.remaining_counts.get(ledger_index, 0) + entry.get("transaction_count", 0)
+            self.recorded_indices.add(ledger_index)
+
+        if remaining_count == 0 and ledger_index in self.recorded_indices:
+            self.remaining_counts.pop(ledger_index, None)
+            self.recorded_indices.discard(ledger_index)
+            self.scheduler.complete(ledger_index)
+        else:
+            self.remaining_counts[ledger_index] = remaining_count
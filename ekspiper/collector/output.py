@@ -1,6 +1,6 @@
 import asyncio
 import logging
-from typing import Any, Dict
+from typing import Any, Dict, List
 
 from fluent.asyncsender import FluentSender
 from google.cloud import bigquery
@@ -18,18 +18,34 @@ class OutputCollector:
         return
 
 
-class BigQueryCollector(OutputCollector):
+class BatchOutputCollector(OutputCollector):
+    """
+    Collector that can take all the outputs of a micro-batch at once.
+    """
+
+    async def acollect_outputs(self,
+                               entries: List[Any],
+                               ):
+        return
+
+    async def acollect_output(self,
+                              entry: Any,
+                              ):
+        await self.acollect_outputs([entry])
+
+
+class BigQueryCollector(BatchOutputCollector):
     def __init__(self, project: str, dataset: str, table: str):
         self.project = project
         self.table = table
         self.dataset = dataset
 
-    async def acollect_output(self,
-                              entry: Dict[str, Any]
-                              ):
+    async def acollect_outputs(self,
+                               entries: List[Dict[str, Any]]
+                               ):
         table_id = self.project + "." + self.dataset + "." + self.table
 
-        errors = bigquery.Client().insert_rows_json(table_id, [entry], row_ids=[None] * len([entry]))
+        errors = bigquery.Client().insert_rows_json(table_id, entries, row_ids=[None] * len(entries))
 
         if not errors:
             logger.info("New rows have been added.")
@@ -37,7 +53,7 @@ class BigQueryCollector(OutputCollector):
             logger.warning("Encountered errors while inserting rows: {}".format(errors))
 
 
-class FluentCollector(OutputCollector):
+class FluentCollector(BatchOutputCollector):
     def __init__(self,
                  fluent_sender: FluentSender,
                  tag_name: str,
@@ -55,6 +71,17 @@ class FluentCollector(OutputCollector):
         )
         logger.debug("[FluentCollector] emit done: %s", is_emitted)
 
+    async def acollect_outputs(self,
+                               entries: List[Dict[str, Any]]
+                               ):
+        logger.debug("[FluentCollector] pre-emit %d entries", len(entries))
+        for entry in entries:
+            self.fluent_sender.emit(
+                self.tag_name,
+                entry,
+            )
+        logger.debug("[FluentCollector] emit done")
+
 
 class LoggerCollector(OutputCollector):
     async def acollect_output(self,
@@ -1,19 +1,34 @@
 import asyncio
+import collections
+import json
 import logging
+import os
+from typing import Dict, Optional, Set, Tuple
 
 from .data import DataSource
 
 logger = logging.getLogger(__name__)
 
+# marks the end of the count for the consumer
+_END_OF_COUNT = object()
+
 
 class PartitionedCounterDataSource(DataSource):
+    """
+    Counts from `starting_count` by `incr_by`, emitting only the indices
+    of its shard. The count runs down to 1, or up to `end_count`
+    (inclusive) when given, after which the iteration stops.
+    """
+
     def __init__(self,
                  starting_count: int,
                  shard_index: int,
                  shard_size: int,
                  incr_by: int = -1,
+                 maxsize: int = 0,
+                 end_count: int = None,
                  ):
-        self.async_queue = asyncio.Queue()
+        self.async_queue = asyncio.Queue(maxsize=maxsize)
         self.is_stop = False
         self.populate_task = None
 
@@ -21,12 +36,18 @@ class PartitionedCounterDataSource(DataSource):
         self.shard_size = shard_size
         self.current_index = starting_count
         self.incr_by = incr_by
+        self.end_count = end_count
 
     def start(self):
         self.populate_task = asyncio.create_task(self._start())
 
+    def _is_exhausted(self) -> bool:
+        if self.end_count is None:
+            return self.current_index <= 0
+        return (self.current_index - self.end_count) * self.incr_by > 0
+
     async def _start(self):
-        while self.current_index > 0 and not self.is_stop:
+        while not self._is_exhausted() and not self.is_stop:
 
             if self.current_index % self.shard_size != self.shard_index:
                 self.current_index += self.incr_by
@@ -37,6 +58,9 @@ class PartitionedCounterDataSource(DataSource):
             await self.async_queue.put(idx)
             await asyncio.sleep(0)  # force yielding control
 
+        if not self.is_stop:
+            await self.async_queue.put(_END_OF_COUNT)
+
     def stop(self):
         self.is_stop = True
         self.populate_task.cancel()
@@ -48,4 +72,201 @@ class PartitionedCounterDataSource(DataSource):
         if self.is_stop and self.async_queue.empty():
             raise StopAsyncIteration
 
-        return await self.async_queue.get()
+        idx = await self.async_queue.get()
+        if idx is _END_OF_COUNT:
+            self.is_stop = True
+            raise StopAsyncIteration
+
+        return idx
+
+
+class _Chunk:
+    def __init__(self,
+                 first_index: int,
+                 last_index: int,
+                 ):
+        self.first_index = first_index
+        self.last_index = last_index
+        self.size = abs(last_index - first_index) + 1
+        self.completed_indices: Set[int] = set()
+
+
+class _Lease:
+    def __init__(self,
+                 chunk: _Chunk,
+                 next_index: int,
+                 last_index: int,
+                 ):
+        self.chunk = chunk
+        self.next_index = next_index
+        self.last_index = last_index
+
+
+class LedgerRangeScheduler:
+    """
+    Splits the [start_index, end_index] range into chunks of `chunk_size`
+    that the workers lease one at a time, in ascending or descending order.
+    The chunks are aligned on multiples of `chunk_size`, so that they stay
+    the same from one run to the next whatever the start index.
+
+    Once no chunk is left, an idle worker steals the second half of the
+    largest remaining lease. A chunk is complete when every one of its
+    indices was passed to `complete`; completed chunks are appended to
+    `completed_file` (when given) and skipped when the scheduler restarts.
+    """
+
+    def __init__(self,
+                 start_index: int,
+                 end_index: int,
+                 chunk_size: int = 100,
+                 is_descending: bool = True,
+                 min_steal_size: int = 2,
+                 completed_file: str = None,
+                 ):
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1 but got '%s'" % chunk_size)
+
+        low_index, high_index = min(start_index, end_index), max(start_index, end_index)
+        self.step = -1 if is_descending else 1
+        self.chunk_size = chunk_size
+        self.min_steal_size = min_steal_size
+        self.completed_file = completed_file
+
+        completed_ranges = self._load_completed_ranges()
+        self.pending_chunks = collections.deque()
+        first_index = high_index if is_descending else low_index
+        while low_index <= first_index <= high_index:
+            chunk_number = self._chunk_number_of(first_index)
+            if is_descending:
+                last_index = max(chunk_number * chunk_size, low_index)
+            else:
+                last_index = min((chunk_number + 1) * chunk_size - 1, high_index)
+            if (first_index, last_index) not in completed_ranges:
+                self.pending_chunks.append(_Chunk(first_index, last_index))
+            first_index = last_index + self.step
+
+        self.active_chunks: Dict[int, _Chunk] = {}
+        self.leases: Dict[str, _Lease] = {}
+        self.completed_chunk_count = 0
+
+    def _load_completed_ranges(self) -> Set[Tuple[int, int]]:
+        if not self.completed_file or not os.path.exists(self.completed_file):
+            return set()
+
+        with open(self.completed_file, "r") as f:
+            completed = [json.loads(line) for line in f if line.strip()]
+        logger.info("[LedgerRangeScheduler] skipping %d completed chunk(s)", len(completed))
+        return {(c["first_index"], c["last_index"]) for c in completed}
+
+    def _chunk_number_of(self,
+                         index: int,
+                         ) -> int:
+        return index // self.chunk_size
+
+    @staticmethod
+    def _remaining_of(lease: _Lease) -> int:
+        return abs(lease.last_index - lease.next_index) + 1 if lease.next_index is not None else 0
+
+    def _lease(self,
+               worker_id: str,
+               ) -> Optional[_Lease]:
+        if self.pending_chunks:
+            chunk = self.pending_chunks.popleft()
+            self.active_chunks[self._chunk_number_of(chunk.first_index)] = chunk
+            return _Lease(chunk, chunk.first_index, chunk.last_index)
+
+        # steal the second half of the largest lease
+        victim = max(self.leases.values(), key=self._remaining_of, default=None)
+        if victim is None or self._remaining_of(victim) < self.min_steal_size:
+            return None
+
+        remaining_count = self._remaining_of(victim)
+        split_index = victim.next_index + self.step * (remaining_count // 2)
+        stolen = _Lease(victim.chunk, split_index, victim.last_index)
+        victim.last_index = split_index - self.step
+        logger.debug(
+            "[LedgerRangeScheduler] worker '%s' stole [%d, %d]",
+            worker_id,
+            stolen.next_index,
+            stolen.last_index,
+        )
+        return stolen
+
+    def next_index(self,
+                   worker_id: str,
+                   ) -> Optional[int]:
+        """
+        The next index for the worker, or None once the whole range
+        has been handed out.
+        """
+        lease = self.leases.get(worker_id)
+        if lease is None or lease.next_index is None:
+            lease = self._lease(worker_id)
+            if lease is None:
+                self.leases.pop(worker_id, None)
+                return None
+            self.leases[worker_id] = lease
+
+        index = lease.next_index
+        lease.next_index = None if index == lease.last_index else index + self.step
+        return index
+
+    def complete(self,
+                 index: int,
+                 ):
+        chunk = self.active_chunks.get(self._chunk_number_of(index))
+        if chunk is None:
+            return
+
+        chunk.completed_indices.add(index)
+        if len(chunk.completed_indices) < chunk.size:
+            return
+
+        del self.active_chunks[self._chunk_number_of(index)]
+        self.completed_chunk_count += 1
+        if self.completed_file:
+            with open(self.completed_file, "a") as f:
+                f.write(json.dumps({
+                    "first_index": chunk.first_index,
+                    "last_index": chunk.last_index,
+                }) + "\n")
+
+    def is_done(self) -> bool:
+        return not self.pending_chunks and not self.active_chunks
+
+
+class LedgerRangeDataSource(DataSource):
+    """
+    One worker of a LedgerRangeScheduler. Indices are pulled from the
+    scheduler on demand so that the unprocessed ones stay stealable.
+    """
+
+    def __init__(self,
+                 scheduler: LedgerRangeScheduler,
+                 worker_id: str,
+                 ):
+        self.scheduler = scheduler
+        self.worker_id = worker_id
+        self.is_stop = False
+
+    def start(self):
+        pass
+
+    def stop(self):
+        self.is_stop = True
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.is_stop:
+            raise StopAsyncIteration
+
+        index = self.scheduler.next_index(self.worker_id)
+        if index is None:
+            self.is_stop = True
+            raise StopAsyncIteration
+
+        # let the other workers pull too
+        await asyncio.sleep(0)
+        return index
@@ -0,0 +1,148 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Dict
+
+import aiofiles
+from xrpl.models.requests.request import Request
+
+from ekspiper.util.callable import RetryExhaustedError
+from .data import DataSource, DataSink
+
+logger = logging.getLogger(__name__)
+
+# entries written as the dict of an xrpl-py request (ie. BookOffers)
+REQUEST_ENTRY_TYPE = "xrpl_request"
+
+
+def _to_serializable(value: Any) -> Any:
+    # xrpl.models requests (ie. BookOffers) know how to turn into a dict
+    if hasattr(value, "to_dict"):
+        return value.to_dict()
+    return str(value)
+
+
+def build_dead_letter(entry: Any,
+                      error: Exception,
+                      flow: str = "",
+                      stage: str = "",
+                      ) -> Dict[str, Any]:
+    attempt_count = error.attempt_count if isinstance(error, RetryExhaustedError) else 1
+    last_error = error.last_error if isinstance(error, RetryExhaustedError) and error.last_error else error
+    return {
+        "time": time.time(),
+        "flow": flow,
+        "stage": stage,
+        "attempt_count": attempt_count,
+        "error": "%s: %s" % (type(last_error).__name__, last_error),
+        "entry": entry,
+        "entry_type": REQUEST_ENTRY_TYPE if isinstance(entry, Request) else None,
+    }
+
+
+def entry_of(dead_letter: Dict[str, Any]) -> Any:
+    """
+    The entry of a dead letter read back from the log, rebuilt into the
+    xrpl-py request it was written from.
+    """
+    entry = dead_letter.get("entry")
+    if dead_letter.get("entry_type") == REQUEST_ENTRY_TYPE:
+        return Request.from_dict(entry)
+    return entry
+
+
+class DeadLetterLog(DataSink):
+    """
+    Append-only log of the messages that could not be processed,
+    one JSON document per line.
+    """
+
+    def __init__(self,
+                 file: str,
+                 ):
+        self.file = file
+        self.lock = asyncio.Lock()
+
+    async def put(self,
+                  entry: Dict[str, Any],
+                  ):
+        line = json.dumps(entry, default=_to_serializable) + "\n"
+        async with self.lock:
+            async with aiofiles.open(self.file, mode="a") as f:
+                await f.write(line)
+
+
+class DeadLetterDataSource(DataSource):
+    """
+    Reads the entries back from a dead-letter log at a controlled rate,
+    optionally only the ones of a given flow and/or stage.
+    """
+
+    def __init__(self,
+                 file: str,
+                 rate_per_s: float = 10,
+                 flow: str = None,
+                 stage: str = None,
+                 ):
+        self.file = file
+        self.rate_per_s = rate_per_s
+        self.flow = flow
+        self.stage = stage
+
+        self.async_queue = asyncio.Queue(maxsize=1)
+        self.is_stop = False
+        self.populate_task = None
+
+    def start(self):
+        self.populate_task = asyncio.create_task(self._start())
+
+    async def _start(self):
+        try:
+            async with aiofiles.open(self.file, mode="r") as f:
+                async for line in f:
+                    if self.is_stop:
+                        break
+                    if not line.strip():
+                        continue
+
+                    try:
+                        dead_letter = json.loads(line)
+                    except Exception as e:
+                        logger.error("[DeadLetterDataSource] skipping malformed line: %s", e)
+                        continue
+
+                    if self.flow and dead_letter.get("flow") != self.flow:
+                        continue
+                    if self.stage and dead_letter.get("stage") != self.stage:
+                        continue
+
+                    try:
+                        entry = entry_of(dead_letter)
+                    except Exception as e:
+                        logger.error("[DeadLetterDataSource] cannot rebuild the entry, replaying it as is: %s", e)
+                        entry = dead_letter.get("entry")
+
+                    await self.async_queue.put(entry)
+                    await asyncio.sleep(1 / self.rate_per_s)
+        finally:
+            self.is_stop = True
+
+    def stop(self):
+        self.is_stop = True
+        if self.populate_task:
+            self.populate_task.cancel()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while True:
+            if self.is_stop and self.async_queue.empty():
+                raise StopAsyncIteration
+
+            try:
+                # wake up once in a while to notice the end of the log
+                return await asyncio.wait_for(self.async_queue.get(), 1)
+            except asyncio.TimeoutError:
+                continue
@@ -0,0 +1,274 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import List
+
+from xrpl.asyncio.clients.async_client import AsyncClient
+from xrpl.models.requests import Ledger, ServerInfo
+from xrpl.models.requests.request import Request
+from xrpl.models.response import Response
+
+from ekspiper.connect.rpc import BatchNotSupportedError
+from ekspiper.metric.prom import EndpointPoolMetrics
+
+logger = logging.getLogger(__name__)
+
+# errors telling that the node, not the request, is the problem
+ENDPOINT_ERRORS = {"slowDown", "tooBusy", "noNetwork", "noCurrent", "noClosed", "amendmentBlocked"}
+
+
+class _Endpoint:
+    def __init__(self,
+                 client: AsyncClient,
+                 ):
+        self.client = client
+        self.outstanding_count = 0
+        # moving average of the response time
+        self.latency_s = 0.0
+        self.failure_count = 0
+        self.is_ejected = False
+        # what has to succeed before the endpoint is taken back
+        self.probe_request: Request = None
+
+
+class EndpointPoolClient(AsyncClient):
+    """
+    Spreads the requests over the healthy endpoints of a pool, picking the
+    one with the fewest requests outstanding; ties go to the lowest
+    average latency.
+
+    A request failing on an endpoint is tried on the next one. An endpoint
+    is ejected after `max_failure_count` consecutive failures, or at once
+    when it answers `lgrNotFound` for a historical ledger (ie. a node
+    without the full history), one more than `historical_margin_ledgers`
+    behind the latest validated ledger. The latest validated ledger is
+    read from `server_info`, before the first `lgrNotFound` is judged and
+    then every `probe_interval_s`. The ejected endpoints are probed in the
+    background as often and taken back once they answer; a node that
+    missed a ledger has to serve that ledger to come back.
+    """
+
+    def __init__(self,
+                 clients: List[AsyncClient],
+                 name: str = "",
+                 max_failure_count: int = 3,
+                 probe_interval_s: float = 10,
+                 historical_margin_ledgers: int = 10,
+                 latency_decay: float = 0.2,
+                 metrics: EndpointPoolMetrics = None,
+                 ):
+        if not clients:
+            raise ValueError("[EndpointPoolClient] the pool needs at least one endpoint")
+
+        super().__init__(clients[0].url)
+        self.name = name
+        self.max_failure_count = max_failure_count
+        self.probe_interval_s = probe_interval_s
+        self.historical_margin_ledgers = historical_margin_ledgers
+        self.latency_decay = latency_decay
+        self.metrics = metrics
+
+        self.endpoints = [_Endpoint(c) for c in clients]
+        # latest validated ledger, as reported by server_info
+        self.latest_ledger_index = 0
+        self.refresh_lock = asyncio.Lock()
+        self.probe_task = None
+
+        if self.metrics:
+            for endpoint in self.endpoints:
+                self.metrics.healthy_gauge.labels(self.name, endpoint.client.url).set(1)
+
+    def _ensure_started(self):
+        if self.probe_task is None:
+            self.probe_task = asyncio.create_task(self._aprobe_ejected())
+
+    async def _arefresh_latest_ledger_index(self):
+        async with self.refresh_lock:
+            endpoint = self._select([])
+            try:
+                response = await self._arequest_endpoint(endpoint, ServerInfo())
+            except Exception as e:
+                logger.debug("[EndpointPoolClient:%s] server_info of %s failed: %s", self.name, endpoint.client.url, e)
+                return
+
+            validated_ledger = response.result.get("info", {}).get("validated_ledger") or {}
+            seq = validated_ledger.get("seq")
+            if isinstance(seq, int) and seq > self.latest_ledger_index:
+                self.latest_ledger_index = seq
+
+    def _select(self,
+                tried: List[_Endpoint],
+                ) -> _Endpoint:
+        candidates = [e for e in self.endpoints if e not in tried and not e.is_ejected]
+        if not candidates:
+            # better an ejected endpoint than no answer at all
+            candidates = [e for e in self.endpoints if e not in tried]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda e: (e.outstanding_count, e.latency_s))
+
+    def _is_historical(self,
+                       request: Request,
+                       ) -> bool:
+        ledger_index = getattr(request, "ledger_index", None)
+        return isinstance(ledger_index, int) and \
+            ledger_index < self.latest_ledger_index - self.historical_margin_ledgers
+
+    def _eject(self,
+               endpoint: _Endpoint,
+               probe_request: Request,
+               reason: str,
+               ):
+        endpoint.probe_request = probe_request
+        if endpoint.is_ejected:
+            return
+
+        endpoint.is_ejected = True
+        logger.warning("[EndpointPoolClient:%s] ejecting %s: %s", self.name, endpoint.client.url, reason)
+        if self.metrics:
+            self.metrics.healthy_gauge.labels(self.name, endpoint.client.url).set(0)
+            self.metrics.ejected_counter.labels(self.name, endpoint.client.url).inc()
+
+    def _readmit(self,
+                 endpoint: _Endpoint,
+                 ):
+        endpoint.is_ejected = False
+        endpoint.failure_count = 0
+        endpoint.probe_request = None
+        logger.info("[EndpointPoolClient:%s] %s is back in rotation", self.name, endpoint.client.url)
+        if self.metrics:
+            self.metrics.healthy_gauge.labels(self.name, endpoint.client.url).set(1)
+
+    def _record_failure(self,
+                        endpoint: _Endpoint,
+                        reason: str,
+                        ):
+        endpoint.failure_count += 1
+        if endpoint.failure_count >= self.max_failure_count:
+            self._eject(endpoint, ServerInfo(), reason)
+
+    def _record_success(self,
+                        endpoint: _Endpoint,
+                        latency_s: float,
+                        ):
+        endpoint.failure_count = 0
+        endpoint.latency_s += self.latency_decay * (latency_s - endpoint.latency_s)
+
+    async def _arequest_endpoint(self,
+                                 endpoint: _Endpoint,
+                                 request: Request,
+                                 ) -> Response:
+        endpoint.outstanding_count += 1
+        if self.metrics:
+            self.metrics.outstanding_gauge.labels(self.name, endpoint.client.url).inc()
+        try:
+            return await endpoint.client.request_impl(request)
+        finally:
+            endpoint.outstanding_count -= 1
+            if self.metrics:
+                self.metrics.outstanding_gauge.labels(self.name, endpoint.client.url).dec()
+
+    async def request_impl(self,
+                           request: Request,
+                           ) -> Response:
+        self._ensure_started()
+        tried: List[_Endpoint] = []
+        response = None
+        last_error = None
+
+        while True:
+            endpoint = self._select(tried)
+            if endpoint is None:
+                break
+            tried.append(endpoint)
+
+            start_time = asyncio.get_running_loop().time()
+            try:
+                response = await self._arequest_endpoint(endpoint, request)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                last_error = e
+                self._record_failure(endpoint, "%s: %s" % (type(e).__name__, e))
+                continue
+
+            error = None if response.is_successful() else response.result.get("error")
+            if error == "lgrNotFound":
+                if not self.latest_ledger_index:
+                    await self._arefresh_latest_ledger_index()
+                # a recent ledger may just not have reached the node yet
+                if self._is_historical(request):
+                    self._eject(endpoint, Ledger(ledger_index=request.ledger_index), "lgrNotFound")
+                continue
+            if error in ENDPOINT_ERRORS:
+                self._record_failure(endpoint, error)
+                continue
+
+            self._record_success(endpoint, asyncio.get_running_loop().time() - start_time)
+            return response
+
+        # every endpoint failed; hand back the last answer if there is one
+        if response is not None:
+            return response
+        raise last_error
+
+    async def request_batch_impl(self,
+                                 requests: List[Request],
+                                 ) -> List[Response]:
+        """
+        Sends the batch to the least busy endpoint taking batches, the next
+        one when it fails. The responses are not checked one by one.
+        """
+        self._ensure_started()
+        tried: List[_Endpoint] = []
+        last_error = BatchNotSupportedError("[EndpointPoolClient:%s] no endpoint takes batches" % self.name)
+
+        while True:
+            endpoint = self._select(tried)
+            if endpoint is None:
+                raise last_error
+            tried.append(endpoint)
+            if not hasattr(endpoint.client, "request_batch_impl"):
+                continue
+
+            endpoint.outstanding_count += 1
+            try:
+                return await endpoint.client.request_batch_impl(requests)
+            except (asyncio.CancelledError, BatchNotSupportedError):
+                raise
+            except Exception as e:
+                last_error = e
+                self._record_failure(endpoint, "%s: %s" % (type(e).__name__, e))
+            finally:
+                endpoint.outstanding_count -= 1
+
+    async def _aprobe(self,
+                      endpoint: _Endpoint,
+                      ):
+        try:
+            response = await self._arequest_endpoint(endpoint, endpoint.probe_request)
+        except Exception as e:
+            logger.debug("[EndpointPoolClient:%s] probe of %s failed: %s", self.name, endpoint.client.url, e)
+            return
+
+        if response.is_successful():
+            self._readmit(endpoint)
+
+    async def _aprobe_ejected(self):
+        while True:
+            await self._arefresh_latest_ledger_index()
+            await asyncio.sleep(self.probe_interval_s)
+            ejected = [e for e in self.endpoints if e.is_ejected]
+            if ejected:
+                await asyncio.gather(*[self._aprobe(e) for e in ejected])
+
+    async def aclose(self):
+        if self.probe_task:
+            self.probe_task.cancel()
+            await asyncio.gather(self.probe_task, return_exceptions=True)
+            self.probe_task = None
+
+        for endpoint in self.endpoints:
+            if hasattr(endpoint.client, "aclose"):
+                await endpoint.client.aclose()
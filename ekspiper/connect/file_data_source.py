@@ -11,8 +11,9 @@ logger = logging.getLogger(__name__)
 class FileDataSource(DataSource):
     def __init__(self,
                  file: str,
+                 maxsize: int = 0,
                  ):
-        self.async_queue = asyncio.Queue()
+        self.async_queue = asyncio.Queue(maxsize=maxsize)
         self.is_stop = False
         self.populate_task = None
         self.file = file
@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections import deque
+from typing import List
+
+from xrpl.asyncio.clients.async_client import AsyncClient
+from xrpl.models.requests.request import Request
+from xrpl.models.response import Response
+
+from ekspiper.connect.rpc import BatchNotSupportedError
+from ekspiper.metric.prom import HedgeMetrics
+from ekspiper.util.callable import RetryBudget
+
+logger = logging.getLogger(__name__)
+
+
+class HedgedClient(AsyncClient):
+    """
+    Sends a duplicate of a request still unanswered after the `percentile`
+    latency of the recent requests, takes the first good answer and
+    cancels the other one. The duplicates are capped to `max_hedge_ratio`
+    of the requests.
+
+    The duplicate goes through the same client: a pooled client sends it
+    on another connection, an endpoint pool to its least busy node.
+
+    The latency kept is the one the caller sees, from the original request
+    to the answer. The failed, timed out and cancelled requests are kept
+    too, with the time waited so far, so that a slow node cannot hide its
+    tail behind the hedges that beat it.
+    """
+
+    def __init__(self,
+                 rpc_client: AsyncClient,
+                 percentile: float = 0.95,
+                 initial_delay_s: float = 1.0,
+                 min_delay_s: float = 0.05,
+                 max_hedge_ratio: float = 0.1,
+                 window_size: int = 200,
+                 min_sample_count: int = 20,
+                 metrics: HedgeMetrics = None,
+                 ):
+        super().__init__(rpc_client.url)
+        if not 0 < percentile < 1:
+            raise ValueError("percentile must be between 0 and 1 but got '%s'" % percentile)
+
+        self.rpc_client = rpc_client
+        self.percentile = percentile
+        self.initial_delay_s = initial_delay_s
+        self.min_delay_s = min_delay_s
+        self.min_sample_count = min_sample_count
+        self.metrics = metrics
+
+        self.latencies = deque(maxlen=window_size)
+        # every request earns `max_hedge_ratio` of a hedge; the small
+        # balance keeps a burst of slow responses within the ratio
+        self.hedge_budget = RetryBudget(
+            ratio=max_hedge_ratio,
+            min_retries_per_s=0,
+            max_balance=max(max_hedge_ratio * 20, 1),
+        )
+
+    def hedge_delay_s(self) -> float:
+        if len(self.latencies) < self.min_sample_count:
+            return self.initial_delay_s
+
+        latencies = sorted(self.latencies)
+        return max(latencies[min(int(len(latencies) * self.percentile), len(latencies) - 1)], self.min_delay_s)
+
+    @staticmethod
+    async def _afirst_good(tasks: List[asyncio.Task]) -> asyncio.Task:
+        pending = set(tasks)
+        last_task = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                last_task = task
+                if task.exception() is None and task.result().is_successful():
+                    return task
+
+        # none of them answered well; surface the last error
+        return last_task
+
+    async def request_impl(self,
+                           request: Request,
+                           ) -> Response:
+        self.hedge_budget.record_request()
+        delay_s = self.hedge_delay_s()
+        if self.metrics:
+            self.metrics.delay_gauge.set(delay_s)
+
+        start_time = asyncio.get_running_loop().time()
+        tasks = [asyncio.create_task(self.rpc_client.request_impl(request))]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay_s)
+            if not done and self.hedge_budget.try_withdraw():
+                logger.debug("[HedgedClient] no answer after %.3fs, hedging %s", delay_s, request.method)
+                tasks.append(asyncio.create_task(self.rpc_client.request_impl(request)))
+                if self.metrics:
+                    self.metrics.hedged_counter.inc()
+
+            winner = await self._afirst_good(tasks)
+            response = winner.result()
+            if winner is not tasks[0] and self.metrics:
+                self.metrics.hedge_won_counter.inc()
+            return response
+        finally:
+            self.latencies.append(asyncio.get_running_loop().time() - start_time)
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def request_batch_impl(self,
+                                 requests: List[Request],
+                                 ) -> List[Response]:
+        # the batches are not hedged
+        if not hasattr(self.rpc_client, "request_batch_impl"):
+            raise BatchNotSupportedError("[HedgedClient] %s cannot send batches" % type(self.rpc_client).__name__)
+        return await self.rpc_client.request_batch_impl(requests)
+
+    async def aclose(self):
+        if hasattr(self.rpc_client, "aclose"):
+            await self.rpc_client.aclose()
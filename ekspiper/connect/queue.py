@@ -1,28 +1,73 @@
 import asyncio
+import collections
 import logging
 import sys
+import time
 import traceback
-from typing import Callable
+from typing import Any, Callable
 
+from ekspiper.metric.prom import QueueMetrics
+from ekspiper.util.size import approximate_size_of
 from .data import DataSource, DataSink
 
 logger = logging.getLogger(__name__)
 
 
 class QueueSourceSink(DataSource, DataSink):
+    """
+    Queue glueing the flows together.
+
+    With `maxsize` (entry count) and/or `max_bytes` (approximate size of
+    the queued entries) set, producers block once the queue reaches either
+    high watermark and are released when it drains back below
+    `low_watermark_ratio` of it.
+    """
+
     def __init__(self,
                  async_queue: asyncio.Queue = None,
                  name: str = "",
                  done_callback: Callable[[], None] = None,
+                 maxsize: int = 0,
+                 max_bytes: int = 0,
+                 low_watermark_ratio: float = 0.8,
+                 size_func: Callable[[Any], int] = approximate_size_of,
+                 metrics: QueueMetrics = None,
                  ):
         self.name = name
         self.async_queue = async_queue if async_queue else asyncio.Queue()
         self.is_stop = False
         self.done_callback = done_callback
 
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.low_watermark_size = int(maxsize * low_watermark_ratio)
+        self.low_watermark_bytes = int(max_bytes * low_watermark_ratio)
+        self.size_func = size_func
+        self.metrics = metrics
+
+        # sizes of the entries put through `put`; they are always
+        # the tail of the queue
+        self.entry_sizes = collections.deque()
+        self.size_bytes = 0
+        self.is_accepting = asyncio.Event()
+        self.is_accepting.set()
+
     def stop(self):
         self.is_stop = True
 
+    def _is_above_high_watermark(self) -> bool:
+        return (self.maxsize > 0 and self.async_queue.qsize() >= self.maxsize) or \
+               (self.max_bytes > 0 and self.size_bytes >= self.max_bytes)
+
+    def _is_below_low_watermark(self) -> bool:
+        return (self.maxsize <= 0 or self.async_queue.qsize() <= self.low_watermark_size) and \
+               (self.max_bytes <= 0 or self.size_bytes <= self.low_watermark_bytes)
+
+    def _update_metrics(self):
+        if self.metrics:
+            self.metrics.depth_gauge.set(self.async_queue.qsize())
+            self.metrics.size_bytes_gauge.set(self.size_bytes)
+
     def __aiter__(self):
         return self
 
@@ -41,9 +86,37 @@ class QueueSourceSink(DataSource, DataSink):
             finally:
                 raise StopAsyncIteration
 
-        return await self.async_queue.get()
+        entry = await self.async_queue.get()
+
+        # the head was put through `put` only if every queued entry was
+        if len(self.entry_sizes) > self.async_queue.qsize():
+            self.size_bytes -= self.entry_sizes.popleft()
+
+        if not self.is_accepting.is_set() and self._is_below_low_watermark():
+            self.is_accepting.set()
+
+        self._update_metrics()
+        return entry
 
     async def put(self,
                   entry,
                   ):
+        if not self.is_accepting.is_set():
+            start_time = time.perf_counter()
+            # another producer may have filled it up again in the meantime
+            while not self.is_accepting.is_set():
+                await self.is_accepting.wait()
+            if self.metrics:
+                self.metrics.blocked_put_counter.inc()
+                self.metrics.blocked_seconds_counter.inc(time.perf_counter() - start_time)
+
+        entry_size = self.size_func(entry) if self.max_bytes > 0 else 0
         await self.async_queue.put(entry)
+        self.entry_sizes.append(entry_size)
+        self.size_bytes += entry_size
+
+        if self._is_above_high_watermark():
+            logger.debug("[QueueSourceSink:%s] reached the high watermark", self.name)
+            self.is_accepting.clear()
+
+        self._update_metrics()
@@ -0,0 +1,189 @@
+import asyncio
+import collections
+import logging
+import sys
+import traceback
+from typing import Any, Callable, Dict
+
+from ekspiper.metric.prom import ReorderBufferMetrics
+from .data import DataSource, DataSink
+
+logger = logging.getLogger(__name__)
+
+
+def ledger_index_key(entry: Any) -> int:
+    """
+    Extract the ledger index from either a ledger index or
+    a ledger response result.
+    """
+    if type(entry) == int:
+        return entry
+
+    ledger_index = entry.get("ledger_index") or entry.get("ledger", {}).get("ledger_index")
+    if ledger_index is None:
+        raise ValueError("[ReorderSourceSink] missing ledger index: %s" % entry)
+
+    return int(ledger_index)
+
+
+class ReorderSourceSink(DataSource, DataSink):
+    """
+    Accepts entries in any order and releases them in key sequence.
+
+    Entries ahead of the next expected key are held back in a bounded
+    buffer. When the next key does not show up within `gap_timeout_s`,
+    the gap is skipped and the buffer resumes from the closest key it holds.
+    Entries arriving after their key has been passed are released right away.
+
+    Without a `start_key`, the first key is the one `seed` is given, or else
+    the first key put (which, with concurrent producers, may not be the lowest).
+    """
+
+    def __init__(self,
+                 key_func: Callable[[Any], int] = ledger_index_key,
+                 start_key: int = None,
+                 incr_by: int = 1,
+                 max_buffer_size: int = 1000,
+                 gap_timeout_s: float = 30,
+                 name: str = "",
+                 done_callback: Callable[[], None] = None,
+                 metrics: ReorderBufferMetrics = None,
+                 ):
+        if incr_by not in [1, -1]:
+            raise ValueError("incr_by must be either 1 or -1 but got '%s'" % incr_by)
+
+        self.key_func = key_func
+        self.next_key = start_key
+        self.incr_by = incr_by
+        self.max_buffer_size = max_buffer_size
+        self.gap_timeout_s = gap_timeout_s
+        self.name = name
+        self.done_callback = done_callback
+        self.metrics = metrics
+
+        self.buffer: Dict[int, Any] = {}
+        self.ready = collections.deque()
+        self.gap_since = None
+        self.is_stop = False
+        self._changed = asyncio.Event()
+
+    def seed(self,
+             key: int,
+             ):
+        """
+        Sets the key to release first, unless it is known already.
+        """
+        if self.next_key is None:
+            logger.info("[ReorderSourceSink:%s] starting from key '%d'", self.name, key)
+            self.next_key = key
+
+    def stop(self):
+        self.is_stop = True
+        self._notify()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def _is_behind(self, key: int) -> bool:
+        return (key - self.next_key) * self.incr_by < 0
+
+    def _is_full(self) -> bool:
+        return len(self.buffer) + len(self.ready) >= self.max_buffer_size
+
+    def _release(self):
+        is_advanced = False
+        while self.next_key in self.buffer:
+            self.ready.append(self.buffer.pop(self.next_key))
+            self.next_key += self.incr_by
+            is_advanced = True
+
+        if not self.buffer:
+            self.gap_since = None
+        elif is_advanced or self.gap_since is None:
+            self.gap_since = asyncio.get_running_loop().time()
+
+    def _skip_gap(self):
+        target_key = min(self.buffer) if self.incr_by > 0 else max(self.buffer)
+        skipped_count = abs(target_key - self.next_key)
+        logger.warning(
+            "[ReorderSourceSink:%s] skipping %d key(s) from '%d' to '%d'",
+            self.name,
+            skipped_count,
+            self.next_key,
+            target_key,
+        )
+        if self.metrics:
+            self.metrics.gap_skipped_counter.inc(skipped_count)
+
+        self.next_key = target_key
+        self._release()
+
+    def _update_metrics(self):
+        if self.metrics:
+            self.metrics.buffer_depth_gauge.set(len(self.buffer))
+            self.metrics.ready_depth_gauge.set(len(self.ready))
+
+    async def put(self,
+                  entry: Any,
+                  ):
+        key = self.key_func(entry)
+
+        # block while full unless the consumer is waiting for this very key
+        while self._is_full() and not (key == self.next_key and not self.ready):
+            await self._changed.wait()
+
+        if self.next_key is None:
+            self.next_key = key
+
+        if self._is_behind(key) or key in self.buffer:
+            logger.warning(
+                "[ReorderSourceSink:%s] releasing late or duplicate key '%d' (next key '%d')",
+                self.name,
+                key,
+                self.next_key,
+            )
+            if self.metrics:
+                self.metrics.late_entry_counter.inc()
+            self.ready.append(entry)
+        else:
+            self.buffer[key] = entry
+            self._release()
+
+        self._update_metrics()
+        self._notify()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self.ready:
+            if self.is_stop:
+                if not self.buffer:
+                    try:
+                        if self.done_callback:
+                            self.done_callback()
+                    except Exception as e:
+                        traceback.print_exc(file=sys.stdout)
+                    finally:
+                        raise StopAsyncIteration
+
+                # flush the remaining entries in order
+                self._skip_gap()
+                continue
+
+            changed = self._changed
+            timeout_s = None
+            if self.buffer:
+                elapsed_s = asyncio.get_running_loop().time() - self.gap_since
+                timeout_s = max(self.gap_timeout_s - elapsed_s, 0)
+
+            try:
+                await asyncio.wait_for(changed.wait(), timeout_s)
+            except asyncio.TimeoutError:
+                self._skip_gap()
+
+        entry = self.ready.popleft()
+        self._update_metrics()
+        self._notify()
+        return entry
@@ -0,0 +1,222 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+from typing import Dict, List
+
+import aiohttp
+from xrpl.asyncio.clients import XRPLRequestFailureException
+from xrpl.asyncio.clients.async_client import AsyncClient
+from xrpl.asyncio.clients.utils import json_to_response, request_to_json_rpc
+from xrpl.models.requests.request import Request
+from xrpl.models.response import Response
+
+from ekspiper.metric.prom import ConnectionMetrics, RateLimiterMetrics
+from ekspiper.util.callable import RPCResponseError
+from ekspiper.util.rate_limit import TokenBucketRateLimiter, get_rate_limiter
+
+logger = logging.getLogger(__name__)
+
+# how an endpoint without the `batch` method answers it
+BATCH_REFUSED_STATUS_CODES = {400, 404, 405}
+BATCH_REFUSED_ERRORS = {"unknownCmd"}
+
+
+class BatchNotSupportedError(RuntimeError):
+    pass
+
+
+class RateLimitedClient(AsyncClient):
+    """
+    Wraps any xrpl-py async client so that its requests go through a
+    rate limiter; by default the one shared by every client of the URL,
+    recording into `metrics`.
+    """
+
+    def __init__(self,
+                 rpc_client: AsyncClient,
+                 rate_limiter: TokenBucketRateLimiter = None,
+                 metrics: RateLimiterMetrics = None,
+                 ):
+        super().__init__(rpc_client.url)
+        self.rpc_client = rpc_client
+        self.rate_limiter = rate_limiter if rate_limiter else get_rate_limiter(rpc_client.url, metrics=metrics)
+
+    async def request_impl(self,
+                           request: Request,
+                           ) -> Response:
+        await self.rate_limiter.acquire()
+        return await self.rpc_client.request_impl(request)
+
+    async def request_batch_impl(self,
+                                 requests: List[Request],
+                                 ) -> List[Response]:
+        if not hasattr(self.rpc_client, "request_batch_impl"):
+            raise BatchNotSupportedError("[RateLimitedClient] %s cannot send batches" % type(self.rpc_client).__name__)
+
+        for _ in requests:
+            await self.rate_limiter.acquire()
+        return await self.rpc_client.request_batch_impl(requests)
+
+    async def aclose(self):
+        if hasattr(self.rpc_client, "aclose"):
+            await self.rpc_client.aclose()
+
+
+def _build_trace_config(metrics: ConnectionMetrics) -> aiohttp.TraceConfig:
+    trace_config = aiohttp.TraceConfig()
+
+    async def on_connection_create_start(session, trace_config_ctx, params):
+        trace_config_ctx.connection_start_time = asyncio.get_running_loop().time()
+
+    async def on_connection_create_end(session, trace_config_ctx, params):
+        metrics.created_counter.inc()
+        metrics.create_latency.observe(asyncio.get_running_loop().time() - trace_config_ctx.connection_start_time)
+
+    async def on_connection_reuseconn(session, trace_config_ctx, params):
+        metrics.reused_counter.inc()
+
+    trace_config.on_connection_create_start.append(on_connection_create_start)
+    trace_config.on_connection_create_end.append(on_connection_create_end)
+    trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+    return trace_config
+
+
+class PooledJsonRpcClient(AsyncClient):
+    """
+    JSON-RPC client keeping its connections alive in one pool, instead of
+    xrpl-py's AsyncJsonRpcClient opening a new HTTP client (and TCP/TLS
+    handshake) for every request.
+
+    The session is created on first use in the running event loop, and
+    re-created if the client is used from another loop later on.
+    """
+
+    def __init__(self,
+                 url: str,
+                 limit_per_host: int = 20,
+                 keepalive_timeout_s: float = 60,
+                 timeout_s: float = 10,
+                 metrics: ConnectionMetrics = None,
+                 ):
+        super().__init__(url)
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout_s = keepalive_timeout_s
+        self.timeout_s = timeout_s
+        self.metrics = metrics
+
+        self.session: aiohttp.ClientSession = None
+        self.session_loop = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        if self.session is None or self.session.closed or self.session_loop is not loop:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit_per_host=self.limit_per_host,
+                    keepalive_timeout=self.keepalive_timeout_s,
+                    ttl_dns_cache=300,
+                ),
+                timeout=aiohttp.ClientTimeout(total=self.timeout_s),
+                trace_configs=[_build_trace_config(self.metrics)] if self.metrics else None,
+            )
+            self.session_loop = loop
+        return self.session
+
+    async def request_impl(self,
+                           request: Request,
+                           ) -> Response:
+        async with self._get_session().post(self.url, json=request_to_json_rpc(request)) as response:
+            body = await response.text()
+            try:
+                return json_to_response(json.loads(body))
+            except json.JSONDecodeError:
+                raise XRPLRequestFailureException({
+                    "error": response.status,
+                    "error_message": body,
+                })
+
+    async def request_batch_impl(self,
+                                 requests: List[Request],
+                                 ) -> List[Response]:
+        """
+        Sends the requests as one rippled `batch` request (the requests as
+        its params). Raises BatchNotSupportedError when the endpoint turns
+        the batch down (a 400/404/405 or an `unknownCmd`) or does not
+        answer with one response per request; a busy endpoint (a 429, a
+        5xx or a `slowDown`) fails like a single request would, to be
+        retried.
+        """
+        payload = {
+            "method": "batch",
+            "params": [request_to_json_rpc(r) for r in requests],
+        }
+        async with self._get_session().post(self.url, json=payload) as response:
+            body = await response.text()
+
+        if response.status in BATCH_REFUSED_STATUS_CODES:
+            raise BatchNotSupportedError("[PooledJsonRpcClient] %s turned the batch down (%d): %s" % (
+                self.url,
+                response.status,
+                body[:200],
+            ))
+
+        try:
+            results = json.loads(body) if response.status < 400 else None
+        except json.JSONDecodeError:
+            results = None
+        if results is None:
+            # ie. a 429, or a 502 page from the load balancer
+            raise XRPLRequestFailureException({
+                "error": response.status,
+                "error_message": body,
+            })
+
+        # ie. {"result": {"error": "tooBusy", ...}}
+        if isinstance(results, dict) and isinstance(results.get("result"), dict):
+            error = results["result"].get("error")
+            if error in BATCH_REFUSED_ERRORS:
+                raise BatchNotSupportedError("[PooledJsonRpcClient] %s turned the batch down: %s" % (
+                    self.url,
+                    error,
+                ))
+            raise RPCResponseError("[PooledJsonRpcClient] %s failed the batch: %s" % (
+                self.url,
+                body[:200],
+            ), error=error)
+
+        # rippled answers with the array of results, in the order of the requests
+        if isinstance(results, dict):
+            results = results.get("result")
+        if not isinstance(results, list) or len(results) != len(requests):
+            raise BatchNotSupportedError("[PooledJsonRpcClient] %s did not answer the batch: %s" % (
+                self.url,
+                body[:200],
+            ))
+
+        return [json_to_response(r if "result" in r else {"result": r}) for r in results]
+
+    async def aclose(self):
+        if self.session and not self.session.closed:
+            await self.session.close()
+
+
+_json_rpc_clients: Dict[str, PooledJsonRpcClient] = {}
+
+
+def get_json_rpc_client(url: str,
+                        metrics: ConnectionMetrics = None,
+                        ) -> PooledJsonRpcClient:
+    """
+    The pooled client shared by everything calling `url`. The `metrics`
+    are attached to it unless it already has some; they apply to the
+    sessions it opens from then on.
+    """
+    if url not in _json_rpc_clients:
+        _json_rpc_clients[url] = PooledJsonRpcClient(url)
+
+    rpc_client = _json_rpc_clients[url]
+    if metrics and not rpc_client.metrics:
+        rpc_client.metrics = metrics
+    return rpc_client
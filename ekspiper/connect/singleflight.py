@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import asyncio
+import collections
+import copy
+import json
+import logging
+from typing import Dict, List
+
+from xrpl.asyncio.clients.async_client import AsyncClient
+from xrpl.models.requests.request import Request
+from xrpl.models.response import Response
+
+from ekspiper.connect.rpc import BatchNotSupportedError
+from ekspiper.metric.prom import SingleflightMetrics
+
+logger = logging.getLogger(__name__)
+
+
+def request_key(request: Request) -> str:
+    """
+    What identifies a request, regardless of its id.
+    """
+    params = {k: v for k, v in request.to_dict().items() if k != "id"}
+    return json.dumps(params, sort_keys=True, default=str)
+
+
+def _copy_response(response: Response) -> Response:
+    return Response(
+        status=response.status,
+        result=copy.deepcopy(response.result),
+        id=response.id,
+        type=response.type,
+    )
+
+
+class _Flight:
+    def __init__(self):
+        self.task: asyncio.Task = None
+        self.waiter_count = 0
+        self.is_memoized = False
+
+
+class SingleflightClient(AsyncClient):
+    """
+    Coalesces identical requests: the ones sent while the same request is
+    in flight wait for its response instead of calling the endpoint again.
+    The validated answers about a fixed ledger (ie. `ledger_index` or
+    `ledger_hash` given) are also kept for `memo_ttl_s`, for the
+    duplicates arriving just after.
+
+    Every caller sharing a response gets its own copy of the result, so
+    that a processor modifying its message does not affect the others.
+    A request is only cancelled once all of its callers are.
+    """
+
+    def __init__(self,
+                 rpc_client: AsyncClient,
+                 memo_ttl_s: float = 2.0,
+                 max_memo_size: int = 1000,
+                 metrics: SingleflightMetrics = None,
+                 ):
+        super().__init__(rpc_client.url)
+        self.rpc_client = rpc_client
+        self.memo_ttl_s = memo_ttl_s
+        self.max_memo_size = max_memo_size
+        self.metrics = metrics
+
+        self.flights: Dict[str, _Flight] = {}
+        # key -> (expiry time, response), soonest expiry first
+        self.memo: collections.OrderedDict = collections.OrderedDict()
+        self.request_count = 0
+        self.coalesced_count = 0
+
+    @staticmethod
+    def _is_memoizable(request: Request,
+                       response: Response,
+                       ) -> bool:
+        is_fixed_ledger = isinstance(getattr(request, "ledger_index", None), int) or \
+            getattr(request, "ledger_hash", None) is not None
+        return is_fixed_ledger and response.is_successful() and response.result.get("validated") is True
+
+    def _get_memoized(self,
+                      key: str,
+                      ) -> Response:
+        now = asyncio.get_running_loop().time()
+        while self.memo and next(iter(self.memo.values()))[0] <= now:
+            self.memo.popitem(last=False)
+
+        memoized = self.memo.get(key)
+        return memoized[1] if memoized else None
+
+    def _memoize(self,
+                 key: str,
+                 response: Response,
+                 ):
+        self.memo.pop(key, None)
+        self.memo[key] = (asyncio.get_running_loop().time() + self.memo_ttl_s, response)
+        while len(self.memo) > self.max_memo_size:
+            self.memo.popitem(last=False)
+
+    def _record(self,
+                kind: str = None,
+                ):
+        self.request_count += 1
+        if kind:
+            self.coalesced_count += 1
+        if self.metrics:
+            self.metrics.request_counter.inc()
+            if kind:
+                self.metrics.coalesced_counter.labels(self.metrics.name, kind).inc()
+            self.metrics.dedup_ratio_gauge.set(self.coalesced_count / self.request_count)
+
+    def _land(self,
+              key: str,
+              flight: _Flight,
+              ):
+        if self.flights.get(key) is flight:
+            del self.flights[key]
+
+    async def _afly(self,
+                    key: str,
+                    request: Request,
+                    flight: _Flight,
+                    ) -> Response:
+        try:
+            response = await self.rpc_client.request_impl(request)
+        finally:
+            self._land(key, flight)
+
+        if self.memo_ttl_s > 0 and self._is_memoizable(request, response):
+            flight.is_memoized = True
+            self._memoize(key, response)
+        return response
+
+    async def request_impl(self,
+                           request: Request,
+                           ) -> Response:
+        key = request_key(request)
+        memoized = self._get_memoized(key)
+        if memoized:
+            self._record("memo")
+            return _copy_response(memoized)
+
+        flight = self.flights.get(key)
+        if flight:
+            logger.debug("[SingleflightClient] joining the %s request in flight", request.method)
+            self._record("in_flight")
+        else:
+            self._record()
+            flight = _Flight()
+            flight.task = asyncio.create_task(self._afly(key, request, flight))
+            self.flights[key] = flight
+
+        flight.waiter_count += 1
+        try:
+            response = await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            flight.waiter_count -= 1
+            if flight.waiter_count == 0 and not flight.task.done():
+                # nobody is waiting for it anymore
+                self._land(key, flight)
+                flight.task.cancel()
+            raise
+        flight.waiter_count -= 1
+
+        # the last one to wake up takes the original, unless the memo keeps it
+        if flight.waiter_count == 0 and not flight.is_memoized:
+            return response
+        return _copy_response(response)
+
+    async def request_batch_impl(self,
+                                 requests: List[Request],
+                                 ) -> List[Response]:
+        # the batches are not coalesced
+        if not hasattr(self.rpc_client, "request_batch_impl"):
+            raise BatchNotSupportedError("[SingleflightClient] %s cannot send batches" % type(self.rpc_client).__name__)
+        return await self.rpc_client.request_batch_impl(requests)
+
+    async def aclose(self):
+        if hasattr(self.rpc_client, "aclose"):
+            await self.rpc_client.aclose()
@@ -0,0 +1,201 @@
+from __future__ import annotations
+
+import asyncio
+import itertools
+import json
+import logging
+from typing import Any, Dict, List
+
+import websockets
+from xrpl.asyncio.clients.async_client import AsyncClient
+from xrpl.asyncio.clients.utils import request_to_websocket, websocket_to_response
+from xrpl.models.requests.request import Request
+from xrpl.models.response import Response
+
+from ekspiper.metric.prom import ConnectionMetrics
+
+logger = logging.getLogger(__name__)
+
+
+class _Connection:
+    def __init__(self,
+                 index: int,
+                 ):
+        self.index = index
+        self.websocket = None
+        self.is_connected = asyncio.Event()
+        self.in_flight_count = 0
+
+
+class _PendingRequest:
+    def __init__(self,
+                 message: Dict[str, Any],
+                 future: asyncio.Future,
+                 connection: _Connection,
+                 ):
+        self.message = message
+        self.future = future
+        self.connection = connection
+
+
+class MultiplexedWebsocketClient(AsyncClient):
+    """
+    Request/response client multiplexing the requests over `connection_count`
+    websocket connections, matching the responses back by request id.
+
+    Every connection reconnects on its own with an exponential backoff and
+    re-sends the requests that were still in flight on it. A request fails
+    with asyncio.TimeoutError after `request_timeout_s`, or with a
+    RuntimeError once the client is closed.
+    """
+
+    def __init__(self,
+                 url: str,
+                 connection_count: int = 2,
+                 request_timeout_s: float = 30,
+                 reconnect_delay_s: float = 1,
+                 max_reconnect_delay_s: float = 30,
+                 metrics: ConnectionMetrics = None,
+                 ):
+        super().__init__(url)
+        if connection_count < 1:
+            raise ValueError("connection_count must be at least 1 but got '%s'" % connection_count)
+
+        self.connection_count = connection_count
+        self.request_timeout_s = request_timeout_s
+        self.reconnect_delay_s = reconnect_delay_s
+        self.max_reconnect_delay_s = max_reconnect_delay_s
+        self.metrics = metrics
+
+        self.request_ids = itertools.count(1)
+        self.pending: Dict[int, _PendingRequest] = {}
+        self.connections: List[_Connection] = []
+        self.connection_tasks: List[asyncio.Task] = []
+        self.is_closed = False
+        self.closed_event: asyncio.Event = None
+
+    def _ensure_started(self):
+        if self.connection_tasks:
+            return
+
+        self.closed_event = asyncio.Event()
+        self.connections = [_Connection(i) for i in range(self.connection_count)]
+        self.connection_tasks = [
+            asyncio.create_task(self._amaintain_connection(c)) for c in self.connections
+        ]
+
+    async def _amaintain_connection(self,
+                                    connection: _Connection,
+                                    ):
+        reconnect_delay_s = self.reconnect_delay_s
+        while not self.is_closed:
+            try:
+                start_time = asyncio.get_running_loop().time()
+                async with websockets.connect(self.url, max_size=None) as websocket:
+                    if self.metrics:
+                        self.metrics.created_counter.inc()
+                        self.metrics.create_latency.observe(asyncio.get_running_loop().time() - start_time)
+                    logger.info("[MultiplexedWebsocketClient] connection %d open to %s", connection.index, self.url)
+
+                    connection.websocket = websocket
+                    reconnect_delay_s = self.reconnect_delay_s
+
+                    # whatever was in flight on the lost connection goes again
+                    for pending in list(self.pending.values()):
+                        if pending.connection is connection and not pending.future.done():
+                            await websocket.send(json.dumps(pending.message))
+                    connection.is_connected.set()
+
+                    async for raw_message in websocket:
+                        self._on_message(json.loads(raw_message))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(
+                    "[MultiplexedWebsocketClient] connection %d to %s lost: %s",
+                    connection.index,
+                    self.url,
+                    e,
+                )
+            finally:
+                connection.is_connected.clear()
+                connection.websocket = None
+
+            if not self.is_closed:
+                await asyncio.sleep(reconnect_delay_s)
+                reconnect_delay_s = min(reconnect_delay_s * 2, self.max_reconnect_delay_s)
+
+    def _on_message(self,
+                    message: Dict[str, Any],
+                    ):
+        # stream messages (ie. subscriptions) carry no request id
+        pending = self.pending.get(message.get("id"))
+        if pending and not pending.future.done():
+            pending.future.set_result(websocket_to_response(message))
+
+    async def _aconnected(self) -> _Connection:
+        connected = [c for c in self.connections if c.is_connected.is_set()]
+        if not connected:
+            waiters = [asyncio.create_task(c.is_connected.wait()) for c in self.connections]
+            waiters.append(asyncio.create_task(self.closed_event.wait()))
+            try:
+                await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for waiter in waiters:
+                    waiter.cancel()
+            if self.is_closed:
+                raise RuntimeError("[MultiplexedWebsocketClient] %s closed" % self.url)
+            connected = [c for c in self.connections if c.is_connected.is_set()]
+
+        return min(connected, key=lambda c: c.in_flight_count)
+
+    async def request_impl(self,
+                           request: Request,
+                           ) -> Response:
+        if self.is_closed:
+            raise RuntimeError("[MultiplexedWebsocketClient] %s closed" % self.url)
+
+        self._ensure_started()
+        request_id = next(self.request_ids)
+        message = {**request_to_websocket(request), "id": request_id}
+        future = asyncio.get_running_loop().create_future()
+
+        try:
+            return await asyncio.wait_for(self._arequest(request_id, message, future), self.request_timeout_s)
+        finally:
+            pending = self.pending.pop(request_id, None)
+            if pending:
+                pending.connection.in_flight_count -= 1
+
+    async def _arequest(self,
+                        request_id: int,
+                        message: Dict[str, Any],
+                        future: asyncio.Future,
+                        ) -> Response:
+        connection = await self._aconnected()
+        self.pending[request_id] = _PendingRequest(message, future, connection)
+        connection.in_flight_count += 1
+        if self.metrics:
+            self.metrics.reused_counter.inc()
+
+        try:
+            await connection.websocket.send(json.dumps(message))
+        except Exception as e:
+            # the connection re-sends it once it is back
+            logger.debug("[MultiplexedWebsocketClient] send failed, waiting for reconnect: %s", e)
+
+        return await future
+
+    async def aclose(self):
+        self.is_closed = True
+        if self.closed_event:
+            self.closed_event.set()
+        # nothing answers the requests in flight anymore
+        for pending in list(self.pending.values()):
+            if not pending.future.done():
+                pending.future.set_exception(RuntimeError("[MultiplexedWebsocketClient] %s closed" % self.url))
+
+        for task in self.connection_tasks:
+            task.cancel()
+        await asyncio.gather(*self.connection_tasks, return_exceptions=True)
+        self.connection_tasks = []
@@ -1,41 +1,167 @@
 import asyncio
+import collections
 import logging
 import sys
 import traceback
-from typing import Callable, Union
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 import bson
-from xrpl.asyncio.clients import (
-    AsyncWebsocketClient,
-    AsyncJsonRpcClient,
-)
+from xrpl.asyncio.clients import AsyncWebsocketClient
+from xrpl.asyncio.clients.async_client import AsyncClient
 from xrpl.models import Subscribe, StreamParameter
+from xrpl.models.requests import Ledger, Request
 from xrpl.models.requests.ledger_data import LedgerData
 
-from ekspiper.util.callable import RetryWrapper
-from .data import DataSource
+from ekspiper.connect.dead_letter import build_dead_letter
+from ekspiper.metric.prom import LedgerGapMetrics, TransactionStreamMetrics
+from ekspiper.processor.fetch_transactions import build_ledger_request
+from ekspiper.util.callable import RetryExhaustedError, RetryWrapper, RPCResponseError
+from ekspiper.util.ledger_codec import close_time_human
+from .data import DataSource, DataSink
 from ..util.async_iterable_with_timeout import AsyncTimedIterable
 
 logger = logging.getLogger(__name__)
 
 
+def parse_validated_ledgers(validated_ledgers: str) -> List[Tuple[int, int]]:
+    """
+    Parse the `validated_ledgers` of a ledger stream message
+    (ie. "32570-75000000,75000002") into inclusive ranges.
+    """
+    ranges = []
+    for part in (validated_ledgers or "").split(","):
+        part = part.strip()
+        if not part or part == "empty":
+            continue
+        start, _, end = part.partition("-")
+        ranges.append((int(start), int(end or start)))
+    return ranges
+
+
 class LedgerCreationDataSource(DataSource):
+    """
+    Emits the index of every ledger closed on the network.
+
+    When the next streamed ledger is not the one after `last_ledger`
+    (ie. after a reconnect), the missing indexes are handed to
+    `backfill_sink` by a task of their own, so that the live ledgers never
+    wait behind them; without a sink they are emitted along with the live
+    ones. `last_ledger` can be seeded to backfill from a previous run.
+
+    `first_ledger_callback` is given the first index emitted (ie. to seed
+    the ReorderSourceSink the fetched ledgers are released from).
+    """
+
     def __init__(self,
                  wss_url: str = "wss://s1.ripple.com",
                  done_callback: Callable[[], None] = None,
                  stream_type=StreamParameter.LEDGER,
+                 maxsize: int = 0,
+                 backfill_sink: DataSink = None,
+                 last_ledger: int = None,
+                 metrics: LedgerGapMetrics = None,
+                 first_ledger_callback: Callable[[int], None] = None,
                  ):
         self.wss_url = wss_url
-        self.async_queue = asyncio.Queue()
+        self.async_queue = asyncio.Queue(maxsize=maxsize)
         self.is_stop = False
         self.populate_task = None
         self.client = None
         self.done_callback = done_callback
         self.stream_type = stream_type
-        self.last_ledger = None
+        self.last_ledger = last_ledger
+        self.backfill_sink = backfill_sink
+        self.metrics = metrics
+        self.first_ledger_callback = first_ledger_callback
+
+        # missing (start, end) ranges, inclusive, waiting for the backfill task
+        self.pending_gaps = collections.deque()
+        self.gap_queued = asyncio.Event()
+        self.backfill_task = None
+        self.validated_ranges: List[Tuple[int, int]] = []
+
+    def pending_backfill_count(self) -> int:
+        return sum(end - start + 1 for start, end in self.pending_gaps)
+
+    def _is_validated(self,
+                      ledger_index: int,
+                      ) -> bool:
+        return any(start <= ledger_index <= end for start, end in self.validated_ranges)
+
+    def _queue_gap(self,
+                   start: int,
+                   end: int,
+                   ):
+        logger.warning("[LedgerCreationDataSource] missed ledgers %d to %d, backfilling them", start, end)
+        if self.validated_ranges and not (self._is_validated(start) and self._is_validated(end)):
+            logger.warning(
+                "[LedgerCreationDataSource] the node's validated ledgers (%s) do not cover %d to %d",
+                self.validated_ranges,
+                start,
+                end,
+            )
+
+        self.pending_gaps.append((start, end))
+        self.gap_queued.set()
+        if self.metrics:
+            self.metrics.gap_counter.inc()
+            self.metrics.backfill_pending_gauge.set(self.pending_backfill_count())
+
+    async def _abackfill(self):
+        while not self.is_stop:
+            if not self.pending_gaps:
+                self.gap_queued.clear()
+                await self.gap_queued.wait()
+                continue
+
+            start, end = self.pending_gaps[0]
+            if self.backfill_sink:
+                await self.backfill_sink.put(start)
+            else:
+                await self.async_queue.put(start)
+
+            if start < end:
+                self.pending_gaps[0] = (start + 1, end)
+            else:
+                self.pending_gaps.popleft()
+            if self.metrics:
+                self.metrics.backfill_counter.inc()
+                self.metrics.backfill_pending_gauge.set(self.pending_backfill_count())
+
+    async def _aon_ledger(self,
+                          message: dict,
+                          ):
+        result = message.get("result", {})
+        ledger_index = int(result.get("ledger_index") or message.get("ledger_index"))
+        validated_ledgers = result.get("validated_ledgers") or message.get("validated_ledgers")
+        if validated_ledgers:
+            self.validated_ranges = parse_validated_ledgers(validated_ledgers)
+
+        if self.last_ledger is not None:
+            if ledger_index == self.last_ledger:
+                # ie. the subscription answer repeating the current ledger
+                logger.info("[LedgerCreationDataSource] skipping ledger %d already seen", ledger_index)
+                return
+            if ledger_index < self.last_ledger:
+                logger.warning(
+                    "[LedgerCreationDataSource] ledger %d is behind the last ledger %d, following the stream",
+                    ledger_index,
+                    self.last_ledger,
+                )
+            elif ledger_index > self.last_ledger + 1:
+                self._queue_gap(self.last_ledger + 1, ledger_index - 1)
+
+        if self.first_ledger_callback:
+            self.first_ledger_callback(ledger_index)
+            self.first_ledger_callback = None
+
+        self.last_ledger = ledger_index
+        await self.async_queue.put(ledger_index)
 
     async def start(self):
         ledger_update_sub_req = Subscribe(streams=[self.stream_type])
+        if self.backfill_task is None:
+            self.backfill_task = asyncio.create_task(self._abackfill())
 
         async with AsyncWebsocketClient(self.wss_url) as client:
             self.client = client
@@ -47,10 +173,7 @@ class LedgerCreationDataSource(DataSource):
                 timed_message_iterator = AsyncTimedIterable(client, 15)
                 async for message in timed_message_iterator:
                     logger.info("Received message: " + str(message))
-                    self.last_ledger = int(message.get(
-                        "result", {}).get("ledger_index") or message.get("ledger_index"))
-
-                    self.async_queue.put_nowait(self.last_ledger)
+                    await self._aon_ledger(message)
             except asyncio.TimeoutError as e:
                 logger.error(
                     "[LedgerCreationDataSource] Haven't received a message in 15s, closing connection : " + str(e))
@@ -62,11 +185,15 @@ class LedgerCreationDataSource(DataSource):
 
     def stop(self):
         self.is_stop = True
-        self.client.close()
+        if self.client:
+            self.client.close()
 
         if self.populate_task:
             self.populate_task.cancel()
 
+        if self.backfill_task:
+            self.backfill_task.cancel()
+
     def __aiter__(self):
         return self
 
@@ -84,13 +211,309 @@ class LedgerCreationDataSource(DataSource):
         return await self.async_queue.get()
 
 
+class _LedgerBatch:
+    def __init__(self,
+                 ledger_index: int,
+                 ledger_closed: Dict[str, Any] = None,
+                 ):
+        self.ledger_index = ledger_index
+        # the ledgerClosed message; None for a ledger announced before
+        # the subscription
+        self.ledger_closed = ledger_closed
+        self.transactions = []
+
+    def is_complete(self) -> bool:
+        return self.ledger_closed is not None and len(self.transactions) == self.ledger_closed.get("txn_count")
+
+    def sorted_transactions(self) -> List[Dict[str, Any]]:
+        return sorted(self.transactions, key=lambda t: t["metaData"].get("TransactionIndex", 0))
+
+    def to_ledger_result(self) -> Dict[str, Any]:
+        """
+        Same shape as the result of an expanded `ledger` request, with only
+        the header fields the ledger stream carries: `parent_hash`,
+        `account_hash`, `transaction_hash`, `total_coins`, `parent_close_time`,
+        `close_flags` and `close_time_resolution` are left out.
+        """
+        ledger_hash = self.ledger_closed.get("ledger_hash")
+        close_time = self.ledger_closed.get("ledger_time")
+        return {
+            "ledger": {
+                "accepted": True,
+                "closed": True,
+                "close_time": close_time,
+                "close_time_human": close_time_human(close_time) if close_time is not None else None,
+                "hash": ledger_hash,
+                "ledger_hash": ledger_hash,
+                "ledger_index": str(self.ledger_index),
+                "seqNum": str(self.ledger_index),
+                "transactions": self.sorted_transactions(),
+            },
+            "ledger_hash": ledger_hash,
+            "ledger_index": self.ledger_index,
+            "validated": True,
+        }
+
+
+class TransactionStreamDataSource(DataSource):
+    """
+    Emits every validated ledger with its transactions, in the shape of an
+    expanded `ledger` request, built from the `transactions` stream rather
+    than a request per close.
+
+    A ledger's batch is closed when the ledger stream announces the next
+    close. Only the batches short of the announced `txn_count` (ie. around
+    a reconnect) and the ledgers skipped while disconnected are fetched
+    over `rpc_client`; the fetches do not hold the stream back, and the
+    ledgers are still emitted in order.
+
+    The stream does not carry the whole ledger header; with
+    `is_fetch_header`, the header of every streamed ledger is fetched
+    (without its transactions) to fill it in.
+
+    A fetch is retried, through `retry_wrapper`, until it succeeds: a
+    ledger is only given up on a fatal error (ie. `lgrNotFound`), and is
+    then written to `dead_letter_sink` rather than silently skipped.
+    """
+
+    def __init__(self,
+                 wss_url: str = "wss://s1.ripple.com",
+                 rpc_client: AsyncClient = None,
+                 done_callback: Callable[[], None] = None,
+                 maxsize: int = 100,
+                 reconnect_delay_s: float = 5,
+                 metrics: TransactionStreamMetrics = None,
+                 is_fetch_header: bool = False,
+                 retry_wrapper: RetryWrapper = None,
+                 dead_letter_sink: DataSink = None,
+                 name: str = "transaction_stream",
+                 ):
+        self.wss_url = wss_url
+        self.rpc_client = rpc_client
+        self.done_callback = done_callback
+        self.reconnect_delay_s = reconnect_delay_s
+        self.metrics = metrics
+        self.is_fetch_header = is_fetch_header
+        self.dead_letter_sink = dead_letter_sink
+        self.name = name
+
+        # futures of the ledger results, in ledger order
+        self.async_queue = asyncio.Queue(maxsize=maxsize)
+        self.is_stop = False
+        self.populate_task = None
+        self.client = None
+        self.retry_wrapper = retry_wrapper if retry_wrapper else RetryWrapper()
+
+        self.batches: Dict[int, _LedgerBatch] = {}
+        # ledger of the open batch
+        self.open_ledger: Optional[int] = None
+        self.last_ledger: Optional[int] = None
+
+    def start(self):
+        self.populate_task = asyncio.create_task(self._start())
+
+    async def _start(self):
+        while not self.is_stop:
+            try:
+                await self._aconsume_stream()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("[TransactionStreamDataSource] stream failed: %s", e)
+
+            # whatever was streamed for the open ledger may be partial
+            if self.open_ledger is not None:
+                await self._aclose_batch(self.open_ledger)
+                self.open_ledger = None
+
+            if not self.is_stop:
+                await asyncio.sleep(self.reconnect_delay_s)
+
+    async def _aconsume_stream(self):
+        async with AsyncWebsocketClient(self.wss_url) as client:
+            self.client = client
+            logger.info("[TransactionStreamDataSource] Sending subscribe request")
+            await client.send(Subscribe(streams=[StreamParameter.LEDGER, StreamParameter.TRANSACTIONS]))
+
+            try:
+                async for message in AsyncTimedIterable(client, 15):
+                    await self._aon_message(message)
+            except asyncio.TimeoutError as e:
+                logger.error(
+                    "[TransactionStreamDataSource] Haven't received a message in 15s, closing connection : " + str(e))
+                await client.close()
+
+        logger.warning("[TransactionStreamDataSource] Connection closed")
+
+    async def _aon_message(self,
+                           message: Dict[str, Any],
+                           ):
+        message_type = message.get("type")
+        if message_type == "transaction":
+            if not message.get("validated"):
+                return
+
+            ledger_index = message["ledger_index"]
+            is_closed = self.last_ledger is not None and ledger_index <= self.last_ledger
+            if is_closed and ledger_index != self.open_ledger:
+                logger.warning("[TransactionStreamDataSource] late transaction for ledger %d", ledger_index)
+                return
+
+            if ledger_index not in self.batches:
+                self.batches[ledger_index] = _LedgerBatch(ledger_index)
+            self.batches[ledger_index].transactions.append({
+                **message["transaction"],
+                "metaData": message.get("meta", {}),
+            })
+        elif message_type == "ledgerClosed":
+            await self._aon_ledger_closed(message)
+        elif "result" in message and message["result"].get("ledger_index"):
+            # the subscription answer; the ledger it names was streamed
+            # before we listened, so it is fetched instead
+            await self._aon_ledger_closed({"ledger_index": message["result"]["ledger_index"]})
+
+    async def _aon_ledger_closed(self,
+                                 message: Dict[str, Any],
+                                 ):
+        ledger_index = int(message["ledger_index"])
+        if self.last_ledger is not None and ledger_index <= self.last_ledger:
+            return
+
+        if self.open_ledger is not None:
+            await self._aclose_batch(self.open_ledger)
+
+        # ledgers that were never announced (ie. while disconnected)
+        if self.last_ledger is not None:
+            for missing_index in range(self.last_ledger + 1, ledger_index):
+                await self._aclose_batch(missing_index)
+
+        batch = self.batches.get(ledger_index) or _LedgerBatch(ledger_index)
+        batch.ledger_closed = message if "txn_count" in message else None
+        self.batches[ledger_index] = batch
+        self.open_ledger = ledger_index
+        self.last_ledger = ledger_index
+
+    async def _aclose_batch(self,
+                            ledger_index: int,
+                            ):
+        batch = self.batches.pop(ledger_index, None) or _LedgerBatch(ledger_index)
+        if batch.is_complete():
+            if self.metrics:
+                self.metrics.streamed_counter.inc()
+            if self.is_fetch_header and self.rpc_client:
+                await self.async_queue.put(asyncio.create_task(self._afetch_header(batch)))
+                return
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(batch.to_ledger_result())
+            await self.async_queue.put(future)
+            return
+
+        logger.info(
+            "[TransactionStreamDataSource] ledger %d incomplete (%d transaction(s)), fetching it",
+            ledger_index,
+            len(batch.transactions),
+        )
+        if self.metrics:
+            self.metrics.fallback_counter.inc()
+        await self.async_queue.put(asyncio.create_task(self._afetch_ledger(ledger_index)))
+
+    async def _afetch_ledger(self,
+                             ledger_index: int,
+                             ) -> Optional[Dict[str, Any]]:
+        return await self._arequest(ledger_index, build_ledger_request(ledger_index))
+
+    async def _afetch_header(self,
+                             batch: _LedgerBatch,
+                             ) -> Optional[Dict[str, Any]]:
+        ledger_result = await self._arequest(batch.ledger_index, Ledger(ledger_index=batch.ledger_index))
+        if ledger_result is not None:
+            ledger_result["ledger"]["transactions"] = batch.sorted_transactions()
+        return ledger_result
+
+    async def _arequest(self,
+                        ledger_index: int,
+                        request: Request,
+                        ) -> Optional[Dict[str, Any]]:
+        async def afetch(index: int) -> Dict[str, Any]:
+            response = await self.rpc_client.request(request)
+            if not response.is_successful():
+                raise RPCResponseError("Error fetching transactions for ledger :%s (%s)" % (
+                    index,
+                    response.result.get("error"),
+                ), error=response.result.get("error"))
+            return response.result
+
+        if not self.rpc_client:
+            await self._adead_letter(ledger_index, RuntimeError("no RPC client to fetch the ledger"))
+            return None
+
+        while True:
+            try:
+                return await self.retry_wrapper.aretry(ledger_index, afetch)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                is_retryable = isinstance(e, RetryExhaustedError) and \
+                    (e.last_error is None or self.retry_wrapper.is_retryable(e.last_error))
+                if self.is_stop or not is_retryable:
+                    await self._adead_letter(ledger_index, e)
+                    return None
+
+            logger.error(
+                "[TransactionStreamDataSource] could not fetch ledger %d yet, retrying in %ss",
+                ledger_index,
+                self.reconnect_delay_s,
+            )
+            await asyncio.sleep(self.reconnect_delay_s)
+
+    async def _adead_letter(self,
+                            ledger_index: int,
+                            error: Exception,
+                            ):
+        if not self.dead_letter_sink:
+            logger.error("[TransactionStreamDataSource] giving up on ledger %d: %s", ledger_index, error)
+            return
+
+        logger.error("[TransactionStreamDataSource] dead-lettering ledger %d: %s", ledger_index, error)
+        await self.dead_letter_sink.put(build_dead_letter(
+            entry=ledger_index,
+            error=error,
+            flow=self.name,
+            stage="fetch_ledger",
+        ))
+
+    def stop(self):
+        self.is_stop = True
+        if self.populate_task:
+            self.populate_task.cancel()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while True:
+            if self.is_stop and self.async_queue.empty():
+                try:
+                    if self.done_callback:
+                        self.done_callback()
+                except Exception as e:
+                    traceback.print_exc(file=sys.stdout)
+                finally:
+                    raise StopAsyncIteration
+
+            ledger_result = await (await self.async_queue.get())
+            if ledger_result is not None:
+                return ledger_result
+
+
 class LedgerObjectDataSource(DataSource):
     def __init__(self,
-                 rpc_client: AsyncJsonRpcClient,
+                 rpc_client: AsyncClient,
                  ledger_index: Union[int, str] = "current",
                  is_attach_execution_id: bool = True,
                  is_attach_seq: bool = True,
                  done_callback: Callable[[], None] = None,
+                 maxsize: int = 0,
                  ):
         # more than efficient for a request-response query pattern
         #  - server is not pushing any information; must have a request
@@ -100,7 +523,7 @@ class LedgerObjectDataSource(DataSource):
         self.ledger_index = ledger_index
         self.next_marker = None
 
-        self.async_queue = asyncio.Queue()
+        self.async_queue = asyncio.Queue(maxsize=maxsize)
         self.is_stop = False
 
         self.is_attach_execution_id = is_attach_execution_id
@@ -1,11 +1,42 @@
+import weakref
 from timeit import default_timer
+from typing import Any, Dict, List
 
 from prometheus_client import (
     CollectorRegistry,
+    Counter,
     Gauge,
+    Histogram,
     Summary,
 )
 
+LATENCY_BUCKETS_S = (
+    .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0, 30.0, float("inf"),
+)
+
+# registry -> metric name -> collector
+_collectors: "weakref.WeakKeyDictionary[CollectorRegistry, Dict[str, Any]]" = weakref.WeakKeyDictionary()
+
+
+def _shared(collector_type,
+            name: str,
+            documentation: str,
+            labelnames: List[str],
+            registry: CollectorRegistry,
+            **kwargs,
+            ):
+    """
+    The collector of `name` in `registry`, created on first use, so that
+    several instances (ie. one per queue) can label the same metric.
+    """
+    if registry is None:
+        return collector_type(name, documentation, labelnames, registry=registry, **kwargs)
+
+    registry_collectors = _collectors.setdefault(registry, {})
+    if name not in registry_collectors:
+        registry_collectors[name] = collector_type(name, documentation, labelnames, registry=registry, **kwargs)
+    return registry_collectors[name]
+
 
 class ScriptExecutionMetrics:
     def __init__(self,
@@ -56,3 +87,560 @@ class ScriptExecutionMetrics:
         # Time can go backwards.
         duration = max(default_timer() - self.start_time, 0)
         self.exec_duration_summary.labels(self.job_name).observe(duration)
+
+
+class ReorderBufferMetrics:
+    def __init__(self,
+                 prom_registry: CollectorRegistry,
+                 name: str,
+                 ):
+        self.name = name
+        self.buffer_depth_gauge = _shared(
+            Gauge,
+            "rx_reorder_buffer_depth",
+            "Number of entries held back waiting for an earlier key",
+            ["name"],
+            registry=prom_registry,
+        ).labels(name)
+
+        self.ready_depth_gauge = _shared(
+            Gauge,
+            "rx_reorder_ready_depth",
+            "Number of in-order entries waiting to be consumed",
+            ["name"],
+            registry=prom_registry,
+        ).labels(name)
+
+        self.gap_skipped_counter = _shared(
+            Counter,
+            "rx_reorder_gap_skipped_total",
+            "Number of keys skipped after the gap timeout expired",
+            ["name"],
+            registry=prom_registry,
+        ).labels(name)
+
+        self.late_entry_counter = _shared(
+            Counter,
+            "rx_reorder_late_entry_total",
+            "Number of entries that arrived after their key was skipped",
+            ["name"],
+            registry=prom_registry,
+        ).labels(name)
+
+
+class FlowMetrics:
+    """
+    Metric families shared by all the TemplateFlows registered
+    on the same registry; labelled by flow and stage name.
+    """
+
+    def __init__(self,
+                 prom_registry: CollectorRegistry,
+                 ):
+        self.processor_latency_histogram = _shared(
+            Histogram,
+            "rx_flow_processor_latency_seconds",
+            "Time spent in a stage processor, retries included",
+            ["flow", "stage"],
+            buckets=LATENCY_BUCKETS_S,
+            registry=prom_registry,
+        )
+        self.collector_latency_histogram = _shared(
+            Histogram,
+            "rx_flow_collector_latency_seconds",
+            "Time spent in a stage collector",
+            ["flow", "stage", "collector"],
+            buckets=LATENCY_BUCKETS_S,
+            registry=prom_registry,
+        )
+        self.messages_in_counter = _shared(
+            Counter,
+            "rx_flow_messages_in_total",
+            "Number of messages given to a stage processor",
+            ["flow", "stage"],
+            registry=prom_registry,
+        )
+        self.messages_out_counter = _shared(
+            Counter,
+            "rx_flow_messages_out_total",
+            "Number of messages produced by a stage processor",
+            ["flow", "stage"],
+            registry=prom_registry,
+        )
+        self.retry_counter = _shared(
+            Counter,
+            "rx_flow_retries_total",
+            "Number of failed attempts that were retried",
+            ["flow", "stage"],
+            registry=prom_registry,
+        )
+        self.error_counter = _shared(
+            Counter,
+            "rx_flow_errors_total",
+            "Number of messages that failed in a stage",
+            ["flow", "stage"],
+            registry=prom_registry,
+        )
+
+    def stage(self,
+              flow_name: str,
+              stage_name: str,
+              collector_names: List[str],
+              ) -> "FlowStageMetrics":
+        return FlowStageMetrics(
+            flow_metrics=self,
+            flow_name=flow_name,
+            stage_name=stage_name,
+            collector_names=collector_names,
+        )
+
+
+class FlowStageMetrics:
+    """
+    Label children resolved once per stage to keep the per message cost low.
+    """
+
+    def __init__(self,
+                 flow_metrics: FlowMetrics,
+                 flow_name: str,
+                 stage_name: str,
+                 collector_names: List[str],
+                 ):
+        self.processor_latency = flow_metrics.processor_latency_histogram.labels(flow_name, stage_name)
+        self.messages_in = flow_metrics.messages_in_counter.labels(flow_name, stage_name)
+        self.messages_out = flow_metrics.messages_out_counter.labels(flow_name, stage_name)
+        self.retries = flow_metrics.retry_counter.labels(flow_name, stage_name)
+        self.errors = flow_metrics.error_counter.labels(flow_name, stage_name)
+        self.collector_latencies = [
+            flow_metrics.collector_latency_histogram.labels(flow_name, stage_name, collector_name)
+            for collector_name in collector_names
+        ]
+
+    def on_retry(self,
+                 iteration_count: int,
+                 error: Exception,
+                 ):
+        self.retries.inc()
+
+
+class QueueMetrics:
+    def __init__(self,
+                 prom_registry: CollectorRegistry,
+                 name: str,
+                 ):
+        self.name = name
+        self.depth_gauge = _shared(
+            Gauge,
+            "rx_queue_depth",
+            "Number of entries waiting in the queue",
+            ["name"],
+            registry=prom_registry,
+        ).labels(name)
+
+        self.size_bytes_gauge = _shared(
+            Gauge,
+            "rx_queue_size_bytes",
+            "Approximate size of the entries waiting in the queue",
+            ["name"],
+            registry=prom_registry,
+        ).labels(name)
+
+        self.blocked_put_counter = _shared(
+            Counter,
+            "rx_queue_blocked_put_total",
+            "Number of puts that waited for the queue to drain",
+            ["name"],
+            registry=prom_registry,
+        ).labels(name)
+
+        self.blocked_seconds_counter = _shared(
+            Counter,
+            "rx_queue_blocked_seconds_total",
+            "Time producers spent waiting for the queue to drain",
+            ["name"],
+            registry=prom_registry,
+        ).labels(name)
+
+
+class CircuitBreakerMetrics:
+    def __init__(self,
+                 prom_registry: CollectorRegistry,
+                 name: str,
+                 ):
+        self.name = name
+        self.state_gauge = _shared(
+            Gauge,
+            "rx_circuit_breaker_state",
+            "State of the circuit breaker: 0 closed, 1 open, 2 half-open",
+            ["name"],
+            registry=prom_registry,
+        ).labels(name)
+
+        self.opened_counter = _shared(
+            Counter,
+            "rx_circuit_breaker_opened_total",
+            "Number of times the circuit breaker opened",
+            ["name"],
+            registry=prom_registry,
+        ).labels(name)
+
+        self.retry_budget_exhausted_counter = _shared(
+            Counter,
+            "rx_retry_budget_exhausted_total",
+            "Number of retries denied because the retry budget ran out",
+            ["name"],
+            registry=prom_registry,
+        ).labels(name)
+
+
+class RateLimiterMetrics:
+    def __init__(self,
+                 prom_registry: CollectorRegistry,
+                 name: str,
+                 ):
+        self.name = name
+        self.acquired_counter = _shared(
+            Counter,
+            "rx_rate_limiter_acquired_total",
+            "Number of tokens acquired from the rate limiter",
+            ["name"],
+            registry=prom_registry,
+        ).labels(name)
+
+        self.wait_seconds_counter = _shared(
+            Counter,
+            "rx_rate_limiter_wait_seconds_total",
+            "Total time spent waiting on the rate limiter",
+            ["name"],
+            registry=prom_registry,
+        ).labels(name)
+
+
+class ConcurrencyMetrics:
+    def __init__(self,
+                 prom_registry: CollectorRegistry,
+                 name: str,
+                 ):
+        self.name = name
+        self.limit_gauge = _shared(
+            Gauge,
+            "rx_concurrency_limit",
+            "Concurrency chosen by the adaptive concurrency controller",
+            ["name"],
+            registry=prom_registry,
+        ).labels(name)
+
+        self.throttled_counter = _shared(
+            Counter,
+            "rx_concurrency_throttled_total",
+            "Number of timeouts and throttling responses observed",
+            ["name"],
+            registry=prom_registry,
+        ).labels(name)
+
+
+class ShardedRunnerMetrics:
+    def __init__(self,
+                 prom_registry: CollectorRegistry,
+                 name: str,
+                 ):
+        self.name = name
+        self.processed_gauge = _shared(
+            Gauge,
+            "rx_shard_processed",
+            "Number of entries processed by the shard",
+            ["name", "shard"],
+            registry=prom_registry,
+        )
+
+        self.restart_counter = _shared(
+            Counter,
+            "rx_shard_restarts_total",
+            "Number of times the shard process was restarted",
+            ["name", "shard"],
+            registry=prom_registry,
+        )
+
+
+class ConnectionMetrics:
+    def __init__(self,
+                 prom_registry: CollectorRegistry,
+                 name: str,
+                 ):
+        self.name = name
+        self.created_counter = _shared(
+            Counter,
+            "rx_http_connections_created_total",
+            "Number of HTTP connections opened",
+            ["name"],
+            registry=prom_registry,
+        ).labels(name)
+
+        self.reused_counter = _shared(
+            Counter,
+            "rx_http_connections_reused_total",
+            "Number of requests sent over an already open HTTP connection",
+            ["name"],
+            registry=prom_registry,
+        ).labels(name)
+
+        self.create_latency = _shared(
+            Histogram,
+            "rx_http_connection_create_seconds",
+            "Time to open an HTTP connection, including the TCP and TLS handshakes",
+            ["name"],
+            buckets=LATENCY_BUCKETS_S,
+            registry=prom_registry,
+        ).labels(name)
+
+
+class EndpointPoolMetrics:
+    def __init__(self,
+                 prom_registry: CollectorRegistry,
+                 name: str,
+                 ):
+        self.name = name
+        self.healthy_gauge = _shared(
+            Gauge,
+            "rx_endpoint_healthy",
+            "Whether the endpoint is in rotation: 1 healthy, 0 ejected",
+            ["name", "endpoint"],
+            registry=prom_registry,
+        )
+
+        self.outstanding_gauge = _shared(
+            Gauge,
+            "rx_endpoint_outstanding_requests",
+            "Number of requests in flight to the endpoint",
+            ["name", "endpoint"],
+            registry=prom_registry,
+        )
+
+        self.ejected_counter = _shared(
+            Counter,
+            "rx_endpoint_ejected_total",
+            "Number of times the endpoint was taken out of rotation",
+            ["name", "endpoint"],
+            registry=prom_registry,
+        )
+
+
+class HedgeMetrics:
+    def __init__(self,
+                 prom_registry: CollectorRegistry,
+                 name: str,
+                 ):
+        self.name = name
+        self.hedged_counter = _shared(
+            Counter,
+            "rx_hedged_requests_total",
+            "Number of duplicate requests sent for slow requests",
+            ["name"],
+            registry=prom_registry,
+        ).labels(name)
+
+        self.hedge_won_counter = _shared(
+            Counter,
+            "rx_hedge_won_total",
+            "Number of requests answered first by the duplicate",
+            ["name"],
+            registry=prom_registry,
+        ).labels(name)
+
+        self.delay_gauge = _shared(
+            Gauge,
+            "rx_hedge_delay_seconds",
+            "Time waited before sending the duplicate request",
+            ["name"],
+            registry=prom_registry,
+        ).labels(name)
+
+
+class LedgerGapMetrics:
+    def __init__(self,
+                 prom_registry: CollectorRegistry,
+                 name: str,
+                 ):
+        self.name = name
+        self.gap_counter = _shared(
+            Counter,
+            "rx_ledger_gap_detected_total",
+            "Number of gaps detected in the ledger stream",
+            ["name"],
+            registry=prom_registry,
+        ).labels(name)
+
+        self.backfill_counter = _shared(
+            Counter,
+            "rx_ledger_backfill_queued_total",
+            "Number of missing ledger indexes sent to the backfill",
+            ["name"],
+            registry=prom_registry,
+        ).labels(name)
+
+        self.backfill_pending_gauge = _shared(
+            Gauge,
+            "rx_ledger_backfill_pending",
+            "Number of missing ledger indexes not yet handed to the backfill",
+            ["name"],
+            registry=prom_registry,
+        ).labels(name)
+
+
+class TransactionStreamMetrics:
+    def __init__(self,
+                 prom_registry: CollectorRegistry,
+                 name: str,
+                 ):
+        self.name = name
+        self.streamed_counter = _shared(
+            Counter,
+            "rx_stream_ledger_complete_total",
+            "Number of ledgers built from the transactions stream alone",
+            ["name"],
+            registry=prom_registry,
+        ).labels(name)
+
+        self.fallback_counter = _shared(
+            Counter,
+            "rx_stream_ledger_fallback_total",
+            "Number of incomplete ledgers fetched over RPC instead",
+            ["name"],
+            registry=prom_registry,
+        ).labels(name)
+
+
+class LedgerCacheMetrics:
+    def __init__(self,
+                 prom_registry: CollectorRegistry,
+                 name: str,
+                 ):
+        self.name = name
+        self.hit_counter = _shared(
+            Counter,
+            "rx_ledger_cache_hits_total",
+            "Number of ledgers served from the disk cache",
+            ["name"],
+            registry=prom_registry,
+        ).labels(name)
+
+        self.miss_counter = _shared(
+            Counter,
+            "rx_ledger_cache_misses_total",
+            "Number of ledgers fetched because they were not cached",
+            ["name"],
+            registry=prom_registry,
+        ).labels(name)
+
+        self.eviction_counter = _shared(
+            Counter,
+            "rx_ledger_cache_evictions_total",
+            "Number of ledgers evicted to stay under the size cap",
+            ["name"],
+            registry=prom_registry,
+        ).labels(name)
+
+        self.size_bytes_gauge = _shared(
+            Gauge,
+            "rx_ledger_cache_size_bytes",
+            "Size of the compressed ledgers on disk",
+            ["name"],
+            registry=prom_registry,
+        ).labels(name)
+
+
+class SingleflightMetrics:
+    def __init__(self,
+                 prom_registry: CollectorRegistry,
+                 name: str,
+                 ):
+        self.name = name
+        self.request_counter = _shared(
+            Counter,
+            "rx_singleflight_requests_total",
+            "Number of requests going through the coalescing layer",
+            ["name"],
+            registry=prom_registry,
+        ).labels(name)
+
+        # joined an identical request in flight, or served from the memo
+        self.coalesced_counter = _shared(
+            Counter,
+            "rx_singleflight_coalesced_total",
+            "Number of requests answered without a call of their own",
+            ["name", "kind"],
+            registry=prom_registry,
+        )
+
+        self.dedup_ratio_gauge = _shared(
+            Gauge,
+            "rx_singleflight_dedup_ratio",
+            "Share of the requests answered without a call of their own",
+            ["name"],
+            registry=prom_registry,
+        ).labels(name)
+
+
+class BookOffersCacheMetrics:
+    def __init__(self,
+                 prom_registry: CollectorRegistry,
+                 name: str,
+                 ):
+        self.name = name
+        # hit: served from the cache, joined: waited for a fetch of the
+        # same book, fetched: sent a request of its own
+        self.request_counter = _shared(
+            Counter,
+            "rx_book_offers_requests_total",
+            "Number of book offers requests by how they were answered",
+            ["name", "outcome"],
+            registry=prom_registry,
+        )
+
+        self.book_count_gauge = _shared(
+            Gauge,
+            "rx_book_offers_cached_books",
+            "Number of order books in the cache",
+            ["name"],
+            registry=prom_registry,
+        ).labels(name)
+
+
+class BookOffersFetchMetrics:
+    def __init__(self,
+                 prom_registry: CollectorRegistry,
+                 name: str,
+                 ):
+        self.name = name
+        self.page_counter = _shared(
+            Counter,
+            "rx_book_offers_pages_total",
+            "Number of book offers pages fetched",
+            ["name"],
+            registry=prom_registry,
+        ).labels(name)
+
+        self.byte_counter = _shared(
+            Counter,
+            "rx_book_offers_bytes_total",
+            "Size of the book offers pages fetched, serialized as JSON",
+            ["name"],
+            registry=prom_registry,
+        ).labels(name)
+
+        self.pages_per_book = _shared(
+            Histogram,
+            "rx_book_offers_pages_per_book",
+            "Number of pages fetched for one order book",
+            ["name"],
+            buckets=(1, 2, 5, 10, 20, 50, 100),
+            registry=prom_registry,
+        ).labels(name)
+
+        self.truncated_counter = _shared(
+            Counter,
+            "rx_book_offers_truncated_total",
+            "Number of order books cut short by the page cap",
+            ["name"],
+            registry=prom_registry,
+        ).labels(name)
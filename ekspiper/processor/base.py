@@ -1,9 +1,32 @@
 import logging
-from typing import Any, List
+from typing import Any, List, Tuple
+
+from ekspiper.util.callable import FatalError
 
 logger = logging.getLogger(__name__)
 
 
+class BatchEntryError(FatalError):
+    """
+    Some entries of a batch failed: `outputs` has the outputs of the other
+    entries and `failed_entries` the (entry, error) of the failed ones.
+
+    The batch is not retried as a whole; TemplateFlow runs the failed
+    entries again one at a time, to retry and dead-letter them.
+    """
+
+    def __init__(self,
+                 outputs: List[Any],
+                 failed_entries: List[Tuple[Any, Exception]],
+                 ):
+        super().__init__("[BatchEntryProcessor] %d entry(ies) failed: %s" % (
+            len(failed_entries),
+            "; ".join(str(e) for _, e in failed_entries[:3]),
+        ))
+        self.outputs = outputs
+        self.failed_entries = failed_entries
+
+
 class EntryProcessor:
     async def aprocess(self,
                        entry: Any,
@@ -11,8 +34,30 @@ class EntryProcessor:
         pass
 
 
-class PassthruProcessor(EntryProcessor):
+class BatchEntryProcessor(EntryProcessor):
+    """
+    Processor that can take a whole micro-batch of entries at once.
+    TemplateFlow hands it the batch in a single call when batching is on.
+    """
+
+    async def aprocess_batch(self,
+                             entries: List[Any],
+                             ) -> List[Any]:
+        pass
+
+    async def aprocess(self,
+                       entry: Any,
+                       ) -> List[Any]:
+        return await self.aprocess_batch([entry])
+
+
+class PassthruProcessor(BatchEntryProcessor):
     async def aprocess(self,
                        entry: Any,
                        ) -> List[Any]:
         return [entry]
+
+    async def aprocess_batch(self,
+                             entries: List[Any],
+                             ) -> List[Any]:
+        return list(entries)
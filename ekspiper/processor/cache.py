@@ -0,0 +1,193 @@
+import asyncio
+import collections
+import gzip
+import json
+import logging
+import os
+import uuid
+from typing import Any, Dict, List, Optional
+
+from ekspiper.metric.prom import LedgerCacheMetrics
+from ekspiper.processor.base import EntryProcessor
+from ekspiper.processor.fetch_transactions import ledger_index_of
+
+logger = logging.getLogger(__name__)
+
+# ledgers per sub-directory, to keep the directories small
+_LEDGERS_PER_DIR = 100_000
+
+
+def _read_entry(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with gzip.open(path, "rt") as f:
+            entry = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, EOFError, ValueError) as e:
+        logger.warning("[CachingLedgerFetchProcessor] dropping corrupt cache file %s: %s", path, e)
+        _remove(path)
+        return None
+
+    # the modification time doubles as the last access time
+    os.utime(path)
+    return entry
+
+
+def _write_entry(path: str,
+                 entry: Dict[str, Any],
+                 compress_level: int,
+                 ) -> int:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # written aside then moved, so that a reader never sees half a file;
+    # the name is unique to the write, as the executor runs several at once
+    tmp_path = "%s.%s.tmp" % (path, uuid.uuid4().hex)
+    try:
+        with gzip.open(tmp_path, "wt", compresslevel=compress_level) as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        _remove(tmp_path)
+        raise
+    return os.path.getsize(path)
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _scan(network_dir: str) -> List[os.DirEntry]:
+    entries = []
+    if not os.path.isdir(network_dir):
+        return entries
+
+    for sub_dir in os.scandir(network_dir):
+        if sub_dir.is_dir():
+            entries.extend(e for e in os.scandir(sub_dir.path) if e.name.endswith(".json.gz"))
+    return sorted(entries, key=lambda e: e.stat().st_mtime)
+
+
+class CachingLedgerFetchProcessor(EntryProcessor):
+    """
+    Wraps a ledger fetch processor with a cache of the validated ledgers on
+    local disk, gzipped and keyed by network and ledger index; a validated
+    ledger never changes.
+
+    With `is_read_through`, cached ledgers are served without calling the
+    wrapped processor; with `is_write_through`, fetched ledgers are stored.
+    Once the files exceed `max_size_bytes`, the least recently used
+    ledgers are evicted. The disk work runs in the default executor; a
+    ledger that cannot be stored (ie. disk full) is still returned.
+    """
+
+    def __init__(self,
+                 fetch_processor: EntryProcessor,
+                 cache_dir: str,
+                 network: str,
+                 max_size_bytes: int = 10 * 1024 ** 3,
+                 is_read_through: bool = True,
+                 is_write_through: bool = True,
+                 compress_level: int = 6,
+                 metrics: LedgerCacheMetrics = None,
+                 ):
+        self.fetch_processor = fetch_processor
+        self.network_dir = os.path.join(cache_dir, network)
+        self.max_size_bytes = max_size_bytes
+        self.is_read_through = is_read_through
+        self.is_write_through = is_write_through
+        self.compress_level = compress_level
+        self.metrics = metrics
+
+        # path -> size, least recently used first
+        self.entries: Optional[collections.OrderedDict] = None
+        self.size_bytes = 0
+        self.load_lock = asyncio.Lock()
+
+    def _path(self,
+              ledger_index: int,
+              ) -> str:
+        return os.path.join(
+            self.network_dir,
+            str(ledger_index // _LEDGERS_PER_DIR),
+            "%d.json.gz" % ledger_index,
+        )
+
+    async def _aload_entries(self):
+        async with self.load_lock:
+            if self.entries is not None:
+                return
+
+            scanned = await asyncio.get_running_loop().run_in_executor(None, _scan, self.network_dir)
+            self.entries = collections.OrderedDict((e.path, e.stat().st_size) for e in scanned)
+            self.size_bytes = sum(self.entries.values())
+            logger.info(
+                "[CachingLedgerFetchProcessor] %d ledger(s), %d bytes cached in %s",
+                len(self.entries),
+                self.size_bytes,
+                self.network_dir,
+            )
+
+    async def _aevict(self):
+        evicted_paths = []
+        while self.size_bytes > self.max_size_bytes and self.entries:
+            path, size = self.entries.popitem(last=False)
+            self.size_bytes -= size
+            evicted_paths.append(path)
+
+        if evicted_paths:
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(*[loop.run_in_executor(None, _remove, p) for p in evicted_paths])
+            if self.metrics:
+                self.metrics.eviction_counter.inc(len(evicted_paths))
+
+    async def _astore(self,
+                      path: str,
+                      entry: Dict[str, Any],
+                      ):
+        size = await asyncio.get_running_loop().run_in_executor(
+            None,
+            _write_entry,
+            path,
+            entry,
+            self.compress_level,
+        )
+        self.size_bytes += size - self.entries.pop(path, 0)
+        self.entries[path] = size
+        await self._aevict()
+
+    async def aprocess(self,
+                       entry: Any,
+                       ) -> List[Any]:
+        await self._aload_entries()
+        path = self._path(ledger_index_of(entry))
+
+        if self.is_read_through:
+            cached = await asyncio.get_running_loop().run_in_executor(None, _read_entry, path)
+            if cached is not None:
+                if path in self.entries:
+                    self.entries.move_to_end(path)
+                if self.metrics:
+                    self.metrics.hit_counter.inc()
+                return [cached]
+            # ie. removed as corrupt
+            self.size_bytes -= self.entries.pop(path, 0)
+
+        if self.metrics:
+            self.metrics.miss_counter.inc()
+        outputs = await self.fetch_processor.aprocess(entry)
+
+        if self.is_write_through:
+            for output in outputs:
+                # only the validated ledgers are immutable
+                if not output.get("validated"):
+                    continue
+                try:
+                    await self._astore(path, output)
+                except Exception as e:
+                    logger.warning("[CachingLedgerFetchProcessor] could not cache %s: %s", path, e)
+
+        if self.metrics:
+            self.metrics.size_bytes_gauge.set(self.size_bytes)
+        return outputs
@@ -1,10 +1,12 @@
+import asyncio
 import copy
 import logging
 from collections import namedtuple
-from typing import Any, Dict, List
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Tuple, Union
 
 from ekspiper.schema.xrp import XRPLTransactionSchema
-from .base import EntryProcessor
+from .base import BatchEntryError, BatchEntryProcessor
 
 logger = logging.getLogger(__name__)
 
@@ -25,7 +27,7 @@ class Transformer:
         return data_entry
 
 
-class ETLTemplateProcessor(EntryProcessor):
+class ETLTemplateProcessor(BatchEntryProcessor):
 
     def __init__(self,
                  validator: Validator,
@@ -42,6 +44,115 @@ class ETLTemplateProcessor(EntryProcessor):
             logger.warn("There were NO valid attributes")
         return [self.transformer.transform(validated_entry)]
 
+    async def aprocess_batch(self,
+                             data_entries: List[Any],
+                             ) -> List[Any]:
+        """
+        The entries failing their validation or transformation are handed
+        back in a BatchEntryError along with the outputs of the others.
+        """
+        output_entries = []
+        failed_entries = []
+        for data_entry in data_entries:
+            try:
+                output_entries.extend(await self.aprocess(data_entry))
+            except Exception as e:
+                if len(data_entries) == 1:
+                    raise
+                failed_entries.append((data_entry, e))
+
+        if failed_entries:
+            raise BatchEntryError(output_entries, failed_entries)
+        return output_entries
+
+
+# validators/transformers installed once per worker process so that
+# only the entries are serialized for every chunk
+_worker_etl_steps: List[Union[Validator, Transformer]] = []
+
+
+def _init_etl_worker(etl_steps: List[Union[Validator, Transformer]]):
+    global _worker_etl_steps
+    _worker_etl_steps = etl_steps
+
+
+def _run_etl_steps(data_entries: List[Any]) -> Tuple[List[Any], List[Tuple[int, str]]]:
+    """
+    The outputs of the entries that went through, and the (position,
+    error) of the ones that failed; the errors are sent back as text as
+    they may not pickle.
+    """
+    output_entries = []
+    failures = []
+    for i, data_entry in enumerate(data_entries):
+        try:
+            for step in _worker_etl_steps:
+                if isinstance(step, Validator):
+                    data_entry = step.validate(data_entry)
+                else:
+                    data_entry = step.transform(data_entry)
+        except Exception as e:
+            failures.append((i, "%s: %s" % (type(e).__name__, e)))
+            continue
+        output_entries.append(data_entry)
+    return output_entries, failures
+
+
+class ProcessPoolETLProcessor(BatchEntryProcessor):
+    """
+    Runs a chain of synchronous validators/transformers in a process pool
+    so that the CPU heavy work does not block the event loop.
+
+    Batches are split into chunks of `chunk_size` entries and the chunks
+    are spread across the pool. The chain is shipped to every worker once,
+    when the pool starts. Like ETLTemplateProcessor, the entries failing
+    their validation or transformation are handed back in a
+    BatchEntryError along with the outputs of the others.
+    """
+
+    def __init__(self,
+                 etl_steps: List[Union[Validator, Transformer]],
+                 max_workers: int = None,
+                 chunk_size: int = 50,
+                 ):
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1 but got '%s'" % chunk_size)
+
+        self.chunk_size = chunk_size
+        self.executor = ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=_init_etl_worker,
+            initargs=(etl_steps,),
+        )
+
+    async def aprocess_batch(self,
+                             data_entries: List[Any],
+                             ) -> List[Any]:
+        loop = asyncio.get_running_loop()
+        chunk_futures = [
+            loop.run_in_executor(
+                self.executor,
+                _run_etl_steps,
+                data_entries[i:i + self.chunk_size],
+            ) for i in range(0, len(data_entries), self.chunk_size)
+        ]
+
+        output_entries = []
+        failed_entries = []
+        for chunk_index, (chunk_output_entries, failures) in enumerate(await asyncio.gather(*chunk_futures)):
+            output_entries.extend(chunk_output_entries)
+            for i, error in failures:
+                failed_entries.append((data_entries[chunk_index * self.chunk_size + i], ValueError(error)))
+
+        if len(data_entries) == 1 and failed_entries:
+            raise failed_entries[0][1]
+        if failed_entries:
+            raise BatchEntryError(output_entries, failed_entries)
+        return output_entries
+
+    def shutdown(self):
+        self.executor.shutdown()
+
 
 class GenericValidator(Validator):
     def __init__(self,
@@ -1,23 +1,83 @@
+import asyncio
+import collections
+import copy
+import json
 import logging
 from typing import Any, Dict, List, Union
 
-from xrpl.asyncio.clients import AsyncJsonRpcClient
+from xrpl.asyncio.clients.async_client import AsyncClient
 from xrpl.models.currencies import XRP, IssuedCurrency
 from xrpl.models.requests.book_offers import BookOffers
 
-from ekspiper.processor.base import EntryProcessor
+from ekspiper.metric.prom import BookOffersCacheMetrics, BookOffersFetchMetrics
+from ekspiper.processor.base import BatchEntryError, BatchEntryProcessor, EntryProcessor
+from ekspiper.util.callable import MalformedEntryError, RPCResponseError
+from ekspiper.util.xrplpy_patches import PagedBookOffers
 
 logger = logging.getLogger(__name__)
 
 
-class XRPLFetchBookOffersProcessor(EntryProcessor):
+class XRPLFetchBookOffersProcessor(BatchEntryProcessor):
+    """
+    Fetches the whole order book of a BookOffers request, following the
+    `marker` from page to page (`page_size` offers each, the server's
+    default when None) up to `max_page_count` pages. The pages after the
+    first are pinned to the ledger of the first, so that they make up one
+    snapshot.
+
+    Emits one message per book with the offers of all of its pages, or
+    with `is_stream_pages` each page as it comes. The pages of a book are
+    fetched one after the other, the books concurrently, with at most
+    `max_concurrency` requests in flight across all of them.
+    """
+
     def __init__(self,
-                 rpc_client: AsyncJsonRpcClient,
+                 rpc_client: AsyncClient,
+                 page_size: int = None,
+                 max_page_count: int = 100,
+                 is_stream_pages: bool = False,
+                 max_concurrency: int = 8,
+                 metrics: BookOffersFetchMetrics = None,
                  ):
         # more than efficient for a request-response query pattern
         #  - server is not pushing any information; must have a request
         #  - make sure HTTP keep-alive to avoid reconnect/establishment
         self.rpc_client = rpc_client
+        self.page_size = page_size
+        self.max_page_count = max_page_count
+        self.is_stream_pages = is_stream_pages
+        self.metrics = metrics
+
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _afetch_page(self,
+                           entry: BookOffers,
+                           ledger_index: Union[str, int],
+                           marker: Any,
+                           ) -> Dict[str, Any]:
+        request = PagedBookOffers(
+            taker_gets=entry.taker_gets,
+            taker_pays=entry.taker_pays,
+            ledger_hash=entry.ledger_hash,
+            ledger_index=ledger_index,
+            limit=self.page_size or entry.limit,
+            taker=entry.taker,
+            marker=marker,
+        )
+        async with self.semaphore:
+            response = await self.rpc_client.request(request)
+
+        # check the response success
+        if not response.is_successful():
+            raise RPCResponseError(
+                "Error fetching book offers (%s): %s" % (response.result.get("error"), entry),
+                error=response.result.get("error"),
+            )
+
+        if self.metrics:
+            self.metrics.page_counter.inc()
+            self.metrics.byte_counter.inc(len(json.dumps(response.result)))
+        return response.result
 
     async def aprocess(self,
                        entry: BookOffers,
@@ -26,7 +86,7 @@ class XRPLFetchBookOffersProcessor(EntryProcessor):
         Presume the entry is the BookOffers
         """
         if type(entry) != BookOffers:
-            raise ValueError(
+            raise MalformedEntryError(
                 "[XRPLFetchBookOffersProcessor] Expected 'BookOffers' but got '%s': %s" % (
                     type(entry),
                     entry,
@@ -37,21 +97,64 @@ class XRPLFetchBookOffersProcessor(EntryProcessor):
             entry,
         )
 
-        response = await self.rpc_client.request(entry)
-
-        # check the response success
-        if not response.is_successful():
-            raise ValueError("Error fetching book offers: %s" % entry)
+        pages = [await self._afetch_page(entry, entry.ledger_index, None)]
+        ledger_index = entry.ledger_index
+        if not entry.ledger_hash:
+            # ie. 'validated' or 'current'; stay on the ledger of the first page
+            ledger_index = pages[0].get("ledger_index") or pages[0].get("ledger_current_index") or ledger_index
+
+        while pages[-1].get("marker") is not None:
+            if len(pages) >= self.max_page_count:
+                logger.warning(
+                    "[XRPLFetchBookOffersProcessor] Stopping after %d pages: %s",
+                    len(pages),
+                    entry,
+                )
+                if self.metrics:
+                    self.metrics.truncated_counter.inc()
+                break
+            pages.append(await self._afetch_page(entry, ledger_index, pages[-1]["marker"]))
 
-        message = response.result
+        if self.metrics:
+            self.metrics.pages_per_book.observe(len(pages))
 
         """
         Reference:
-          txns = message.get("ledger").get("transactions")
+          offers = message.get("offers")
           ledger_index = message.get("ledger_index")
         """
+        if self.is_stream_pages:
+            return pages
+
+        message = {k: v for k, v in pages[0].items() if k != "marker"}
+        message["offers"] = [o for page in pages for o in page.get("offers", [])]
         return [message]
 
+    async def aprocess_batch(self,
+                             entries: List[BookOffers],
+                             ) -> List[Dict[str, Any]]:
+        """
+        The books failing to be fetched are handed back in a
+        BatchEntryError along with the messages of the others.
+        """
+        # the same book asked for twice is fetched once
+        books = list({json.dumps(e.to_dict(), sort_keys=True): e for e in entries}.values())
+        outputs = await asyncio.gather(*[self.aprocess(e) for e in books], return_exceptions=True)
+
+        messages = []
+        failed_entries = []
+        for book, output in zip(books, outputs):
+            if isinstance(output, BaseException):
+                failed_entries.append((book, output))
+                continue
+            messages.extend(output)
+
+        if len(books) == 1 and failed_entries:
+            raise failed_entries[0][1]
+        if failed_entries:
+            raise BatchEntryError(messages, failed_entries)
+        return messages
+
 
 class BuildBookOfferRequestsProcessor(EntryProcessor):
 
@@ -131,3 +234,156 @@ class BuildBookOfferRequestsProcessor(EntryProcessor):
         logger.info("[BuildBookOfferRequestsProcessor] Done iteration.")
 
         return book_offers_requests
+
+
+def book_key(entry: BookOffers) -> str:
+    """
+    What identifies an order book request, regardless of the ledger.
+    """
+    params = {k: v for k, v in entry.to_dict().items() if k not in ("id", "ledger_index", "ledger_hash")}
+    return json.dumps(params, sort_keys=True)
+
+
+class _Fetch:
+    def __init__(self,
+                 entry: BookOffers,
+                 ):
+        # the newest request it will send, and the oldest ledger waiting for it
+        self.entry = entry
+        self.first_ledger_index: int = entry.ledger_index
+        self.is_fetching = False
+        self.task: asyncio.Task = None
+
+
+class _Book:
+    def __init__(self):
+        # the messages of the newest fetch, and the ledger they are from
+        self.messages: List[Dict[str, Any]] = None
+        self.ledger_index: int = None
+        # the fetch to join
+        self.fetch: _Fetch = None
+
+
+class CachingBookOffersFetchProcessor(EntryProcessor):
+    """
+    Wraps a book offers fetch processor with a cache per order book, across
+    ledgers. A book is fetched again only when it is asked for at a ledger
+    at least `min_refetch_interval_ledgers` newer than the cached snapshot;
+    until then the snapshot is served, so that a busy book is fetched once
+    every N ledgers instead of on every close.
+
+    Requests for a book waiting for its fetch are merged into it, the
+    fetch going out for the newest ledger asked for, as long as that stays
+    within `min_refetch_interval_ledgers` of every request waiting for it. At most
+    `max_concurrency` fetches run at once. The messages carry the
+    `ledger_index` they were fetched at; a request for a ledger older than
+    the snapshot, or than the fetch under way, is fetched on its own.
+    """
+
+    def __init__(self,
+                 fetch_processor: EntryProcessor,
+                 min_refetch_interval_ledgers: int = 10,
+                 max_concurrency: int = 8,
+                 max_book_count: int = 10_000,
+                 metrics: BookOffersCacheMetrics = None,
+                 ):
+        if min_refetch_interval_ledgers < 1:
+            raise ValueError(
+                "min_refetch_interval_ledgers must be at least 1 but got '%s'" % min_refetch_interval_ledgers
+            )
+
+        self.fetch_processor = fetch_processor
+        self.min_refetch_interval_ledgers = min_refetch_interval_ledgers
+        self.max_book_count = max_book_count
+        self.metrics = metrics
+
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        # least recently asked for first
+        self.books: collections.OrderedDict = collections.OrderedDict()
+
+    def _get_book(self,
+                  key: str,
+                  ) -> _Book:
+        book = self.books.get(key)
+        if book is None:
+            book = self.books[key] = _Book()
+            evict_count = max(len(self.books) - self.max_book_count, 0)
+            # the books with a fetch going on are kept
+            for old_key in [k for k, b in self.books.items() if b.fetch is None and k != key][:evict_count]:
+                del self.books[old_key]
+        self.books.move_to_end(key)
+        if self.metrics:
+            self.metrics.book_count_gauge.set(len(self.books))
+        return book
+
+    def _is_fresh(self,
+                  ledger_index: int,
+                  since_ledger_index: int,
+                  ) -> bool:
+        return since_ledger_index is not None and \
+            0 <= ledger_index - since_ledger_index < self.min_refetch_interval_ledgers
+
+    def _record(self,
+                outcome: str,
+                ):
+        if self.metrics:
+            self.metrics.request_counter.labels(self.metrics.name, outcome).inc()
+
+    async def _afetch(self,
+                      book: _Book,
+                      fetch: _Fetch,
+                      ) -> List[Dict[str, Any]]:
+        try:
+            async with self.semaphore:
+                # the newest request merged while waiting
+                entry = fetch.entry
+                fetch.is_fetching = True
+                messages = await self.fetch_processor.aprocess(entry)
+        finally:
+            if book.fetch is fetch:
+                book.fetch = None
+
+        if book.ledger_index is None or entry.ledger_index > book.ledger_index:
+            book.messages = messages
+            book.ledger_index = entry.ledger_index
+        return messages
+
+    async def aprocess(self,
+                       entry: BookOffers,
+                       ) -> List[Dict[str, Any]]:
+        if type(entry) != BookOffers:
+            raise MalformedEntryError(
+                "[CachingBookOffersFetchProcessor] Expected 'BookOffers' but got '%s': %s" % (
+                    type(entry),
+                    entry,
+                ))
+
+        ledger_index = entry.ledger_index
+        if not isinstance(ledger_index, int):
+            # ie. 'validated'; nothing to compare the snapshot with
+            self._record("fetched")
+            return await self.fetch_processor.aprocess(entry)
+
+        book = self._get_book(book_key(entry))
+        if self._is_fresh(ledger_index, book.ledger_index):
+            self._record("hit")
+            return copy.deepcopy(book.messages)
+
+        fetch = book.fetch
+        if (book.ledger_index is not None and ledger_index < book.ledger_index) or \
+                (fetch and ledger_index < fetch.entry.ledger_index):
+            # the book is ahead of the ledger asked for
+            self._record("fetched")
+            return await self.fetch_processor.aprocess(entry)
+
+        if fetch and self._is_fresh(ledger_index, fetch.first_ledger_index):
+            self._record("joined")
+            if not fetch.is_fetching:
+                fetch.entry = entry
+        else:
+            # too far ahead of the requests already waiting
+            self._record("fetched")
+            fetch = book.fetch = _Fetch(entry)
+            fetch.task = asyncio.create_task(self._afetch(book, fetch))
+
+        return copy.deepcopy(await asyncio.shield(fetch.task))
@@ -1,37 +1,137 @@
+import asyncio
+import collections
 import copy
 import logging
-from typing import Any, Dict, List, Union
+from concurrent.futures import Executor
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 import xrpl.models
-from xrpl.asyncio.clients import AsyncJsonRpcClient
+from xrpl.asyncio.clients.async_client import AsyncClient
 
-from ekspiper.processor.base import EntryProcessor
+from ekspiper.connect.rpc import BatchNotSupportedError
+from ekspiper.processor.base import BatchEntryProcessor, EntryProcessor
+from ekspiper.util.callable import MalformedEntryError, RPCResponseError, is_fatal_rpc_error
+from ekspiper.util.concurrency import THROTTLE_ERRORS
+from ekspiper.util.ledger_codec import decode_binary_ledger
 
 logger = logging.getLogger(__name__)
 
 
+def read_last_ledger_index(index_file_path: str) -> Optional[int]:
+    """
+    The last ledger index written by LedgerIndexProcessor, if any.
+    """
+    last_ledger = None
+    try:
+        with open(index_file_path, "r") as f:
+            for line in f:
+                if line.strip():
+                    last_ledger = int(line)
+    except FileNotFoundError:
+        logger.info("[FetchTransactions] no ledger index file at %s", index_file_path)
+    return last_ledger
+
+
 class LedgerIndexProcessor:
-    def __init__(self, index_file_path: str = None):
-        self.last_ledger = None
+    """
+    Keeps the low watermark of the fetched ledgers in the index file: the
+    highest ledger index with every ledger up to it fetched. The live and
+    the backfill flows share one, so that a restart in the middle of a
+    backfill resumes from the first missing ledger rather than the tip.
+
+    The watermark starts from the index file, or the first ledger fetched.
+    A ledger still missing after `max_pending_count` newer ones were
+    fetched (ie. dead-lettered) is given up on.
+    """
+
+    def __init__(self,
+                 index_file_path: str = None,
+                 max_pending_count: int = 100_000,
+                 ):
         self.index_file_path = index_file_path
+        self.max_pending_count = max_pending_count
+
+        self.watermark = read_last_ledger_index(index_file_path) if index_file_path else None
+        # fetched above the watermark
+        self.completed = set()
+        self.last_ledger = self.watermark
 
     def process(self, ledger_index: int):
-        if self.index_file_path is not None:
-            logger.info("ledger_index: " + str(ledger_index))
-            logger.info("last_ledger: " + str(self.last_ledger))
+        if self.watermark is None:
+            self.watermark = ledger_index
+        elif ledger_index > self.watermark:
+            self.completed.add(ledger_index)
+
+        if len(self.completed) > self.max_pending_count:
+            logger.warning(
+                "[LedgerIndexProcessor] giving up on ledger(s) %d to %d",
+                self.watermark + 1,
+                min(self.completed) - 1,
+            )
+            self.watermark = min(self.completed) - 1
+        while self.watermark + 1 in self.completed:
+            self.watermark += 1
+            self.completed.remove(self.watermark)
 
-            if self.last_ledger is None or ledger_index - self.last_ledger >= 100:
+        if self.index_file_path is not None:
+            if self.last_ledger is None or self.watermark - self.last_ledger >= 100:
                 with open(self.index_file_path, "a+") as f:
-                    logger.info("[FetchTransactions] Writing index: " + str(ledger_index) + " to file: " + self.index_file_path)
-                    f.write(str(ledger_index))
-                    self.last_ledger = ledger_index
+                    logger.info("[FetchTransactions] Writing index: " + str(self.watermark) + " to file: " + self.index_file_path)
+                    f.write(str(self.watermark) + "\n")
+                    self.last_ledger = self.watermark
+
+
+def ledger_index_of(entry: Union[int, dict]) -> int:
+    if type(entry) not in [int, dict]:
+        raise MalformedEntryError(
+            "[XRPLFetchLedgerDetailsProcessor] Expected 'int' but got '%s': %s" % (
+                type(entry),
+                entry,
+            ))
+
+    ledger_index = None
+
+    # TODO: input extraction should be done elsewhere; not its responsibility
+    if type(entry) == int:
+        ledger_index = entry
+    elif type(entry) == dict:
+        ledger_index = entry.get(
+            "result", {}).get("ledger_index") or entry.get("ledger_index")
+
+    if not ledger_index:
+        raise MalformedEntryError(
+            "[XRPLFetchLedgerDetailsProcessor] missing ledger index: %s" % (
+                entry,
+            ))
+
+    return ledger_index
+
+
+def build_ledger_request(ledger_index: int,
+                         is_binary: bool = False,
+                         ) -> xrpl.models.Ledger:
+    return xrpl.models.Ledger(
+        ledger_index=ledger_index,
+        transactions=True,
+        expand=True,
+        binary=is_binary,
+    )
 
 
 class XRPLFetchLedgerDetailsProcessor(EntryProcessor):
+    """
+    Fetches a ledger with its transactions expanded.
+
+    With `is_binary`, the ledger is fetched in binary (several times
+    smaller on the wire) and decoded back into the JSON shape on
+    `decode_executor` (ie. a process pool), off the event loop.
+    """
 
     def __init__(self,
-                 rpc_client: AsyncJsonRpcClient,
-                 ledger_index_processor: LedgerIndexProcessor,
+                 rpc_client: AsyncClient,
+                 ledger_index_processor: LedgerIndexProcessor = None,
+                 is_binary: bool = False,
+                 decode_executor: Executor = None,
                  ):
         # more than efficient for a request-response query pattern
         #  - server is not pushing any information; must have a request
@@ -39,6 +139,8 @@ class XRPLFetchLedgerDetailsProcessor(EntryProcessor):
         self.rpc_client = rpc_client
         self.last_ledger = None
         self.ledger_index_processor = ledger_index_processor
+        self.is_binary = is_binary
+        self.decode_executor = decode_executor
 
     async def aprocess(self,
                        entry: Union[int, dict],  # ledger index
@@ -46,49 +148,34 @@ class XRPLFetchLedgerDetailsProcessor(EntryProcessor):
         """
         Presume the entry is the ledger index (int).
         """
-        if type(entry) not in [int, dict]:
-            raise ValueError(
-                "[XRPLFetchLedgerDetailsProcessor] Expected 'int' but got '%s': %s" % (
-                    type(entry),
-                    entry,
-                ))
-
-        ledger_index = None
-
-        # TODO: input extraction should be done elsewhere; not its responsibility
-        if type(entry) == int:
-            ledger_index = entry
-        elif type(entry) == dict:
-            ledger_index = entry.get(
-                "result", {}).get("ledger_index") or entry.get("ledger_index")
-
-        if not ledger_index:
-            raise ValueError(
-                "[XRPLFetchLedgerDetailsProcessor] missing ledger index: %s" % (
-                    entry,
-                ))
+        ledger_index = ledger_index_of(entry)
 
         logger.info(
             "[XRPLFetchLedgerDetailsProcessor] Fetching transactions for ledger '%d'",
             ledger_index,
         )
 
-        self.ledger_index_processor.process(ledger_index)
-
         # build the request
-        req = xrpl.models.Ledger(
-            ledger_index=ledger_index,
-            transactions=True,
-            expand=True,
-        )
+        req = build_ledger_request(ledger_index, is_binary=self.is_binary)
         response = await self.rpc_client.request(req)
 
         # check the response success
         if not response.is_successful():
             logger.error("[XRPLFetchLedgerDetailsProcessor] failed to fetch request, error: " + str(response))
-            raise ValueError("Error fetching transactions for ledger :" + str(ledger_index))
+            raise RPCResponseError("Error fetching transactions for ledger :%s (%s)" % (
+                ledger_index,
+                response.result.get("error"),
+            ), error=response.result.get("error"))
 
         message = response.result
+        if self.is_binary:
+            message = await asyncio.get_running_loop().run_in_executor(
+                self.decode_executor,
+                decode_binary_ledger,
+                message,
+            )
+        if self.ledger_index_processor:
+            self.ledger_index_processor.process(ledger_index)
         """
         Reference:
           txns = message.get("ledger").get("transactions")
@@ -97,6 +184,107 @@ class XRPLFetchLedgerDetailsProcessor(EntryProcessor):
         return [message]
 
 
+class XRPLBatchFetchLedgerDetailsProcessor(BatchEntryProcessor):
+    """
+    Fetches a micro-batch of ledgers with a single JSON-RPC batch request,
+    falling back to concurrent requests over the pooled connections when
+    the client or the endpoint does not take batches.
+
+    Ledgers fetched by a partially failed attempt are kept (up to
+    `max_kept_count`, about 10 batches) so that the retry only asks for
+    the missing ones. A busy endpoint fails the batch to be retried; only
+    an endpoint refusing it turns batching off.
+    """
+
+    def __init__(self,
+                 rpc_client: AsyncClient,
+                 ledger_index_processor: LedgerIndexProcessor = None,
+                 max_kept_count: int = 100,
+                 ):
+        self.rpc_client = rpc_client
+        self.ledger_index_processor = ledger_index_processor
+        self.max_kept_count = max_kept_count
+
+        self.is_batch_supported = hasattr(rpc_client, "request_batch_impl")
+        self.fetched: Dict[int, Dict[str, Any]] = collections.OrderedDict()
+
+    def _keep(self,
+              ledger_indices: List[int],
+              responses: List[Any],
+              ) -> List[Tuple[str, Any]]:
+        # (description, error code) of each failed ledger
+        errors = []
+        for ledger_index, response in zip(ledger_indices, responses):
+            if isinstance(response, Exception):
+                errors.append(("%s: %s" % (ledger_index, response), getattr(response, "error", None)))
+            elif not response.is_successful():
+                error = response.result.get("error")
+                errors.append(("%s: %s" % (ledger_index, error), error))
+            else:
+                self.fetched[ledger_index] = response.result
+        return errors
+
+    def _trim(self):
+        while len(self.fetched) > self.max_kept_count:
+            self.fetched.popitem(last=False)
+
+    async def _afetch(self,
+                      ledger_indices: List[int],
+                      ) -> List[Tuple[str, Any]]:
+        requests = [build_ledger_request(i) for i in ledger_indices]
+        if self.is_batch_supported:
+            try:
+                return self._keep(ledger_indices, await self.rpc_client.request_batch_impl(requests))
+            except BatchNotSupportedError as e:
+                logger.warning("[XRPLBatchFetchLedgerDetailsProcessor] falling back to single requests: %s", e)
+                self.is_batch_supported = False
+
+        responses = await asyncio.gather(
+            *[self.rpc_client.request(r) for r in requests],
+            return_exceptions=True,
+        )
+        return self._keep(ledger_indices, responses)
+
+    async def aprocess_batch(self,
+                             entries: List[Union[int, dict]],
+                             ) -> List[Dict[str, Any]]:
+        ledger_indices = list(dict.fromkeys(ledger_index_of(e) for e in entries))
+        missing_indices = [i for i in ledger_indices if i not in self.fetched]
+
+        logger.info(
+            "[XRPLBatchFetchLedgerDetailsProcessor] Fetching %d ledger(s) out of %d",
+            len(missing_indices),
+            len(ledger_indices),
+        )
+        try:
+            errors = await self._afetch(missing_indices) if missing_indices else []
+            if errors:
+                message = "Error fetching transactions for %d ledger(s): %s" % (
+                    len(errors),
+                    ", ".join(d for d, _ in errors),
+                )
+                error_codes = {e for _, e in errors}
+                # retrying would only help if one of them can succeed
+                if all(is_fatal_rpc_error(e) for e in error_codes):
+                    raise RPCResponseError(message, error=error_codes.pop())
+                # report a throttled ledger first so that the concurrency backs off
+                retryable_codes = sorted(
+                    (e for e in error_codes if not is_fatal_rpc_error(e)),
+                    key=lambda e: (e not in THROTTLE_ERRORS, str(e)),
+                )
+                raise RPCResponseError(message, error=retryable_codes[0])
+
+            messages = []
+            for ledger_index in ledger_indices:
+                if self.ledger_index_processor:
+                    self.ledger_index_processor.process(ledger_index)
+                messages.append(self.fetched.pop(ledger_index))
+            return messages
+        finally:
+            # only what is kept for the retries counts, the batch is taken out first
+            self._trim()
+
+
 class XRPLExtractTransactionsFromLedgerProcessor(EntryProcessor):
     def __init__(self,
                  is_include_ledger_index=True,
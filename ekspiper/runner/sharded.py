@@ -0,0 +1,231 @@
+import asyncio
+import logging
+import multiprocessing
+import time
+from typing import Any, Awaitable, Callable, Dict, List
+
+from ekspiper.connect.reorder import ledger_index_key
+from ekspiper.metric.prom import ShardedRunnerMetrics
+from ekspiper.processor.base import EntryProcessor
+
+logger = logging.getLogger(__name__)
+
+
+class ShardProgress:
+    """
+    Counters shared between a shard process and the supervisor; they
+    survive the restarts of the shard.
+    """
+
+    def __init__(self,
+                 mp_context,
+                 ):
+        self.processed_count = mp_context.Value("q", 0)
+        # last position the shard reported; 0 until there is one
+        self.checkpoint = mp_context.Value("q", 0)
+        self.restart_count = mp_context.Value("i", 0)
+
+    def increment(self,
+                  count: int = 1,
+                  ):
+        with self.processed_count.get_lock():
+            self.processed_count.value += count
+
+    def set_checkpoint(self,
+                       checkpoint: int,
+                       ):
+        self.checkpoint.value = checkpoint
+
+    def advance_checkpoint(self,
+                           checkpoint: int,
+                           incr_by: int = 1,
+                           ):
+        """
+        Moves the checkpoint to `checkpoint` if it is further along the
+        `incr_by` direction, so that an entry finishing late does not
+        pull it back.
+        """
+        with self.checkpoint.get_lock():
+            if not self.checkpoint.value or (checkpoint - self.checkpoint.value) * incr_by > 0:
+                self.checkpoint.value = checkpoint
+
+
+class ShardProgressProcessor(EntryProcessor):
+    """
+    Counts the ledgers going through and checkpoints the furthest index
+    reached, going by `incr_by`.
+
+    A restarted shard re-emits the ledgers short of the checkpoint it
+    resumes from; they were counted by the crashed run, so only the ones
+    past it are counted.
+    """
+
+    def __init__(self,
+                 progress: ShardProgress,
+                 incr_by: int = 1,
+                 ):
+        if incr_by not in [1, -1]:
+            raise ValueError("incr_by must be either 1 or -1 but got '%s'" % incr_by)
+
+        self.progress = progress
+        self.incr_by = incr_by
+        # checkpoint of the previous run, if any
+        self.resume_checkpoint = progress.checkpoint.value or None
+
+    async def aprocess(self,
+                       entry: Any,
+                       ) -> List[Any]:
+        ledger_index = ledger_index_key(entry)
+        if self.resume_checkpoint is None or (ledger_index - self.resume_checkpoint) * self.incr_by > 0:
+            self.progress.increment()
+        self.progress.advance_checkpoint(ledger_index, self.incr_by)
+        return [entry]
+
+
+def _run_shard(shard_main: Callable[[int, int, ShardProgress], Awaitable[None]],
+               shard_index: int,
+               shard_size: int,
+               progress: ShardProgress,
+               ):
+    asyncio.run(shard_main(shard_index, shard_size, progress))
+
+
+class ShardedProcessRunner:
+    """
+    Runs `shard_main(shard_index, shard_size, progress)` in its own process
+    and event loop for every shard, so that the shards use as many cores.
+
+    The supervisor restarts a crashed shard after `restart_delay_s`, up to
+    `max_restart_count` times, and reports the summed progress every
+    `report_interval_s`. `shard_main` must be picklable (ie. a module-level
+    function or a partial of one) and can resume from `progress.checkpoint`.
+    """
+
+    def __init__(self,
+                 shard_main: Callable[[int, int, ShardProgress], Awaitable[None]],
+                 shard_size: int,
+                 name: str = "",
+                 max_restart_count: int = 5,
+                 restart_delay_s: float = 5,
+                 report_interval_s: float = 10,
+                 poll_interval_s: float = 0.5,
+                 mp_start_method: str = "spawn",
+                 metrics: ShardedRunnerMetrics = None,
+                 ):
+        if shard_size < 1:
+            raise ValueError("shard_size must be at least 1 but got '%s'" % shard_size)
+
+        self.shard_main = shard_main
+        self.shard_size = shard_size
+        self.name = name
+        self.max_restart_count = max_restart_count
+        self.restart_delay_s = restart_delay_s
+        self.report_interval_s = report_interval_s
+        self.poll_interval_s = poll_interval_s
+        self.metrics = metrics
+
+        self.mp_context = multiprocessing.get_context(mp_start_method)
+        self.progresses = [ShardProgress(self.mp_context) for _ in range(shard_size)]
+        self.processes: Dict[int, multiprocessing.Process] = {}
+        self.failed_shards = set()
+
+    def _start_shard(self,
+                     shard_index: int,
+                     ):
+        process = self.mp_context.Process(
+            target=_run_shard,
+            args=(self.shard_main, shard_index, self.shard_size, self.progresses[shard_index]),
+            name="%s-shard-%d" % (self.name, shard_index),
+            daemon=True,
+        )
+        process.start()
+        self.processes[shard_index] = process
+        logger.info("[ShardedProcessRunner:%s] started shard %d (pid %d)", self.name, shard_index, process.pid)
+
+    def processed_count(self) -> int:
+        return sum(p.processed_count.value for p in self.progresses)
+
+    def _report(self,
+                start_time: float,
+                ):
+        processed_count = self.processed_count()
+        logger.info(
+            "[ShardedProcessRunner:%s] processed %d entries (%.1f/s), %d shard(s) running",
+            self.name,
+            processed_count,
+            processed_count / max(time.monotonic() - start_time, 1e-9),
+            len(self.processes),
+        )
+        if self.metrics:
+            for i, progress in enumerate(self.progresses):
+                self.metrics.processed_gauge.labels(self.name, str(i)).set(progress.processed_count.value)
+
+    def run(self) -> bool:
+        """
+        Blocks until every shard finished or gave up; returns whether
+        all of them finished cleanly.
+        """
+        start_time = time.monotonic()
+        next_report_at = start_time + self.report_interval_s
+        restart_at: Dict[int, float] = {}
+
+        for i in range(self.shard_size):
+            self._start_shard(i)
+
+        try:
+            while self.processes or restart_at:
+                time.sleep(self.poll_interval_s)
+                now = time.monotonic()
+
+                for i, process in list(self.processes.items()):
+                    if process.is_alive():
+                        continue
+
+                    process.join()
+                    del self.processes[i]
+                    if process.exitcode == 0:
+                        logger.info("[ShardedProcessRunner:%s] shard %d finished", self.name, i)
+                        continue
+
+                    progress = self.progresses[i]
+                    if progress.restart_count.value >= self.max_restart_count:
+                        logger.error(
+                            "[ShardedProcessRunner:%s] shard %d exited with %s; giving up after %d restart(s)",
+                            self.name,
+                            i,
+                            process.exitcode,
+                            progress.restart_count.value,
+                        )
+                        self.failed_shards.add(i)
+                        continue
+
+                    logger.warning(
+                        "[ShardedProcessRunner:%s] shard %d exited with %s; restarting in %s seconds",
+                        self.name,
+                        i,
+                        process.exitcode,
+                        self.restart_delay_s,
+                    )
+                    restart_at[i] = now + self.restart_delay_s
+
+                for i, due_at in list(restart_at.items()):
+                    if due_at > now:
+                        continue
+
+                    del restart_at[i]
+                    self.progresses[i].restart_count.value += 1
+                    if self.metrics:
+                        self.metrics.restart_counter.labels(self.name, str(i)).inc()
+                    self._start_shard(i)
+
+                if now >= next_report_at:
+                    self._report(start_time)
+                    next_report_at = now + self.report_interval_s
+        finally:
+            for process in self.processes.values():
+                process.terminate()
+            for process in self.processes.values():
+                process.join()
+
+        self._report(start_time)
+        return not self.failed_shards
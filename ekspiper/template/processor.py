@@ -1,9 +1,19 @@
+from __future__ import annotations
+
+import asyncio
 import collections
+import copy
 import logging
-from typing import List
+import time
+from typing import Any, Awaitable, Callable, List
 
-from ekspiper.collector.output import OutputCollector
+from ekspiper.collector.output import BatchOutputCollector, OutputCollector
+from ekspiper.connect.data import DataSink
+from ekspiper.connect.dead_letter import build_dead_letter
+from ekspiper.metric.prom import FlowMetrics, FlowStageMetrics
+from ekspiper.processor.base import BatchEntryError, BatchEntryProcessor
 from ekspiper.util.callable import RetryWrapper
+from ekspiper.util.concurrency import AIMDConcurrencyController
 
 logger = logging.getLogger(__name__)
 
@@ -11,21 +21,100 @@ ProcessCollectorsMap = collections.namedtuple(
     "ProcessCollectorsMap", [
         "processor",
         "collectors",
-    ]
+        "name",
+    ],
+    defaults=[None],
 )
 
 
+def stage_name_of(process_collectors_map: ProcessCollectorsMap) -> str:
+    return process_collectors_map.name or type(process_collectors_map.processor).__name__
+
+
+def collector_name_of(collector: OutputCollector) -> str:
+    return getattr(collector, "name", None) or type(collector).__name__
+
+
 class TemplateFlow:
     """
     Every ekspiper.Processor is associated with a corresponding set of ekspiper.Collectors.
+
+    Up to `max_in_flight` messages are taken from the iterator and run
+    through the processors concurrently. With the default of 1, messages
+    are processed strictly one after another.
+
+    With `max_batch_size` above 1, messages are grouped into micro-batches
+    of up to that size, waiting at most `max_linger_s` after the first
+    message of a batch. A batch is then the unit that is put in flight.
+
+    When `metrics` is given, every stage records its processor and collector
+    latencies, messages in/out, retries and errors under the flow `name`.
+
+    A message that fails in a stage is logged and the flow moves on. When a
+    `dead_letter_sink` is given, the message is also written to it along with
+    the error, stage and attempt count, and the remaining stages still run.
+    A micro-batch failing in a BatchEntryProcessor is retried one message
+    at a time (only its failed entries on a BatchEntryError), so that only
+    the failing messages are dropped or dead-lettered.
+
+    A `retry_wrapper` built around a CircuitBreaker and/or a RetryBudget
+    can be shared by the flows calling the same endpoint.
+
+    With a `concurrency_controller`, the window follows the limit it adapts
+    from the processor latencies and errors instead of `max_in_flight`.
     """
 
     def __init__(self,
                  process_collectors_maps: List[ProcessCollectorsMap],
                  output_collector: OutputCollector = None,
+                 max_in_flight: int = 1,
+                 max_batch_size: int = 1,
+                 max_linger_s: float = 0.0,
+                 name: str = "",
+                 metrics: FlowMetrics = None,
+                 dead_letter_sink: DataSink = None,
+                 retry_wrapper: RetryWrapper = None,
+                 concurrency_controller: AIMDConcurrencyController = None,
                  ):
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1 but got '%s'" % max_in_flight)
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1 but got '%s'" % max_batch_size)
+
         self.output_collector = output_collector
         self.process_collectors_maps = process_collectors_maps
+        self.max_in_flight = max_in_flight
+        self.max_batch_size = max_batch_size
+        self.max_linger_s = max_linger_s
+        self.retry_wrapper = retry_wrapper if retry_wrapper else RetryWrapper()
+        self.concurrency_controller = concurrency_controller
+        self.name = name
+        self.dead_letter_sink = dead_letter_sink
+        self.stage_metrics: List[FlowStageMetrics] = [
+            metrics.stage(
+                flow_name=name,
+                stage_name=stage_name_of(pc),
+                collector_names=[collector_name_of(c) for c in pc.collectors],
+            ) if metrics else None
+            for pc in process_collectors_maps
+        ]
+
+    def with_stage(self,
+                   stage: str,
+                   ) -> TemplateFlow:
+        """
+        A copy of the flow running only the given stage, ie. to replay the
+        messages dead-lettered in it without re-running the other stages.
+        """
+        stage_names = [stage_name_of(pc) for pc in self.process_collectors_maps]
+        if stage not in stage_names:
+            raise ValueError("[Template Flow] unknown stage '%s', expected one of: %s" % (stage, stage_names))
+
+        i = stage_names.index(stage)
+        flow = copy.copy(self)
+        flow.process_collectors_maps = self.process_collectors_maps[i:i + 1]
+        flow.stage_metrics = self.stage_metrics[i:i + 1]
+        return flow
 
     async def aexecute(self, message_iterator):
         try:
@@ -37,50 +126,324 @@ class TemplateFlow:
         if not message_iterator:
             raise ValueError("message_iterator is not specified")
 
-        retry_wrapper = RetryWrapper()
-        # should_stop = False
-        # ripple_epoch = 946684800
-        # epoch_time_end = int(time.time()) - ripple_epoch
-        # timeframe = 7776000  # 7776000 90 days  # 86400 5 days?
-        # epoch_time_start = 1677038441 - ripple_epoch  # epoch_time_end - timeframe
+        aprocess_unit = self._aprocess_message
+        if self.max_batch_size > 1:
+            message_iterator = self._abatch(message_iterator)
+            aprocess_unit = self._aprocess_batch
 
-        # go through all the messages
-        async for message in message_iterator:
-            # if should_stop:
-            #     logger.info("Stopping processor")
-            #     break
+        if self.max_in_flight == 1 and not self.concurrency_controller:
+            # go through all the messages
+            async for message in message_iterator:
+                await self._aprocess_isolated(aprocess_unit, message)
+            return
 
-            # for all the process, collectors pair
-            for pc in self.process_collectors_maps:
+        await self._aexecute_concurrently(message_iterator, aprocess_unit)
 
-                output_messages = await retry_wrapper.aretry(
-                    message,
-                    pc.processor.aprocess,
+    async def _abatch(self, message_iterator):
+        """
+        Group the messages into micro-batches. The pending read is carried
+        over to the next batch instead of being cancelled on linger timeout
+        so that no message is lost.
+        """
+        loop = asyncio.get_running_loop()
+        pending_next = None
+        is_exhausted = False
+        try:
+            while not is_exhausted:
+                batch = []
+                deadline = None
+                while len(batch) < self.max_batch_size:
+                    if pending_next is None:
+                        pending_next = asyncio.ensure_future(message_iterator.__anext__())
+
+                    # once the deadline is past, only take what is ready
+                    timeout_s = None
+                    if deadline is not None:
+                        timeout_s = max(deadline - loop.time(), 0)
+
+                    done, _ = await asyncio.wait({pending_next}, timeout=timeout_s)
+                    if not done:
+                        break
+
+                    try:
+                        message = pending_next.result()
+                    except StopAsyncIteration:
+                        is_exhausted = True
+                        break
+                    finally:
+                        pending_next = None
+
+                    batch.append(message)
+                    if deadline is None:
+                        deadline = loop.time() + self.max_linger_s
+
+                if batch:
+                    yield batch
+        finally:
+            if pending_next is not None:
+                pending_next.cancel()
+
+    def _window_size(self) -> int:
+        if self.concurrency_controller:
+            return self.concurrency_controller.limit
+        return self.max_in_flight
+
+    async def _aexecute_concurrently(self, message_iterator, aprocess_unit):
+        # a slot is taken before the next message is pulled from the
+        # iterator; the window size is re-read as slots free up
+        in_flight_tasks = set()
+        slot_freed = asyncio.Event()
+
+        def _on_done(task: asyncio.Task):
+            in_flight_tasks.discard(task)
+            slot_freed.set()
+
+        try:
+            while True:
+                while len(in_flight_tasks) >= self._window_size():
+                    slot_freed.clear()
+                    await slot_freed.wait()
+
+                try:
+                    message = await message_iterator.__anext__()
+                except StopAsyncIteration:
+                    break
+
+                task = asyncio.create_task(self._aprocess_isolated(aprocess_unit, message))
+                in_flight_tasks.add(task)
+                task.add_done_callback(_on_done)
+
+            # drain whatever is still running before returning
+            if in_flight_tasks:
+                await asyncio.gather(*in_flight_tasks)
+        except asyncio.CancelledError:
+            for task in in_flight_tasks:
+                task.cancel()
+            await asyncio.gather(*in_flight_tasks, return_exceptions=True)
+            raise
+
+    async def _aprocess_isolated(self, aprocess_unit, message: Any):
+        """
+        Failures are confined to the message so that the rest of the
+        window keeps flowing.
+        """
+        try:
+            await aprocess_unit(message)
+        except Exception as e:
+            logger.error(
+                "[Template Flow] - Error while executing processors for message '%s': %s",
+                message,
+                e,
+            )
+
+    async def _aprocess_message(self, message: Any):
+        # for all the process, collectors pair
+        for pc, stage_metrics in zip(self.process_collectors_maps, self.stage_metrics):
+            try:
+                await self._aprocess_stage_message(pc, stage_metrics, message)
+            except Exception as e:
+                if not self.dead_letter_sink:
+                    raise
+                await self._adead_letter(pc, [message], e)
+
+    async def _aprocess_stage_message(self,
+                                      pc: ProcessCollectorsMap,
+                                      stage_metrics: FlowStageMetrics,
+                                      message: Any,
+                                      ):
+        output_messages = await self._arun_processor(
+            stage_metrics,
+            message,
+            pc.processor.aprocess,
+        )
+
+        # run through the collectors for the corresponding
+        # Collectors
+        for m in output_messages:
+            for i, c in enumerate(pc.collectors):
+                await self._arun_collector(
+                    stage_metrics,
+                    i,
+                    c.acollect_output,
+                    m,
+                )
+
+        # if there is an output collector
+        # collect the output as a whole
+        # if self.output_collector:
+        #     await self.output_collector.acollect(
+        #         input = message,
+        #         output = output_messages,
+        #     )
+
+    async def _aprocess_batch(self, messages: List[Any]):
+        for pc, stage_metrics in zip(self.process_collectors_maps, self.stage_metrics):
+            try:
+                await self._aprocess_stage_batch(pc, stage_metrics, messages)
+            except Exception as e:
+                if not self.dead_letter_sink:
+                    raise
+                await self._adead_letter(pc, messages, e)
+
+    async def _aprocess_stage_batch(self,
+                                    pc: ProcessCollectorsMap,
+                                    stage_metrics: FlowStageMetrics,
+                                    messages: List[Any],
+                                    ):
+        if isinstance(pc.processor, BatchEntryProcessor):
+            try:
+                output_messages = await self._arun_processor(
+                    stage_metrics,
+                    messages,
+                    pc.processor.aprocess_batch,
+                    in_count=len(messages),
+                )
+            except BatchEntryError as e:
+                logger.warning(
+                    "[Template Flow] - %d message(s) of a batch of %d failed in stage '%s', retrying them one by one",
+                    len(e.failed_entries),
+                    len(messages),
+                    stage_name_of(pc),
+                )
+                output_messages = e.outputs + await self._aprocess_each(
+                    pc,
+                    stage_metrics,
+                    [m for m, _ in e.failed_entries],
+                )
+            except Exception as e:
+                if len(messages) == 1:
+                    raise
+                logger.warning(
+                    "[Template Flow] - Batch of %d message(s) failed in stage '%s', retrying them one by one: %s",
+                    len(messages),
+                    stage_name_of(pc),
+                    e,
                 )
+                output_messages = await self._aprocess_each(pc, stage_metrics, messages)
+        else:
+            # single-entry processors still see one message at a time
+            output_messages = await self._aprocess_each(pc, stage_metrics, messages)
 
-                if type(output_messages) != list:
-                    raise ValueError(
-                        "output message from processor" +
-                        "must be a list but got '%s'" % type(output_messages))
+        if not output_messages:
+            return
 
-                # run through the collectors for the corresponding
-                # Collectors
+        for i, c in enumerate(pc.collectors):
+            if isinstance(c, BatchOutputCollector):
+                await self._arun_collector(
+                    stage_metrics,
+                    i,
+                    c.acollect_outputs,
+                    output_messages,
+                )
+            else:
                 for m in output_messages:
-                    # if type(m) is dict:
-                    #  message_dict = dict(m)
-                    # if message_dict.get("ledger") is not None and dict(message_dict.get("ledger")).get("close_time") is not None:
-                    #     logger.warning("start time: " + str(epoch_time_start) + " current ledger time " + str(m.get("ledger").get("close_time")))
-                    #     if epoch_time_start > m.get("ledger").get("close_time"):
-                    #         should_stop = True
-                    #         logger.warning("stopping processors since start time " + str(epoch_time_start) + " is greater than ledger time " + str(m.get("ledger").get("close_time")))
-
-                    for c in pc.collectors:
-                        await c.acollect_output(m)
-
-                # if there is an output collector
-                # collect the output as a whole
-                # if self.output_collector:
-                #     await self.output_collector.acollect(
-                #         input = message,
-                #         output = output_messages,
-                #     )
+                    await self._arun_collector(
+                        stage_metrics,
+                        i,
+                        c.acollect_output,
+                        m,
+                    )
+
+    async def _aprocess_each(self,
+                             pc: ProcessCollectorsMap,
+                             stage_metrics: FlowStageMetrics,
+                             messages: List[Any],
+                             ) -> List[Any]:
+        output_messages = []
+        for message in messages:
+            try:
+                output_messages.extend(await self._arun_processor(
+                    stage_metrics,
+                    message,
+                    pc.processor.aprocess,
+                ))
+            except Exception as e:
+                if not self.dead_letter_sink:
+                    # dropped on its own, the rest of the batch goes on
+                    logger.error(
+                        "[Template Flow] - Error while executing processors for message '%s': %s",
+                        message,
+                        e,
+                    )
+                    continue
+                await self._adead_letter(pc, [message], e)
+        return output_messages
+
+    async def _adead_letter(self,
+                            pc: ProcessCollectorsMap,
+                            messages: List[Any],
+                            error: Exception,
+                            ):
+        logger.error(
+            "[Template Flow] - Dead-lettering %d message(s) of stage '%s': %s",
+            len(messages),
+            stage_name_of(pc),
+            error,
+        )
+        for message in messages:
+            await self.dead_letter_sink.put(build_dead_letter(
+                entry=message,
+                error=error,
+                flow=self.name,
+                stage=stage_name_of(pc),
+            ))
+
+    async def _arun_processor(self,
+                              stage_metrics: FlowStageMetrics,
+                              entry: Any,
+                              func_handler: Callable[[Any], Awaitable[List[Any]]],
+                              in_count: int = 1,
+                              ) -> List[Any]:
+        if self.concurrency_controller:
+            func_handler = self.concurrency_controller.wrap(func_handler)
+
+        if not stage_metrics:
+            output_messages = await self.retry_wrapper.aretry(
+                entry,
+                func_handler,
+            )
+            self._check_output_messages(output_messages)
+            return output_messages
+
+        stage_metrics.messages_in.inc(in_count)
+        start_time = time.perf_counter()
+        try:
+            output_messages = await self.retry_wrapper.aretry(
+                entry,
+                func_handler,
+                on_retry=stage_metrics.on_retry,
+            )
+            self._check_output_messages(output_messages)
+        except Exception:
+            stage_metrics.errors.inc()
+            raise
+        finally:
+            stage_metrics.processor_latency.observe(time.perf_counter() - start_time)
+
+        stage_metrics.messages_out.inc(len(output_messages))
+        return output_messages
+
+    async def _arun_collector(self,
+                              stage_metrics: FlowStageMetrics,
+                              collector_index: int,
+                              collect_func: Callable[[Any], Awaitable[Any]],
+                              output: Any,
+                              ):
+        if not stage_metrics:
+            await collect_func(output)
+            return
+
+        start_time = time.perf_counter()
+        try:
+            await collect_func(output)
+        except Exception:
+            stage_metrics.errors.inc()
+            raise
+        finally:
+            stage_metrics.collector_latencies[collector_index].observe(time.perf_counter() - start_time)
+
+    def _check_output_messages(self, output_messages: Any):
+        if type(output_messages) != list:
+            raise ValueError(
+                "output message from processor" +
+                "must be a list but got '%s'" % type(output_messages))
@@ -1,8 +1,11 @@
 import asyncio
 import logging
 import random
+import time
 import traceback
-from typing import Awaitable, Callable, Generic, TypeVar
+from typing import Any, Awaitable, Callable, Generic, Optional, TypeVar
+
+from ekspiper.metric.prom import CircuitBreakerMetrics
 
 logger = logging.getLogger(__name__)
 
@@ -10,7 +13,205 @@ I = TypeVar("I")
 O = TypeVar("O")
 
 
+class RetryExhaustedError(RuntimeError):
+    def __init__(self,
+                 attempt_count: int,
+                 last_error: Exception = None,
+                 ):
+        super().__init__("[Callable] - Failed even after %d retries." % attempt_count)
+        self.attempt_count = attempt_count
+        self.last_error = last_error
+
+
+class FatalError(Exception):
+    """
+    Raise (or wrap) to signal that retrying would not help.
+    """
+    pass
+
+
+class MalformedEntryError(FatalError, ValueError):
+    """
+    The entry cannot be turned into a request.
+    """
+    pass
+
+
+class RPCResponseError(ValueError):
+    """
+    An unsuccessful response, with the `error` code of its result.
+    """
+
+    def __init__(self,
+                 message: str,
+                 error: str = None,
+                 ):
+        super().__init__(message)
+        self.error = error
+
+
+# rippled errors no retry fixes: the node does not have the ledger, or
+# the request itself is wrong
+FATAL_RPC_ERRORS = {
+    "lgrNotFound",
+    "invalidParams",
+    "badSyntax",
+    "unknownCmd",
+    "missingCommand",
+    "lgrIdxInvalid",
+}
+
+
+def is_fatal_rpc_error(error: Any) -> bool:
+    # ie. lgrIdxMalformed, srcCurMalformed, actMalformed
+    return isinstance(error, str) and (error in FATAL_RPC_ERRORS or error.endswith("Malformed"))
+
+
+def is_retryable_error(e: Exception) -> bool:
+    if isinstance(e, FatalError):
+        return False
+    # RPCResponseError and xrpl-py's XRPLRequestFailureException carry the code
+    return not is_fatal_rpc_error(getattr(e, "error", None))
+
+
+class CircuitBreaker:
+    """
+    Shared by all the RetryWrappers calling the same endpoint.
+
+    Opens after `failure_threshold` consecutive failures and rejects the
+    calls for `reset_timeout_s`. It then lets `half_open_max_probes` calls
+    through; a successful probe closes it, a failed one opens it again.
+    """
+    CLOSED = 0
+    OPEN = 1
+    HALF_OPEN = 2
+
+    def __init__(self,
+                 name: str = "",
+                 failure_threshold: int = 5,
+                 reset_timeout_s: float = 30,
+                 half_open_max_probes: int = 1,
+                 metrics: CircuitBreakerMetrics = None,
+                 ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_s = reset_timeout_s
+        self.half_open_max_probes = half_open_max_probes
+        self.metrics = metrics
+
+        self.state = CircuitBreaker.CLOSED
+        self.consecutive_failure_count = 0
+        self.opened_at = 0.0
+        self.probes_in_flight = 0
+        self._set_state(CircuitBreaker.CLOSED)
+
+    def _set_state(self, state: int):
+        if state == CircuitBreaker.OPEN and self.state != CircuitBreaker.OPEN:
+            logger.warning("[CircuitBreaker:%s] opening the circuit", self.name)
+            self.opened_at = time.monotonic()
+            if self.metrics:
+                self.metrics.opened_counter.inc()
+        if state == CircuitBreaker.HALF_OPEN:
+            self.probes_in_flight = 0
+
+        self.state = state
+        if self.metrics:
+            self.metrics.state_gauge.set(state)
+
+    def seconds_until_half_open(self) -> float:
+        return max(self.opened_at + self.reset_timeout_s - time.monotonic(), 0)
+
+    def allow_request(self) -> bool:
+        if self.state == CircuitBreaker.OPEN:
+            if self.seconds_until_half_open() > 0:
+                return False
+            self._set_state(CircuitBreaker.HALF_OPEN)
+
+        if self.state == CircuitBreaker.HALF_OPEN:
+            if self.probes_in_flight >= self.half_open_max_probes:
+                return False
+            self.probes_in_flight += 1
+
+        return True
+
+    def release_probe(self):
+        """
+        Gives back the slot of a half-open probe that ended with neither a
+        success nor a failure (ie. cancelled).
+        """
+        if self.state == CircuitBreaker.HALF_OPEN and self.probes_in_flight > 0:
+            self.probes_in_flight -= 1
+
+    def record_success(self):
+        self.consecutive_failure_count = 0
+        if self.state == CircuitBreaker.HALF_OPEN:
+            logger.info("[CircuitBreaker:%s] closing the circuit", self.name)
+            self._set_state(CircuitBreaker.CLOSED)
+
+    def record_failure(self):
+        self.consecutive_failure_count += 1
+        if self.state == CircuitBreaker.HALF_OPEN:
+            self._set_state(CircuitBreaker.OPEN)
+        elif self.state == CircuitBreaker.CLOSED and self.consecutive_failure_count >= self.failure_threshold:
+            self._set_state(CircuitBreaker.OPEN)
+
+
+class RetryBudget:
+    """
+    Caps retries to a `ratio` of the first attempts, plus a small
+    reserve of `min_retries_per_s`, across everything sharing it.
+    """
+
+    def __init__(self,
+                 ratio: float = 0.2,
+                 min_retries_per_s: float = 1.0,
+                 max_balance: float = 100.0,
+                 metrics: CircuitBreakerMetrics = None,
+                 ):
+        self.ratio = ratio
+        self.min_retries_per_s = min_retries_per_s
+        self.max_balance = max_balance
+        self.metrics = metrics
+
+        self.balance = max_balance
+        self.last_refill_at = time.monotonic()
+
+    def record_request(self):
+        self.balance = min(self.balance + self.ratio, self.max_balance)
+
+    def try_withdraw(self) -> bool:
+        now = time.monotonic()
+        self.balance = min(self.balance + (now - self.last_refill_at) * self.min_retries_per_s, self.max_balance)
+        self.last_refill_at = now
+
+        if self.balance < 1:
+            if self.metrics:
+                self.metrics.retry_budget_exhausted_counter.inc()
+            return False
+
+        self.balance -= 1
+        return True
+
+
 class RetryWrapper(Generic[I, O]):
+    def __init__(self,
+                 circuit_breaker: CircuitBreaker = None,
+                 retry_budget: RetryBudget = None,
+                 is_retryable: Callable[[Exception], bool] = is_retryable_error,
+                 ):
+        self.circuit_breaker = circuit_breaker
+        self.retry_budget = retry_budget
+        self.is_retryable = is_retryable
+
+    async def _await_circuit(self) -> bool:
+        """
+        Returns whether the call is a half-open probe.
+        """
+        # wait out the open circuit instead of failing the entries
+        while not self.circuit_breaker.allow_request():
+            await asyncio.sleep(max(self.circuit_breaker.seconds_until_half_open(), 0.1))
+        return self.circuit_breaker.state == CircuitBreaker.HALF_OPEN
+
     async def aretry(self,
                      entry: I,
                      func_handler: Callable[[I], Awaitable[O]],
@@ -18,29 +219,54 @@ class RetryWrapper(Generic[I, O]):
                      is_mute_stacktrace: bool = False,
                      base_sleep_s: int = 2,
                      sleep_multiplier: float = 1.5,
+                     on_retry: Optional[Callable[[int, Exception], None]] = None,
                      ) -> O:
         iteration_count = 0
-        is_value_set = False
-        out: O = None
+        last_error = None
+        if self.retry_budget:
+            self.retry_budget.record_request()
+
         while iteration_count < max_retry_count:
             iteration_count += 1
+            is_probe = await self._await_circuit() if self.circuit_breaker else False
+
             try:
                 out = await func_handler(entry)
-                is_value_set = True
-                break
+                if self.circuit_breaker:
+                    self.circuit_breaker.record_success()
+                return out
             except Exception as e:
-                sleep_time_s = base_sleep_s * sleep_multiplier ** iteration_count + random.randrange(2, 8)
-                logger.error(
-                    "[iteration:%d] Sleeping %f seconds after receiving message has failure: %s",
-                    iteration_count,
-                    sleep_time_s,
-                    e,
-                )
-                is_mute_stacktrace or traceback.print_exc()
-                await asyncio.sleep(sleep_time_s)
-                continue
-
-        if not is_value_set:
-            raise RuntimeError("[Callable] - Failed even after %d retries." % max_retry_count)
-
-        return out
+                last_error = e
+                if not self.is_retryable(e):
+                    if self.circuit_breaker:
+                        # the endpoint did answer
+                        self.circuit_breaker.record_success()
+                    logger.error("[iteration:%d] Not retrying after fatal failure: %s", iteration_count, e)
+                    raise
+
+                if self.circuit_breaker:
+                    self.circuit_breaker.record_failure()
+            finally:
+                if is_probe:
+                    # no-op once the probe closed or opened the circuit
+                    self.circuit_breaker.release_probe()
+
+            if iteration_count >= max_retry_count:
+                break
+            if self.retry_budget and not self.retry_budget.try_withdraw():
+                logger.error("[iteration:%d] Retry budget exhausted: %s", iteration_count, last_error)
+                break
+
+            sleep_time_s = base_sleep_s * sleep_multiplier ** iteration_count + random.randrange(2, 8)
+            logger.error(
+                "[iteration:%d] Sleeping %f seconds after receiving message has failure: %s",
+                iteration_count,
+                sleep_time_s,
+                last_error,
+            )
+            is_mute_stacktrace or traceback.print_exception(type(last_error), last_error, last_error.__traceback__)
+            if on_retry:
+                on_retry(iteration_count, last_error)
+            await asyncio.sleep(sleep_time_s)
+
+        raise RetryExhaustedError(iteration_count, last_error)
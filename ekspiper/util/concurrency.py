@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, TypeVar
+
+import aiohttp
+
+from ekspiper.metric.prom import ConcurrencyMetrics
+
+logger = logging.getLogger(__name__)
+
+O = TypeVar("O")
+
+THROTTLE_ERRORS = ["slowDown", "tooBusy"]
+THROTTLE_STATUS_CODES = [429, 503]
+
+
+def is_throttle_error(e: Exception) -> bool:
+    """
+    Timeouts and the server telling us to back off.
+    """
+    if isinstance(e, asyncio.TimeoutError):
+        return True
+    if isinstance(e, aiohttp.ClientResponseError):
+        return e.status in THROTTLE_STATUS_CODES
+
+    # ie. RPCResponseError or xrpl-py's XRPLRequestFailureException, carrying
+    # the rippled error code or the HTTP status
+    error = getattr(e, "error", None)
+    return error in THROTTLE_STATUS_CODES or error in THROTTLE_ERRORS
+
+
+class AIMDConcurrencyController:
+    """
+    Additive increase, multiplicative decrease of the concurrency.
+
+    Every `window_size` observed calls, the limit goes up by `increase_by`
+    when the average latency and the error rate are under their targets,
+    and is multiplied by `decrease_factor` otherwise. A timeout or
+    throttling response cuts it right away, at most once per
+    `decrease_cooldown_s` since the calls already in flight fail as well.
+    """
+
+    def __init__(self,
+                 initial_limit: int = 10,
+                 min_limit: int = 1,
+                 max_limit: int = 100,
+                 target_latency_s: float = 1.0,
+                 max_error_rate: float = 0.05,
+                 increase_by: int = 1,
+                 decrease_factor: float = 0.5,
+                 window_size: int = 20,
+                 decrease_cooldown_s: float = 1.0,
+                 is_throttle: Callable[[Exception], bool] = is_throttle_error,
+                 metrics: ConcurrencyMetrics = None,
+                 ):
+        if not min_limit <= initial_limit <= max_limit:
+            raise ValueError("initial_limit must be between %d and %d but got '%s'" % (
+                min_limit, max_limit, initial_limit))
+        if not 0 < decrease_factor < 1:
+            raise ValueError("decrease_factor must be between 0 and 1 but got '%s'" % decrease_factor)
+
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency_s = target_latency_s
+        self.max_error_rate = max_error_rate
+        self.increase_by = increase_by
+        self.decrease_factor = decrease_factor
+        self.window_size = window_size
+        self.decrease_cooldown_s = decrease_cooldown_s
+        self.is_throttle = is_throttle
+        self.metrics = metrics
+
+        self.limit = initial_limit
+        self.last_decrease_at = 0.0
+        self._reset_window()
+        self._update_metrics()
+
+    def _reset_window(self):
+        self.sample_count = 0
+        self.error_count = 0
+        self.total_latency_s = 0.0
+
+    def _update_metrics(self):
+        if self.metrics:
+            self.metrics.limit_gauge.set(self.limit)
+
+    def _increase(self):
+        self.limit = min(self.limit + self.increase_by, self.max_limit)
+        self._update_metrics()
+
+    def _decrease(self):
+        now = time.monotonic()
+        if now - self.last_decrease_at < self.decrease_cooldown_s:
+            return
+
+        self.last_decrease_at = now
+        self.limit = max(int(self.limit * self.decrease_factor), self.min_limit)
+        logger.warning("[AIMDConcurrencyController] decreasing the concurrency to %d", self.limit)
+        self._update_metrics()
+
+    def record(self,
+               latency_s: float,
+               error: Exception = None,
+               ):
+        if error is not None and self.is_throttle(error):
+            if self.metrics:
+                self.metrics.throttled_counter.inc()
+            self._reset_window()
+            self._decrease()
+            return
+
+        self.sample_count += 1
+        self.total_latency_s += latency_s
+        if error is not None:
+            self.error_count += 1
+
+        if self.sample_count < self.window_size:
+            return
+
+        if self.total_latency_s / self.sample_count <= self.target_latency_s and \
+                self.error_count / self.sample_count <= self.max_error_rate:
+            self._increase()
+        else:
+            self._decrease()
+        self._reset_window()
+
+    def wrap(self,
+             func_handler: Callable[[Any], Awaitable[O]],
+             ) -> Callable[[Any], Awaitable[O]]:
+        async def _observed(entry: Any) -> O:
+            start_time = time.perf_counter()
+            try:
+                output = await func_handler(entry)
+            except Exception as e:
+                self.record(time.perf_counter() - start_time, e)
+                raise
+            self.record(time.perf_counter() - start_time)
+            return output
+
+        return _observed
@@ -0,0 +1,21 @@
+import logging
+from typing import Any, Dict
+
+import yaml
+
+logger = logging.getLogger(__name__)
+
+
+def load_from_file(
+        yml_path: str,
+) -> Dict[str, Any]:
+    logger.info("[Config] loading config from path: " + yml_path)
+    yml_config = {}
+    try:
+        with open(yml_path, mode="rt", encoding="utf-8") as file:
+            yml_config = yaml.safe_load(file) or {}
+            logger.info("[Config] config file: " + str(yml_config))
+    except Exception as e:
+        logger.info("[Config] Wasn't able to load config file: " + str(e))
+
+    return yml_config
@@ -13,3 +13,28 @@ wss_endpoints = {
     "debug_mainnet_clio": "wss://s2-clio.ripple.com",
     "debug_testnet": "wss://s.altnet.rippletest.net",
 }
+
+# nodes serving the same network; the endpoint pool client spreads the
+# requests over the healthy ones
+endpoint_pools = {
+    "mainnet": [
+        "https://s2-clio.ripple.com:51234/",
+        "https://s2.ripple.com:51234/",
+        "https://s1.ripple.com:51234/",
+    ],
+    "testnet": [
+        "https://s.altnet.rippletest.net:51234/",
+    ],
+}
+
+# requests/sec and burst allowed against each endpoint; endpoints sharing
+# a URL share a single rate limiter (see ekspiper.util.rate_limit)
+rate_limits = {
+    "mainnet": {"rate_per_s": 20, "burst": 40},
+    "testnet": {"rate_per_s": 10, "burst": 20},
+    "debug_mainnet": {"rate_per_s": 10, "burst": 20},
+    "debug_mainnet_clio": {"rate_per_s": 20, "burst": 40},
+    "debug_testnet": {"rate_per_s": 10, "burst": 20},
+}
+
+default_rate_limit = {"rate_per_s": 10, "burst": 20}
@@ -0,0 +1,111 @@
+import datetime
+import hashlib
+import struct
+from typing import Any, Dict
+
+from xrpl.core.binarycodec import decode
+
+# seconds between the unix epoch and the ripple epoch (2000-01-01)
+RIPPLE_EPOCH_OFFSET_S = 946684800
+
+# hash prefixes, see rippled's HashPrefix.h
+_TRANSACTION_ID_PREFIX = bytes.fromhex("54584E00")  # 'TXN\0'
+_LEDGER_MASTER_PREFIX = bytes.fromhex("4C575200")  # 'LWR\0'
+
+# seq, drops, parent hash, transaction hash, account hash,
+# parent close time, close time, close time resolution, close flags
+_LEDGER_HEADER = struct.Struct(">IQ32s32s32sIIBB")
+
+_CLOSE_TIME_ESTIMATED_FLAG = 0x01
+
+# transactions rippled adds a `delivered_amount` to
+_DELIVERED_AMOUNT_TYPES = {"Payment", "CheckCash", "AccountDelete"}
+
+
+def sha512_half(data: bytes) -> str:
+    return hashlib.sha512(data).digest()[:32].hex().upper()
+
+
+def transaction_hash(tx_blob: str) -> str:
+    return sha512_half(_TRANSACTION_ID_PREFIX + bytes.fromhex(tx_blob))
+
+
+def close_time_human(close_time: int) -> str:
+    close_datetime = datetime.datetime.fromtimestamp(close_time + RIPPLE_EPOCH_OFFSET_S, datetime.timezone.utc)
+    return close_datetime.strftime("%Y-%b-%d %H:%M:%S") + ".000000000 UTC"
+
+
+def decode_ledger_header(ledger_data: str) -> Dict[str, Any]:
+    """
+    Decode the `ledger_data` of a binary `ledger` response into the
+    header fields of the JSON response.
+    """
+    header = bytes.fromhex(ledger_data)
+    (
+        seq,
+        drops,
+        parent_hash,
+        transaction_hash_,
+        account_hash,
+        parent_close_time,
+        close_time,
+        close_time_resolution,
+        close_flags,
+    ) = _LEDGER_HEADER.unpack_from(header)
+
+    ledger_hash = sha512_half(_LEDGER_MASTER_PREFIX + header[:_LEDGER_HEADER.size])
+    return {
+        "accepted": True,
+        "account_hash": account_hash.hex().upper(),
+        "close_flags": close_flags,
+        "close_time": close_time,
+        "close_time_estimated": bool(close_flags & _CLOSE_TIME_ESTIMATED_FLAG),
+        "close_time_human": close_time_human(close_time),
+        "close_time_resolution": close_time_resolution,
+        "closed": True,
+        "hash": ledger_hash,
+        "ledger_hash": ledger_hash,
+        "ledger_index": str(seq),
+        "parent_close_time": parent_close_time,
+        "parent_hash": parent_hash.hex().upper(),
+        "seqNum": str(seq),
+        "totalCoins": str(drops),
+        "total_coins": str(drops),
+        "transaction_hash": transaction_hash_.hex().upper(),
+    }
+
+
+def decode_transaction(transaction: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Decode a `{tx_blob, meta}` entry of a binary `ledger` response into
+    the expanded JSON transaction, `hash` and `metaData` included.
+    """
+    decoded = decode(transaction["tx_blob"])
+    decoded["hash"] = transaction_hash(transaction["tx_blob"])
+
+    meta = decode(transaction["meta"])
+    if decoded.get("TransactionType") in _DELIVERED_AMOUNT_TYPES and meta.get("TransactionResult") == "tesSUCCESS":
+        delivered_amount = meta.get("DeliveredAmount")
+        if delivered_amount is None and decoded["TransactionType"] == "Payment":
+            delivered_amount = decoded.get("Amount")
+        if delivered_amount is not None:
+            meta["delivered_amount"] = delivered_amount
+    decoded["metaData"] = meta
+    return decoded
+
+
+def decode_binary_ledger(result: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Turn the result of a binary `ledger` request (transactions expanded)
+    into the result of the same request in JSON. CPU heavy; meant to run
+    in a worker.
+    """
+    ledger = result["ledger"]
+    decoded_ledger = decode_ledger_header(ledger["ledger_data"])
+    decoded_ledger["closed"] = ledger.get("closed", True)
+    decoded_ledger["transactions"] = [decode_transaction(t) for t in ledger.get("transactions", [])]
+
+    decoded_result = {k: v for k, v in result.items() if k != "ledger"}
+    decoded_result["ledger"] = decoded_ledger
+    decoded_result.setdefault("ledger_hash", decoded_ledger["ledger_hash"])
+    return decoded_result
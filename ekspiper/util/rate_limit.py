@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import time
+import weakref
+from typing import Dict
+
+from ekspiper.metric.prom import RateLimiterMetrics
+from ekspiper.util.endpoints import default_rate_limit, endpoints, rate_limits
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucketRateLimiter:
+    """
+    Allows `rate_per_s` acquisitions per second on average and up to
+    `burst` at once. Waiters are served in arrival order.
+
+    The tokens are shared by every event loop using the limiter (ie. one
+    `asyncio.run` after another); each loop gets a lock of its own.
+    """
+
+    def __init__(self,
+                 rate_per_s: float,
+                 burst: int = 1,
+                 metrics: RateLimiterMetrics = None,
+                 ):
+        if rate_per_s <= 0:
+            raise ValueError("rate_per_s must be positive but got '%s'" % rate_per_s)
+        if burst < 1:
+            raise ValueError("burst must be at least 1 but got '%s'" % burst)
+
+        self.rate_per_s = rate_per_s
+        self.burst = burst
+        self.metrics = metrics
+
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+        # loop -> lock, as an asyncio.Lock is bound to the loop it is used in
+        self.locks: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Lock]" = weakref.WeakKeyDictionary()
+
+    def _lock(self) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        if loop not in self.locks:
+            self.locks[loop] = asyncio.Lock()
+        return self.locks[loop]
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.tokens + (now - self.updated_at) * self.rate_per_s, self.burst)
+        self.updated_at = now
+
+    async def acquire(self,
+                      tokens: int = 1,
+                      ):
+        if tokens > self.burst:
+            raise ValueError("cannot acquire %d tokens with a burst of %d" % (tokens, self.burst))
+
+        start_time = time.perf_counter()
+        async with self._lock():
+            self._refill()
+            while self.tokens < tokens:
+                await asyncio.sleep((tokens - self.tokens) / self.rate_per_s)
+                self._refill()
+            self.tokens -= tokens
+
+        if self.metrics:
+            self.metrics.acquired_counter.inc(tokens)
+            self.metrics.wait_seconds_counter.inc(time.perf_counter() - start_time)
+
+
+_rate_limiters: Dict[str, TokenBucketRateLimiter] = {}
+
+
+def get_rate_limiter(url: str,
+                     metrics: RateLimiterMetrics = None,
+                     ) -> TokenBucketRateLimiter:
+    """
+    The rate limiter shared by everything calling `url`, configured from
+    `rate_limits` of the first endpoint with that URL. The `metrics` are
+    attached to it unless it already has some.
+    """
+    if url not in _rate_limiters:
+        rate_limit = next(
+            (rate_limits[n] for n, u in endpoints.items() if u == url and n in rate_limits),
+            default_rate_limit,
+        )
+        logger.info("[RateLimiter] limiting '%s' to %s", url, rate_limit)
+        _rate_limiters[url] = TokenBucketRateLimiter(**rate_limit)
+
+    rate_limiter = _rate_limiters[url]
+    if metrics and not rate_limiter.metrics:
+        rate_limiter.metrics = metrics
+    return rate_limiter
@@ -0,0 +1,26 @@
+import sys
+from typing import Any
+
+
+def approximate_size_of(entry: Any) -> int:
+    """
+    Approximate the in-memory size of an entry by walking through
+    its dicts, lists, tuples and sets. Shared objects are counted once.
+    """
+    size = 0
+    seen_ids = set()
+    stack = [entry]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen_ids:
+            continue
+        seen_ids.add(id(obj))
+
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+
+    return size
@@ -1,7 +1,8 @@
 from dataclasses import dataclass, field
-from typing import Optional, Union, cast
+from typing import Any, Optional, Union, cast
 
 from xrpl.asyncio.clients import Client, XRPLRequestFailureException
+from xrpl.models.requests.book_offers import BookOffers
 from xrpl.models.requests.request import Request, RequestMethod
 from xrpl.models.utils import require_kwargs_on_init
 
@@ -42,3 +43,14 @@ class Ledger(Request):
     owner_funds: bool = False
     binary: bool = False
     queue: bool = False
+
+
+@require_kwargs_on_init
+@dataclass(frozen=True)
+class PagedBookOffers(BookOffers):
+    """
+    BookOffers with the `marker` of the page to resume from, which the
+    xrpl-py model lacks.
+    """
+
+    marker: Optional[Any] = None
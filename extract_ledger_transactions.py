@@ -10,17 +10,19 @@ from prometheus_client import (
     CollectorRegistry,
     generate_latest,
 )
-from xrpl.asyncio.clients import AsyncJsonRpcClient
 
 import ekspiper.util.xrplpy_patches
 from ekspiper.builder.flow import (
     ProcessCollectorsMapBuilder,
     TemplateFlowBuilder,
 )
-from ekspiper.connect.counter import PartitionedCounterDataSource
+from ekspiper.collector.ledger_range import LedgerRangeCompletionCollector
+from ekspiper.connect.counter import LedgerRangeDataSource, LedgerRangeScheduler
 from ekspiper.connect.file_data_source import FileDataSource
 from ekspiper.connect.queue import QueueSourceSink
-from ekspiper.metric.prom import ScriptExecutionMetrics
+from ekspiper.connect.rpc import RateLimitedClient, get_json_rpc_client
+from ekspiper.metric.prom import ConnectionMetrics, RateLimiterMetrics, ScriptExecutionMetrics
+from ekspiper.processor.cache import CachingLedgerFetchProcessor
 from ekspiper.processor.etl import (
     ETLTemplateProcessor,
     GenericValidator,
@@ -47,6 +49,19 @@ listener.start()
 # logging.basicConfig(level=logging.INFO)
 
 
+def build_rpc_client(xrpl_endpoint: str,
+                     fluent_tag: str,
+                     prom_registry: CollectorRegistry = None,
+                     ) -> RateLimitedClient:
+    if prom_registry is None:
+        return RateLimitedClient(get_json_rpc_client(xrpl_endpoint))
+
+    return RateLimitedClient(
+        get_json_rpc_client(xrpl_endpoint, metrics=ConnectionMetrics(prom_registry, fluent_tag)),
+        metrics=RateLimiterMetrics(prom_registry, xrpl_endpoint),
+    )
+
+
 async def start_ledger_sequence(client) -> int:
     return await get_latest_validated_ledger_sequence(client) - 1
 
@@ -57,6 +72,8 @@ async def amain_file(
         fluent_host: str = "0.0.0.0",
         fluent_port: int = 25225,
         schema: str = "transaction",
+        cache_dir: str = None,
+        prom_registry: CollectorRegistry = None,
 ):
     xrpl_endpoint = endpoints[fluent_tag]
     if xrpl_endpoint is None:
@@ -64,14 +81,22 @@ async def amain_file(
             "[ExtractXRPLTransactions] missing xrpl endpoint - did you forget to specify the fluent tag?")
     file_data_source = FileDataSource(file=file)
     file_data_source.start()
-    async_rpc_client = AsyncJsonRpcClient(xrpl_endpoint)
+    async_rpc_client = build_rpc_client(xrpl_endpoint, fluent_tag, prom_registry)
     ledger_record_source_sink = QueueSourceSink(
         name="ledger_record_source",
     )
-    pc_map = ProcessCollectorsMapBuilder().with_processor(
-        XRPLFetchLedgerDetailsProcessor(
-            rpc_client=async_rpc_client,
+    ledger_fetch_processor = XRPLFetchLedgerDetailsProcessor(
+        rpc_client=async_rpc_client,
+    )
+    if cache_dir is not None:
+        # the runs over the same ledgers read them back from the disk
+        ledger_fetch_processor = CachingLedgerFetchProcessor(
+            ledger_fetch_processor,
+            cache_dir=cache_dir,
+            network=fluent_tag,
         )
+    pc_map = ProcessCollectorsMapBuilder().with_processor(
+        ledger_fetch_processor
     ).add_data_sink_output_collector(
         data_sink=ledger_record_source_sink,
         name="ledger_record_source_sink"
@@ -150,12 +175,15 @@ async def amain(
         fluent_tag: str = "mainnet",
         fluent_host: str = "0.0.0.0",
         fluent_port: int = 25225,
+        cache_dir: str = None,
+        completed_file: str = None,
+        prom_registry: CollectorRegistry = None,
 ):
     xrpl_endpoint = endpoints[fluent_tag]
     if xrpl_endpoint is None:
         raise RuntimeError(
             "[ExtractXRPLTransactions] missing xrpl endpoint - did you forget to specify the fluent tag?")
-    async_rpc_client = AsyncJsonRpcClient(xrpl_endpoint)
+    async_rpc_client = build_rpc_client(xrpl_endpoint, fluent_tag, prom_registry)
     start_index = await start_ledger_sequence(async_rpc_client)
 
     # build the ledger queue for processing
@@ -163,22 +191,33 @@ async def amain(
 
     # Flow: Obtain Ledger Details
     #
+    # the workers lease chunks of ledgers and steal from each other once
+    # they run out, so that none of them sits idle behind heavy ledgers;
+    # the chunks already completed by the previous runs are skipped
+    ledger_range_scheduler = LedgerRangeScheduler(
+        start_index=start_index,
+        end_index=1,
+        chunk_size=100,
+        is_descending=True,
+        completed_file=completed_file or "%s.completed_ledger_ranges.jsonl" % fluent_tag,
+    )
     flow_ledger_detail_tasks = []
-    partition_size = 10
-
-    for i in range(partition_size):
-        # start with the counter
-        index_decrementor_data_source = PartitionedCounterDataSource(
-            starting_count=start_index,
-            shard_index=i,
-            shard_size=partition_size,
+    worker_count = 10
+
+    ledger_fetch_processor = XRPLFetchLedgerDetailsProcessor(
+        rpc_client=async_rpc_client,
+    )
+    if cache_dir is not None:
+        # one cache shared by the workers, so that its size is tracked once
+        ledger_fetch_processor = CachingLedgerFetchProcessor(
+            ledger_fetch_processor,
+            cache_dir=cache_dir,
+            network=fluent_tag,
         )
-        index_decrementor_data_source.start()
 
+    for i in range(worker_count):
         pc_map = ProcessCollectorsMapBuilder().with_processor(
-            XRPLFetchLedgerDetailsProcessor(
-                rpc_client=async_rpc_client,
-            )
+            ledger_fetch_processor
         ).add_data_sink_output_collector(
             data_sink=ledger_record_source_sink,
             name="ledger_record_source_sink"
@@ -186,7 +225,10 @@ async def amain(
 
         flow_payment_detail = TemplateFlowBuilder().add_process_collectors_map(pc_map).build()
         flow_ledger_detail_tasks.append(asyncio.create_task(flow_payment_detail.aexecute(
-            message_iterator=index_decrementor_data_source
+            message_iterator=LedgerRangeDataSource(
+                scheduler=ledger_range_scheduler,
+                worker_id=str(i),
+            ),
         )))
 
     # build the transaction queue for processing
@@ -217,15 +259,21 @@ async def amain(
         message_iterator=ledger_record_source_sink,
     ))
 
+    # a chunk of ledgers is complete once their ledger records and
+    # transactions are all written to fluent, so that a restart does not
+    # skip the ones still in the queues
+    ledger_range_completion_collector = LedgerRangeCompletionCollector(scheduler=ledger_range_scheduler)
     pc_map_transaction = build_fluent_map(schema=XRPLTransactionSchema.SCHEMA, fluent_tag=fluent_tag + ".transactions",
-                                          fluent_host=fluent_host, fluent_port=fluent_port)
+                                          fluent_host=fluent_host, fluent_port=fluent_port,
+                                          completion_collector=ledger_range_completion_collector)
     flow_txn_record = TemplateFlowBuilder().add_process_collectors_map(pc_map_transaction).build()
     flow_txn_record_task = asyncio.create_task(flow_txn_record.aexecute(
         message_iterator=txn_record_source_sink,
     ))
 
     pc_map_ledgers = build_fluent_map(schema=XRPLLedgerSchema.SCHEMA, fluent_tag=fluent_tag + ".ledgers",
-                                      fluent_host=fluent_host, fluent_port=fluent_port)
+                                      fluent_host=fluent_host, fluent_port=fluent_port,
+                                      completion_collector=ledger_range_completion_collector)
     flow_ledger_record = TemplateFlowBuilder().add_process_collectors_map(pc_map_ledgers).build()
     flow_ledger_record_task = asyncio.create_task(flow_ledger_record.aexecute(
         message_iterator=formatted_ledger_source_sink,
@@ -238,8 +286,8 @@ async def amain(
     listener.stop()
 
 
-def build_fluent_map(schema, fluent_tag, fluent_host="0.0.0.0", fluent_port=25225):
-    return ProcessCollectorsMapBuilder().with_processor(
+def build_fluent_map(schema, fluent_tag, fluent_host="0.0.0.0", fluent_port=25225, completion_collector=None):
+    pc_map_builder = ProcessCollectorsMapBuilder().with_processor(
         ETLTemplateProcessor(
             validator=GenericValidator(schema),
             transformer=XRPLGenericTransformer(schema),
@@ -249,7 +297,11 @@ def build_fluent_map(schema, fluent_tag, fluent_host="0.0.0.0", fluent_port=2522
         is_simplified=True
     ).add_fluent_output_collector(
         fluent_sender=FluentSender(fluent_tag, host=fluent_host, port=fluent_port),
-    ).build()
+    )
+    if completion_collector:
+        # after the fluent collector, so that only the written entries count
+        pc_map_builder.add_ledger_range_completion_collector(completion_collector)
+    return pc_map_builder.build()
 
 
 def parse_arguments() -> argparse.Namespace:
@@ -284,6 +336,28 @@ def parse_arguments() -> argparse.Namespace:
         type=str,
         default=None,
     )
+    arg_parser.add_argument(
+        "-s",
+        "--schema",
+        choices=["transaction", "object"],
+        help="schema of the records read from the file",
+        type=str,
+        default="transaction",
+    )
+    arg_parser.add_argument(
+        "-c",
+        "--cache_dir",
+        help="keep the ledgers fetched in this directory for the next runs",
+        type=str,
+        default=None,
+    )
+    arg_parser.add_argument(
+        "-cf",
+        "--completed_file",
+        help="keep track of the ledger ranges completed in this file (default: <fluent_tag>.completed_ledger_ranges.jsonl)",
+        type=str,
+        default=None,
+    )
 
     return arg_parser.parse_args()
 
@@ -302,6 +376,9 @@ if __name__ == "__main__":
                 fluent_tag=args.fluent_tag,
                 fluent_host=args.fluent_host,
                 fluent_port=args.fluent_port,
+                cache_dir=args.cache_dir,
+                completed_file=args.completed_file,
+                prom_registry=registry,
             ))
         else:
             asyncio.run(amain_file(
@@ -310,6 +387,8 @@ if __name__ == "__main__":
                 fluent_host=args.fluent_host,
                 fluent_port=args.fluent_port,
                 schema=args.schema,
+                cache_dir=args.cache_dir,
+                prom_registry=registry,
             ))
 
     print(generate_latest(registry))
@@ -7,15 +7,15 @@ from prometheus_client import (
     CollectorRegistry,
     generate_latest,
 )
-from xrpl.asyncio.clients import AsyncJsonRpcClient
 from xrpl.asyncio.ledger import get_latest_validated_ledger_sequence
 
 from ekspiper.builder.flow import (
     ProcessCollectorsMapBuilder,
     TemplateFlowBuilder,
 )
+from ekspiper.connect.rpc import RateLimitedClient, get_json_rpc_client
 from ekspiper.connect.xrpledger import LedgerObjectDataSource
-from ekspiper.metric.prom import ScriptExecutionMetrics
+from ekspiper.metric.prom import ConnectionMetrics, RateLimiterMetrics, ScriptExecutionMetrics
 from ekspiper.processor.etl import (
     ETLTemplateProcessor,
     GenericValidator,
@@ -32,13 +32,20 @@ async def amain(
         fluent_tag: str = "test",
         fluent_host: str = "0.0.0.0",
         fluent_port: int = 25225,
+        prom_registry: CollectorRegistry = None,
 ):
     """
     # TODO's
     - [ ] Optionally specify specific ledger index
 
     """
-    async_rpc_client = AsyncJsonRpcClient(xrpl_endpoint)
+    async_rpc_client = RateLimitedClient(
+        get_json_rpc_client(
+            xrpl_endpoint,
+            metrics=ConnectionMetrics(prom_registry, fluent_tag) if prom_registry else None,
+        ),
+        metrics=RateLimiterMetrics(prom_registry, xrpl_endpoint) if prom_registry else None,
+    )
     ledger_index = await get_latest_validated_ledger_sequence(async_rpc_client) - 1
 
     # setup fluent client
@@ -129,6 +136,7 @@ if __name__ == "__main__":
             fluent_tag=args.fluent_tag,
             fluent_host=args.fluent_host,
             fluent_port=args.fluent_port,
+            prom_registry=registry,
         ))
 
     print(generate_latest(registry))
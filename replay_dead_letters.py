@@ -0,0 +1,161 @@
+import argparse
+import asyncio
+import json
+import logging
+from typing import List
+
+from ekspiper.builder.pipeline import PipelineBuilder
+from ekspiper.connect.dead_letter import DeadLetterDataSource
+from ekspiper.util.config import load_from_file
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+
+def read_dead_letter_stages(file: str,
+                            flow: str,
+                            ) -> List[str]:
+    """
+    The stages the messages of the given flow were dead-lettered in.
+    """
+    stages = []
+    with open(file, "r") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                dead_letter = json.loads(line)
+            except Exception as e:
+                logger.error("[ReplayDeadLetters] skipping malformed line: %s", e)
+                continue
+            if dead_letter.get("flow") == flow and dead_letter.get("stage") not in stages:
+                stages.append(dead_letter.get("stage"))
+    return stages
+
+
+async def amain(
+        config: str,
+        dead_letter_path: str,
+        flow: str,
+        rate_per_s: float = 10,
+        stage: str = None,
+        fluent_host: str = "0.0.0.0",
+        fluent_port: int = 25225,
+        replay_dead_letter_path: str = None,
+):
+    yml_config = load_from_file(config)
+    pipeline_spec = dict(yml_config["pipeline"])
+    # do not dead-letter into the log that is being replayed, but keep
+    # the messages failing again
+    pipeline_spec["dead_letter_path"] = replay_dead_letter_path or dead_letter_path + ".replay"
+
+    pipeline = PipelineBuilder(
+        network=yml_config.get("network", "mainnet"),
+        fluent_host=fluent_host,
+        fluent_port=fluent_port,
+    ).build(pipeline_spec)
+
+    if flow not in pipeline.flows:
+        raise RuntimeError("[ReplayDeadLetters] unknown flow '%s', expected one of: %s" % (
+            flow,
+            list(pipeline.flows.keys()),
+        ))
+
+    # only the chosen flow is fed, by the dead-letter log, and only the flows
+    # downstream of it run; the live sources and the upstream flows are left
+    # unstarted so that the queues can drain once the replay is done
+    pipeline.sources = {}
+    pipeline.start_flows(pipeline.downstream_flows(flow))
+
+    # every message is replayed through the stage it failed in only
+    stages = [stage] if stage else read_dead_letter_stages(dead_letter_path, flow)
+    for stage_name in stages:
+        dead_letter_source = DeadLetterDataSource(
+            file=dead_letter_path,
+            rate_per_s=rate_per_s,
+            flow=flow,
+            stage=stage_name,
+        )
+        dead_letter_source.start()
+        await pipeline.flows[flow].with_stage(stage_name).aexecute(dead_letter_source)
+
+    await pipeline.adrain()
+    pipeline.shutdown()
+    logger.info("[ReplayDeadLetters] done replaying '%s' into flow '%s'", dead_letter_path, flow)
+
+
+def parse_arguments() -> argparse.Namespace:
+    arg_parser = argparse.ArgumentParser()
+
+    arg_parser.add_argument(
+        "-c",
+        "--config",
+        help="specify the configuration file with the pipeline spec",
+        type=str,
+        default="/tmp/config.yml",
+    )
+    arg_parser.add_argument(
+        "-d",
+        "--dead_letter_path",
+        help="specify the dead-letter log to replay",
+        type=str,
+        required=True,
+    )
+    arg_parser.add_argument(
+        "-f",
+        "--flow",
+        help="specify the flow to feed the dead-lettered messages into",
+        type=str,
+        required=True,
+    )
+    arg_parser.add_argument(
+        "-s",
+        "--stage",
+        help="only replay the messages that failed in this stage (all the stages by default)",
+        type=str,
+        default=None,
+    )
+    arg_parser.add_argument(
+        "-o",
+        "--replay_dead_letter_path",
+        help="specify the dead-letter log of the messages failing again (default: <dead_letter_path>.replay)",
+        type=str,
+        default=None,
+    )
+    arg_parser.add_argument(
+        "-r",
+        "--rate",
+        help="specify the number of messages replayed per second",
+        type=float,
+        default=10,
+    )
+    arg_parser.add_argument(
+        "-fh",
+        "--fluent_host",
+        help="specify the FluentD/Bit host",
+        type=str,
+        default="0.0.0.0",
+    )
+    arg_parser.add_argument(
+        "-fp",
+        "--fluent_port",
+        help="specify the FluentD/Bit port",
+        type=int,
+        default=25225,
+    )
+
+    return arg_parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    asyncio.run(amain(
+        config=args.config,
+        dead_letter_path=args.dead_letter_path,
+        flow=args.flow,
+        rate_per_s=args.rate,
+        stage=args.stage,
+        fluent_host=args.fluent_host,
+        fluent_port=args.fluent_port,
+        replay_dead_letter_path=args.replay_dead_letter_path,
+    ))
@@ -3,12 +3,12 @@ import asyncio
 import logging
 import queue
 from logging.handlers import QueueHandler, QueueListener
+from urllib.parse import urlparse
 
 from prometheus_client import (
     CollectorRegistry,
     generate_latest,
 )
-from xrpl.asyncio.clients import AsyncJsonRpcClient
 from xrpl.asyncio.ledger import get_latest_validated_ledger_sequence
 
 from ekspiper.builder.flow import (
@@ -18,9 +18,12 @@ from ekspiper.builder.flow import (
 from ekspiper.connect.counter import PartitionedCounterDataSource
 from ekspiper.connect.file_data_source import FileDataSource
 from ekspiper.connect.queue import QueueSourceSink
+from ekspiper.connect.rpc import get_json_rpc_client
 from ekspiper.connect.xrpledger import LedgerObjectDataSource
 from ekspiper.metric.prom import ScriptExecutionMetrics
 from ekspiper.processor.attribute import AttributeCollectionProcessor
+from ekspiper.processor.base import EntryProcessor
+from ekspiper.processor.cache import CachingLedgerFetchProcessor
 from ekspiper.processor.fetch_transactions import (
     XRPLFetchLedgerDetailsProcessor,
     XRPLExtractTransactionsFromLedgerProcessor, XRPLLedgerProcessor,
@@ -47,10 +50,29 @@ ledger_index = None
 """
 
 
+def build_ledger_fetch_processor(
+        async_rpc_client,
+        xrpl_endpoint: str,
+        cache_dir: str = None,
+) -> EntryProcessor:
+    processor = XRPLFetchLedgerDetailsProcessor(
+        rpc_client=async_rpc_client,
+    )
+    if cache_dir is None:
+        return processor
+
+    # the runs over the same ledgers read them back from the disk
+    return CachingLedgerFetchProcessor(
+        processor,
+        cache_dir=cache_dir,
+        network=urlparse(xrpl_endpoint).hostname,
+    )
+
+
 async def amain(
         xrpl_endpoint: str = "https://s2.ripple.com:51234",
 ):
-    async_rpc_client = AsyncJsonRpcClient(xrpl_endpoint)
+    async_rpc_client = get_json_rpc_client(xrpl_endpoint)
     ledger_index = await get_latest_validated_ledger_sequence(async_rpc_client) - 1
 
     # setup the ledger object data source
@@ -87,8 +109,10 @@ async def amain(
 async def amain_txns_file(
         file: str,
         xrpl_endpoint: str = "https://s2.ripple.com:51234",
+        cache_dir: str = None,
 ):
-    async_rpc_client = AsyncJsonRpcClient(xrpl_endpoint)
+    async_rpc_client = get_json_rpc_client(xrpl_endpoint)
+    ledger_fetch_processor = build_ledger_fetch_processor(async_rpc_client, xrpl_endpoint, cache_dir)
 
     # setup the ledger object data source
     file_data_source = FileDataSource(file)
@@ -103,9 +127,7 @@ async def amain_txns_file(
     #
     flow_ledger_detail_tasks = []
     pc_map = ProcessCollectorsMapBuilder().with_processor(
-        XRPLFetchLedgerDetailsProcessor(
-            rpc_client=async_rpc_client,
-        )
+        ledger_fetch_processor
     ).add_data_sink_output_collector(
         data_sink=ledger_record_source_sink,
         name="ledger_record_source_sink"
@@ -171,8 +193,10 @@ async def start_ledger_sequence(client) -> int:
 
 async def amain_ledger(
         xrpl_endpoint: str = "https://s2.ripple.com:51234",
+        cache_dir: str = None,
 ):
-    async_rpc_client = AsyncJsonRpcClient(xrpl_endpoint)
+    async_rpc_client = get_json_rpc_client(xrpl_endpoint)
+    ledger_fetch_processor = build_ledger_fetch_processor(async_rpc_client, xrpl_endpoint, cache_dir)
     start_index = await start_ledger_sequence(async_rpc_client)
 
     # build the ledger queue for processing
@@ -188,8 +212,6 @@ async def amain_ledger(
     flow_ledger_detail_tasks = []
     partition_size = 10
     for i in range(partition_size):
-        async_rpc_client = AsyncJsonRpcClient(xrpl_endpoint)
-
         # start with the counter
         index_decrementor_data_source = PartitionedCounterDataSource(
             starting_count=start_index,
@@ -199,9 +221,7 @@ async def amain_ledger(
         index_decrementor_data_source.start()
 
         pc_map = ProcessCollectorsMapBuilder().with_processor(
-            XRPLFetchLedgerDetailsProcessor(
-                rpc_client=async_rpc_client,
-            )
+            ledger_fetch_processor
         ).add_data_sink_output_collector(
             data_sink=ledger_record_source_sink,
             name="ledger_record_source_sink"
@@ -251,8 +271,10 @@ async def amain_ledger(
 
 async def amain_txns(
         xrpl_endpoint: str = "https://s2.ripple.com:51234",
+        cache_dir: str = None,
 ):
-    async_rpc_client = AsyncJsonRpcClient(xrpl_endpoint)
+    async_rpc_client = get_json_rpc_client(xrpl_endpoint)
+    ledger_fetch_processor = build_ledger_fetch_processor(async_rpc_client, xrpl_endpoint, cache_dir)
     start_index = await start_ledger_sequence(async_rpc_client)
 
     # build the ledger queue for processing
@@ -265,8 +287,6 @@ async def amain_txns(
     flow_ledger_detail_tasks = []
     partition_size = 100
     for i in range(partition_size):
-        async_rpc_client = AsyncJsonRpcClient(xrpl_endpoint)
-
         # start with the counter
         index_decrementor_data_source = PartitionedCounterDataSource(
             starting_count=start_index,
@@ -276,9 +296,7 @@ async def amain_txns(
         index_decrementor_data_source.start()
 
         pc_map = ProcessCollectorsMapBuilder().with_processor(
-            XRPLFetchLedgerDetailsProcessor(
-                rpc_client=async_rpc_client,
-            )
+            ledger_fetch_processor
         ).add_data_sink_output_collector(
             data_sink=ledger_record_source_sink,
             name="ledger_record_source_sink"
@@ -365,6 +383,14 @@ def parse_arguments() -> argparse.Namespace:
         default="ledger_obj",
     )
 
+    arg_parser.add_argument(
+        "-c",
+        "--cache_dir",
+        help="keep the fetched ledgers in this directory for the next runs",
+        type=str,
+        default=None,
+    )
+
     return arg_parser.parse_args()
 
 
@@ -393,15 +419,18 @@ if __name__ == "__main__":
                 asyncio.run(amain_txns_file(
                     file=args.file,
                     xrpl_endpoint=args.xrpl_endpoint,
+                    cache_dir=args.cache_dir,
                 ))
             else:
                 asyncio.run(amain_txns(  # amain(
                     xrpl_endpoint=args.xrpl_endpoint,
+                    cache_dir=args.cache_dir,
                 ))
         elif args.type == "ledger":
             print("running with ledger")
             asyncio.run(amain_ledger(
-                xrpl_endpoint=args.xrpl_endpoint
+                xrpl_endpoint=args.xrpl_endpoint,
+                cache_dir=args.cache_dir,
             ))
         else:
             raise ValueError("Unknown option data type '{}'".format(args.type))
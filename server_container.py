@@ -5,28 +5,57 @@ import signal
 import sys
 from functools import partial
 
-import yaml
 from aiohttp import web, web_app
 from fluent.asyncsender import FluentSender
-from xrpl.asyncio.clients import AsyncJsonRpcClient
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    generate_latest,
+)
 
 from ekspiper.builder.flow import (
     ProcessCollectorsMapBuilder,
     TemplateFlowBuilder,
 )
+from ekspiper.builder.pipeline import PipelineBuilder
+from ekspiper.connect.dead_letter import DeadLetterLog
 from ekspiper.connect.queue import QueueSourceSink
+from ekspiper.connect.reorder import ReorderSourceSink
+from ekspiper.connect.endpoint_pool import EndpointPoolClient
+from ekspiper.connect.hedge import HedgedClient
+from ekspiper.connect.rpc import RateLimitedClient, get_json_rpc_client
+from ekspiper.connect.singleflight import SingleflightClient
+from ekspiper.connect.websocket_rpc import MultiplexedWebsocketClient
 from ekspiper.connect.xrpledger import LedgerCreationDataSource
+from ekspiper.metric.prom import (
+    CircuitBreakerMetrics,
+    ConcurrencyMetrics,
+    ConnectionMetrics,
+    EndpointPoolMetrics,
+    FlowMetrics,
+    HedgeMetrics,
+    LedgerGapMetrics,
+    QueueMetrics,
+    RateLimiterMetrics,
+    ReorderBufferMetrics,
+    SingleflightMetrics,
+)
 from ekspiper.processor.etl import (
     ETLTemplateProcessor,
     GenericValidator,
+    ProcessPoolETLProcessor,
     XRPLGenericTransformer,
 )
 from ekspiper.processor.fetch_transactions import (
     XRPLFetchLedgerDetailsProcessor,
     XRPLExtractTransactionsFromLedgerProcessor, XRPLLedgerProcessor, LedgerIndexProcessor,
+    read_last_ledger_index,
 )
 from ekspiper.schema.xrp import XRPLTransactionSchema, XRPLLedgerSchema
-from ekspiper.util.endpoints import endpoints, wss_endpoints
+from ekspiper.util.callable import CircuitBreaker, RetryBudget, RetryWrapper
+from ekspiper.util.concurrency import AIMDConcurrencyController
+from ekspiper.util.config import load_from_file
+from ekspiper.util.endpoints import endpoint_pools, endpoints, wss_endpoints
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
@@ -42,18 +71,11 @@ async def health_check(request):
     return web.Response(text="healthy")
 
 
-def load_from_file(
-        yml_path: str,
-):
-    logger.info("[ServerContainer] loading config from path: " + yml_path)
-    try:
-        with open(yml_path, mode="rt", encoding="utf-8") as file:
-            yml_config = yaml.safe_load(file)
-            logger.info("[ServerContainer] config file: " + str(yml_config))
-    except Exception as e:
-        logger.info("[ServerContainer] Wasn't able to load config file: " + str(e))
-
-    return yml_config
+async def metrics(request):
+    return web.Response(
+        body=generate_latest(request.app["prom_registry"]),
+        headers={"Content-Type": CONTENT_TYPE_LATEST},
+    )
 
 
 async def stop_template_flows(
@@ -61,9 +83,16 @@ async def stop_template_flows(
 ):
     print("Stopping the web application....")
     on_exit()
+    if "pipeline" in app:
+        app["pipeline"].stop()
+        await app["pipeline"].await_flows()
+        app["pipeline"].shutdown()
+        return
+
     # theoretically, if we stop the sources, flow should
     # drain out and exit gracefully
     app["ledger_creation_source"].stop()
+    app["ledger_backfill_source_sink"].stop()
     # app["book_offers_fetch_flow_source_sink"].stop()
     # app["book_offers_req_flow_source_sink"].stop()
     app["ledger_record_source_sink"].stop()
@@ -73,12 +102,17 @@ async def stop_template_flows(
 
     # now wait for them to drain
     await app["flow_ledger_details"]
+    await app["flow_ledger_backfill"]
     # await app["flow_booker_offers_fetch"]
     # for r in app["flow_booker_offer_records"]:
     #     await r
     await app["flow_txn_record"]
     await app["flow_ledger_record"]
     await app["flow_ledger_to_txns_brk"]
+    await app["pooled_rpc_client"].aclose()
+    for processor in app["etl_processors"]:
+        if isinstance(processor, ProcessPoolETLProcessor):
+            processor.shutdown()
 
 
 async def websocket_supervisor(ledger_creation_source):
@@ -107,11 +141,67 @@ def on_exit():
     sys.exit(0)
 
 
+async def start_pipeline(
+        app: web_app.Application,
+        pipeline_spec: dict = None,
+        fluent_tag: str = None,
+        fluent_host: str = "fluent-bit",
+        fluent_port: int = 25225,
+):
+    if fluent_tag not in endpoints:
+        raise RuntimeError(
+            "[ExtractXRPLTransactions] Could not recognize fluent tag - did you forget to specify the fluent tag? " +
+            str(fluent_tag))
+
+    pipeline = PipelineBuilder(
+        network=fluent_tag,
+        fluent_host=fluent_host,
+        fluent_port=fluent_port,
+        prom_registry=app["prom_registry"],
+    ).build(pipeline_spec)
+    app["pipeline"] = pipeline
+
+    for source in pipeline.sources.values():
+        if isinstance(source, LedgerCreationDataSource):
+            app["ledger_creation_source"] = source
+            app["ledger_creation_source_task"] = asyncio.create_task(websocket_supervisor(source))
+        else:
+            source.start()
+
+    logger.info("[ExtractXRPLTransactions] starting pipeline flows: %s", list(pipeline.flows.keys()))
+    pipeline.start_flows()
+
+
+def build_etl_processor(
+        schema,
+        etl_process_pool_size: int = 0,
+):
+    # offload the validation/transformation to worker processes when configured
+    if etl_process_pool_size > 0:
+        return ProcessPoolETLProcessor(
+            etl_steps=[
+                GenericValidator(schema),
+                XRPLGenericTransformer(schema),
+            ],
+            max_workers=etl_process_pool_size,
+        )
+
+    return ETLTemplateProcessor(
+        validator=GenericValidator(schema),
+        transformer=XRPLGenericTransformer(schema),
+    )
+
+
 async def start_template_flows(
         app: web_app.Application,
         fluent_tag: str = None,
         fluent_host: str = "fluent-bit",
         fluent_port: int = 25225,
+        etl_process_pool_size: int = 0,
+        dead_letter_path: str = None,
+        rpc_transport: str = "http",
+        is_hedge_ledger_fetches: bool = False,
+        is_coalesce_rpc_requests: bool = False,
 ):
     if fluent_tag not in endpoints:
         raise RuntimeError(
@@ -124,55 +214,147 @@ async def start_template_flows(
     logger.info("[ExtractXRPLTransactions] using endpoint: " + xrpl_endpoint)
     logger.info("[ExtractXRPLTransactions] using WSS endpoint: " + wss_endpoint)
 
-    async_rpc_client = AsyncJsonRpcClient(xrpl_endpoint)
+    flow_metrics = FlowMetrics(app["prom_registry"])
+    # messages that exhaust their retries are kept for a later replay
+    dead_letter_sink = DeadLetterLog(dead_letter_path) if dead_letter_path else None
+
+    def new_flow_builder(name: str) -> TemplateFlowBuilder:
+        return TemplateFlowBuilder().with_name(name).with_metrics(
+            flow_metrics
+        ).with_dead_letter_sink(dead_letter_sink)
+
+    connection_metrics = ConnectionMetrics(app["prom_registry"], fluent_tag)
+
+    # stay below the request rate the public nodes tolerate
+    def rate_limited(client) -> RateLimitedClient:
+        return RateLimitedClient(client, metrics=RateLimiterMetrics(app["prom_registry"], client.url))
+
+    if rpc_transport == "websocket":
+        # multiplex the requests over a few websocket connections
+        async_rpc_client = rate_limited(MultiplexedWebsocketClient(wss_endpoint, metrics=connection_metrics))
+    elif rpc_transport == "pool":
+        # spread the requests over the healthy nodes of the network
+        async_rpc_client = EndpointPoolClient(
+            [
+                rate_limited(get_json_rpc_client(url, metrics=connection_metrics))
+                for url in endpoint_pools.get(fluent_tag, [xrpl_endpoint])
+            ],
+            name=fluent_tag,
+            metrics=EndpointPoolMetrics(app["prom_registry"], fluent_tag),
+        )
+    else:
+        # keep the connections to the endpoint alive between the requests
+        async_rpc_client = rate_limited(get_json_rpc_client(xrpl_endpoint, metrics=connection_metrics))
+    app["pooled_rpc_client"] = async_rpc_client
+    # a ledger asked for by both flows, or re-queued while being fetched,
+    # is fetched once; the hedged fetches go around it
+    rpc_client = SingleflightClient(
+        async_rpc_client,
+        metrics=SingleflightMetrics(app["prom_registry"], fluent_tag),
+    ) if is_coalesce_rpc_requests else async_rpc_client
+    # stop hammering the RPC endpoint while it is down
+    rpc_breaker_metrics = CircuitBreakerMetrics(app["prom_registry"], fluent_tag)
+    rpc_retry_wrapper = RetryWrapper(
+        circuit_breaker=CircuitBreaker(name=fluent_tag, metrics=rpc_breaker_metrics),
+        retry_budget=RetryBudget(metrics=rpc_breaker_metrics),
+    )
     fluent_sender = FluentSender(fluent_tag + ".transactions", host=fluent_host, port=fluent_port)
-    ledger_creation_source = LedgerCreationDataSource(wss_url=wss_endpoint)
-    ledger_record_source_sink = QueueSourceSink(name="ledger_record_source_sink")
-    txn_record_source_sink = QueueSourceSink(name="txn_record_source_sink")
-    formatted_ledger_source_sink = QueueSourceSink(name="ledger_source_sink")
+    starting_index = read_last_ledger_index(app.ledger_index_file_path)
+    if starting_index is not None:
+        logger.info("Starting index: " + str(starting_index))
+
+    # the ledgers missed while disconnected (or down) are fetched by a
+    # flow of their own, so that the live ones do not wait behind them
+    ledger_backfill_source_sink = QueueSourceSink(
+        name="ledger_backfill_source_sink",
+        maxsize=1_000,
+        metrics=QueueMetrics(app["prom_registry"], "ledger_backfill_source_sink"),
+    )
+    # ledgers are fetched concurrently; release them in ascending order.
+    # the queues are bounded so that memory stays flat while catching up
+    ledger_record_source_sink = ReorderSourceSink(
+        name="ledger_record_source_sink",
+        max_buffer_size=100,
+        metrics=ReorderBufferMetrics(app["prom_registry"], "ledger_record_source_sink"),
+    )
+    ledger_creation_source = LedgerCreationDataSource(
+        wss_url=wss_endpoint,
+        backfill_sink=ledger_backfill_source_sink,
+        last_ledger=starting_index - 1 if starting_index is not None else None,
+        metrics=LedgerGapMetrics(app["prom_registry"], "ledger_creation"),
+        # start the reordering from the first ledger streamed rather than
+        # from whichever concurrent fetch completes first
+        first_ledger_callback=ledger_record_source_sink.seed,
+    )
+    txn_record_source_sink = QueueSourceSink(
+        name="txn_record_source_sink",
+        maxsize=10_000,
+        max_bytes=256 * 1024 * 1024,
+        metrics=QueueMetrics(app["prom_registry"], "txn_record_source_sink"),
+    )
+    formatted_ledger_source_sink = QueueSourceSink(
+        name="ledger_source_sink",
+        maxsize=1_000,
+        metrics=QueueMetrics(app["prom_registry"], "ledger_source_sink"),
+    )
     app["ledger_creation_source_task"] = asyncio.create_task(websocket_supervisor(ledger_creation_source))
     app["ledger_creation_source"] = ledger_creation_source
     app["ledger_record_source_sink"] = ledger_record_source_sink
     app["txn_record_source_sink"] = txn_record_source_sink
-    app["flow_ledger_details"] = []
-    starting_index = None
-
-    try:
-        with open(app.ledger_index_file_path, "r") as f:
-            logger.info("Reading ledger index from file")
-            for line in f:
-                starting_index = int(line)
-    except FileNotFoundError:
-        logger.info("No ledger index file present")
-
-    if starting_index is not None:
-        logger.info("Starting index: " + str(starting_index))
-
-        current_index = await ledger_creation_source.async_queue.get()
-        i = starting_index
-
-        while i <= current_index:
-            logger.info("Appending index to queue: " + str(i))
-            ledger_creation_source.async_queue.put_nowait(i)
-            i += 1
+    app["ledger_backfill_source_sink"] = ledger_backfill_source_sink
 
     ledger_index_processor = LedgerIndexProcessor(index_file_path=ledger_index_file_path)
-    # create 10 tasks of the same to increase throughput
-    for i in range(10):
-        ledger_details_pc_map_builder = ProcessCollectorsMapBuilder()
-        pc_map = ledger_details_pc_map_builder.with_processor(
-            XRPLFetchLedgerDetailsProcessor(
-                rpc_client=async_rpc_client,
-                ledger_index_processor=ledger_index_processor,
-            )
-        ).add_data_sink_output_collector(
-            data_sink=ledger_record_source_sink,
-            name="ledger_record_source_sink",
-        ).build()
-        flow_ledger_details = TemplateFlowBuilder().add_process_collectors_map(pc_map).build()
-        app["flow_ledger_details"].append(asyncio.create_task(flow_ledger_details.aexecute(
-            message_iterator=ledger_creation_source,
-        )))
+    # fetch several ledgers at once; how many adapts to the endpoint
+    # latency and backs off sharply when it times out or throttles
+    ledger_fetch_concurrency = AIMDConcurrencyController(
+        initial_limit=10,
+        max_limit=50,
+        target_latency_s=2.0,
+        metrics=ConcurrencyMetrics(app["prom_registry"], "ledger_details"),
+    )
+    # a few slow responses hold back the in-order queue; duplicate them
+    ledger_rpc_client = HedgedClient(
+        async_rpc_client,
+        metrics=HedgeMetrics(app["prom_registry"], "ledger_details"),
+    ) if is_hedge_ledger_fetches else rpc_client
+    pc_map = ProcessCollectorsMapBuilder().with_processor(
+        XRPLFetchLedgerDetailsProcessor(
+            rpc_client=ledger_rpc_client,
+            ledger_index_processor=ledger_index_processor,
+        )
+    ).add_data_sink_output_collector(
+        data_sink=ledger_record_source_sink,
+        name="ledger_record_source_sink",
+    ).build()
+    flow_ledger_details = new_flow_builder("ledger_details").add_process_collectors_map(
+        pc_map
+    ).with_retry_wrapper(rpc_retry_wrapper).with_concurrency_controller(
+        ledger_fetch_concurrency
+    ).build()
+    app["flow_ledger_details"] = asyncio.create_task(flow_ledger_details.aexecute(
+        message_iterator=ledger_creation_source,
+    ))
+
+    # Flow: Ledger Backfill; same fetch at a fixed, lower concurrency.
+    # the index file keeps the low watermark of both flows, so that a
+    # restart in the middle of a backfill resumes from the missing ledgers.
+    # the backfilled ledgers are behind the ones the reorder buffer has
+    # released already; they come out as they are fetched, out of order
+    pc_map = ProcessCollectorsMapBuilder().with_processor(
+        XRPLFetchLedgerDetailsProcessor(
+            rpc_client=rpc_client,
+            ledger_index_processor=ledger_index_processor,
+        )
+    ).add_data_sink_output_collector(
+        data_sink=ledger_record_source_sink,
+        name="ledger_record_source_sink",
+    ).build()
+    flow_ledger_backfill = new_flow_builder("ledger_backfill").add_process_collectors_map(
+        pc_map
+    ).with_retry_wrapper(rpc_retry_wrapper).with_max_in_flight(4).build()
+    app["flow_ledger_backfill"] = asyncio.create_task(flow_ledger_backfill.aexecute(
+        message_iterator=ledger_backfill_source_sink,
+    ))
 
     # Flow: Ledger to Transactions Break Flow
     pc_map = ProcessCollectorsMapBuilder().with_processor(
@@ -191,41 +373,45 @@ async def start_template_flows(
         name="txn_record_source_sink",
     ).build()
 
-    flow_ledger_to_txns_brk = TemplateFlowBuilder().add_process_collectors_map(pc_map).add_process_collectors_map(
-        ledger_record_pc_map).build()
+    flow_ledger_to_txns_brk = new_flow_builder("ledger_to_txns_brk").add_process_collectors_map(
+        pc_map
+    ).add_process_collectors_map(ledger_record_pc_map).build()
     app["flow_ledger_to_txns_brk"] = asyncio.create_task(flow_ledger_to_txns_brk.aexecute(
         message_iterator=ledger_record_source_sink,
     ))
 
+    # the worker processes, if any, are shut down with the flows
+    txn_etl_processor = build_etl_processor(XRPLTransactionSchema.SCHEMA, etl_process_pool_size)
+    ledger_etl_processor = build_etl_processor(XRPLLedgerSchema.SCHEMA, etl_process_pool_size)
+    app["etl_processors"] = [txn_etl_processor, ledger_etl_processor]
+
     # Flow: Transaction Record
     pc_map = ProcessCollectorsMapBuilder().with_processor(
-        ETLTemplateProcessor(
-            validator=GenericValidator(XRPLTransactionSchema.SCHEMA),
-            transformer=XRPLGenericTransformer(XRPLTransactionSchema.SCHEMA),
-        )
+        txn_etl_processor
     ).with_stdout_output_collector(
         tag_name=fluent_tag,
         is_simplified=True
     ).add_fluent_output_collector(
         fluent_sender=fluent_sender,
     ).build()
-    flow_txn_record = TemplateFlowBuilder().add_process_collectors_map(pc_map).build()
+    flow_txn_record = new_flow_builder("txn_record").add_process_collectors_map(
+        pc_map
+    ).with_micro_batching(max_batch_size=50, max_linger_s=0.05).build()
     app["flow_txn_record"] = asyncio.create_task(flow_txn_record.aexecute(
         message_iterator=txn_record_source_sink,
     ))
 
     pc_map_ledgers = ProcessCollectorsMapBuilder().with_processor(
-        ETLTemplateProcessor(
-            validator=GenericValidator(XRPLLedgerSchema.SCHEMA),
-            transformer=XRPLGenericTransformer(XRPLLedgerSchema.SCHEMA),
-        )
+        ledger_etl_processor
     ).with_stdout_output_collector(
         tag_name=fluent_tag,
         is_simplified=True
     ).add_fluent_output_collector(
         fluent_sender=FluentSender(fluent_tag + ".ledgers", host=fluent_host, port=fluent_port),
     ).build()
-    flow_ledger_record = TemplateFlowBuilder().add_process_collectors_map(pc_map_ledgers).build()
+    flow_ledger_record = new_flow_builder("ledger_record").add_process_collectors_map(
+        pc_map_ledgers
+    ).build()
     logger.info("done building, running...")
     app["flow_ledger_record"] = asyncio.create_task(flow_ledger_record.aexecute(
         message_iterator=formatted_ledger_source_sink,
@@ -272,16 +458,39 @@ if __name__ == "__main__":
     config = load_from_file(args.config)
     fluent_tag = config["network"] if "network" in config and config["network"] is not None else args.fluent_tag
     ledger_index_file_path = config["ledger_index_path"] if "ledger_index_path" in config else "/app/persistent_data/ledgers.txt"
+    etl_process_pool_size = config.get("etl_process_pool_size") or 0
+    dead_letter_path = config.get("dead_letter_path")
+    rpc_transport = config.get("rpc_transport") or "http"
+    is_hedge_ledger_fetches = config.get("hedge_ledger_fetches") or False
+    is_coalesce_rpc_requests = config.get("coalesce_rpc_requests") or False
 
     app = web.Application()
     app.add_routes([
         web.get('/', handle),
-        web.get('/{name}', handle),
         web.get('/health', health_check),
+        web.get('/metrics', metrics),
+        web.get('/{name}', handle),
     ])
+    app["prom_registry"] = CollectorRegistry()
     app.ledger_index_file_path = ledger_index_file_path
 
-    app.on_startup.append(partial(start_template_flows, fluent_tag=fluent_tag))
+    if config.get("pipeline"):
+        # the topology is declared in the config file
+        app.on_startup.append(partial(
+            start_pipeline,
+            pipeline_spec=config["pipeline"],
+            fluent_tag=fluent_tag,
+        ))
+    else:
+        app.on_startup.append(partial(
+            start_template_flows,
+            fluent_tag=fluent_tag,
+            etl_process_pool_size=etl_process_pool_size,
+            dead_letter_path=dead_letter_path,
+            rpc_transport=rpc_transport,
+            is_hedge_ledger_fetches=is_hedge_ledger_fetches,
+            is_coalesce_rpc_requests=is_coalesce_rpc_requests,
+        ))
     app.on_cleanup.append(stop_template_flows)
     app.on_shutdown.append(stop_template_flows)
 
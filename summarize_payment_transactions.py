@@ -1,7 +1,7 @@
+import argparse
 import asyncio
 import logging
 
-from xrpl.asyncio.clients import AsyncJsonRpcClient
 from xrpl.asyncio.ledger import get_latest_validated_ledger_sequence
 
 from ekspiper.builder.flow import (
@@ -10,11 +10,14 @@ from ekspiper.builder.flow import (
 )
 from ekspiper.connect.counter import PartitionedCounterDataSource
 from ekspiper.connect.queue import QueueSourceSink
+from ekspiper.connect.rpc import get_json_rpc_client
+from ekspiper.processor.cache import CachingLedgerFetchProcessor
 from ekspiper.processor.fetch_transactions import (
     XRPLFetchLedgerDetailsProcessor,
     XRPLExtractTransactionsFromLedgerProcessor,
     PaymentTransactionSummaryProcessor,
 )
+from ekspiper.util.concurrency import AIMDConcurrencyController
 
 logger = logging.getLogger(__name__)
 
@@ -26,8 +29,10 @@ async def start_ledger_sequence(client) -> int:
     return await get_latest_validated_ledger_sequence(client) - 1
 
 
-async def amain():
-    async_rpc_client = AsyncJsonRpcClient("https://s2.ripple.com:51234/")
+async def amain(
+        cache_dir: str = None,
+):
+    async_rpc_client = get_json_rpc_client("https://s2.ripple.com:51234/")
     start_index = await start_ledger_sequence(async_rpc_client)
 
     # build the ledger queue for processing
@@ -37,35 +42,41 @@ async def amain():
 
     # Flow: Obtain Ledger Details
     #
-    flow_ledger_detail_tasks = []
-    partition_size = 10
-    for i in range(partition_size):
-        async_rpc_client = AsyncJsonRpcClient("https://s2.ripple.com:51234/")
-
-        # start with the counter
-        index_decrementor_data_source = PartitionedCounterDataSource(
-            starting_count=start_index,
-            shard_index=i,
-            shard_size=partition_size,
-        )
-        index_decrementor_data_source.start()
+    # start with the counter
+    index_decrementor_data_source = PartitionedCounterDataSource(
+        starting_count=start_index,
+        shard_index=0,
+        shard_size=1,
+    )
+    index_decrementor_data_source.start()
 
-        pc_map = ProcessCollectorsMapBuilder().with_processor(
-            XRPLFetchLedgerDetailsProcessor(
-                rpc_client=async_rpc_client,
-            )
-        ).add_data_sink_output_collector(
-            data_sink=ledger_record_source_sink,
-            name="ledger_record_source_sink"
-        ).build()
+    ledger_fetch_processor = XRPLFetchLedgerDetailsProcessor(
+        rpc_client=async_rpc_client,
+    )
+    if cache_dir is not None:
+        # the runs over the same ledgers read them back from the disk
+        ledger_fetch_processor = CachingLedgerFetchProcessor(
+            ledger_fetch_processor,
+            cache_dir=cache_dir,
+            network="mainnet",
+        )
+    pc_map = ProcessCollectorsMapBuilder().with_processor(
+        ledger_fetch_processor
+    ).add_data_sink_output_collector(
+        data_sink=ledger_record_source_sink,
+        name="ledger_record_source_sink"
+    ).build()
 
-        flow_payment_detail = TemplateFlowBuilder().add_process_collectors_map(
-            pc_map
-        ).build()
+    # the number of ledgers fetched at once adapts to the endpoint
+    flow_ledger_detail = TemplateFlowBuilder().add_process_collectors_map(
+        pc_map
+    ).with_concurrency_controller(
+        AIMDConcurrencyController(initial_limit=10, max_limit=50, target_latency_s=2.0)
+    ).build()
 
-        flow_ledger_detail_tasks.append(asyncio.create_task(flow_payment_detail.aexecute(
-            message_iterator=index_decrementor_data_source,
-        )))
+    flow_ledger_detail_task = asyncio.create_task(flow_ledger_detail.aexecute(
+        message_iterator=index_decrementor_data_source,
+    ))
 
     # build the transaction queue for processing
     txn_record_source_sink = QueueSourceSink(
@@ -100,9 +111,26 @@ async def amain():
     ))
 
     # TODO: for now
-    # asyncio.gather(*flow_ledger_detail_tasks)
+    # await flow_ledger_detail_task
     await flow_summary_txns_task
 
 
+def parse_arguments() -> argparse.Namespace:
+    arg_parser = argparse.ArgumentParser()
+
+    arg_parser.add_argument(
+        "-c",
+        "--cache_dir",
+        help="keep the fetched ledgers in this directory for the next runs",
+        type=str,
+        default=None,
+    )
+
+    return arg_parser.parse_args()
+
+
 if __name__ == "__main__":
-    asyncio.run(amain())
+    args = parse_arguments()
+    asyncio.run(amain(
+        cache_dir=args.cache_dir,
+    ))
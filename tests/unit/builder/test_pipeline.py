@@ -0,0 +1,122 @@
+import asyncio
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+
+import yaml
+from xrpl.asyncio.clients import AsyncJsonRpcClient
+
+from ekspiper.builder.pipeline import PipelineBuilder
+from ekspiper.connect.queue import QueueSourceSink
+
+pipeline_yml = """
+queues:
+  input:
+    type: queue
+  middle:
+    type: queue
+    maxsize: 2
+  output:
+    type: queue
+flows:
+  first:
+    source: input
+    max_in_flight: 2
+    stages:
+      - name: pass_one
+        processor:
+          type: passthru
+        collectors:
+          - type: data_sink
+            sink: middle
+  second:
+    source: middle
+    max_batch_size: 3
+    stages:
+      - processor:
+          type: passthru
+        collectors:
+          - type: data_sink
+            sink: output
+"""
+
+
+class PipelineBuilderTest(unittest.IsolatedAsyncioTestCase):
+    async def test_build_and_run(self):
+        pipeline = PipelineBuilder().build(yaml.safe_load(pipeline_yml))
+
+        self.assertEqual(["first", "second"], list(pipeline.flows.keys()))
+        self.assertEqual(2, pipeline.flows["first"].max_in_flight)
+        self.assertEqual(3, pipeline.flows["second"].max_batch_size)
+        self.assertIsInstance(pipeline.flow_iterators["second"], QueueSourceSink)
+
+        for i in range(5):
+            await pipeline.queues["input"].put(i)
+
+        pipeline.start_flows()
+        pipeline.queues["input"].stop()
+        await pipeline.flow_tasks["first"]
+        pipeline.queues["middle"].stop()
+        await pipeline.flow_tasks["second"]
+
+        output = pipeline.queues["output"]
+        output.stop()
+        self.assertEqual(list(range(5)), sorted([e async for e in output]))
+
+    async def test_start_downstream_flows(self):
+        pipeline = PipelineBuilder().build(yaml.safe_load(pipeline_yml))
+
+        self.assertEqual(["second"], pipeline.downstream_flows("first"))
+        self.assertEqual([], pipeline.downstream_flows("second"))
+
+        # the flow feeding `middle` is left out, so it is stopped on drain
+        await pipeline.queues["middle"].put(1)
+        pipeline.start_flows(["second"])
+        await asyncio.wait_for(pipeline.adrain(), 5)
+
+        self.assertEqual(["second"], list(pipeline.flow_tasks.keys()))
+        self.assertEqual([1], [e async for e in pipeline.queues["output"]])
+
+    def test_shared_decode_executor(self):
+        spec = yaml.safe_load(pipeline_yml)
+        for name in ["first", "second"]:
+            spec["flows"][name]["stages"][0]["processor"] = {"type": "fetch_ledger_details", "binary": True}
+        pipeline = PipelineBuilder(rpc_client=AsyncJsonRpcClient("http://localhost:51234/")).build(spec)
+
+        decode_executor = pipeline.flows["first"].process_collectors_maps[0].processor.decode_executor
+        self.assertIsInstance(decode_executor, ProcessPoolExecutor)
+        self.assertIs(decode_executor, pipeline.flows["second"].process_collectors_maps[0].processor.decode_executor)
+        self.assertEqual([decode_executor], pipeline.executors)
+
+        pipeline.shutdown()
+        self.assertEqual([], pipeline.executors)
+        with self.assertRaises(RuntimeError):
+            decode_executor.submit(print)
+
+    def test_etl_executor_shutdown(self):
+        spec = yaml.safe_load(pipeline_yml)
+        spec["flows"]["first"]["stages"][0]["processor"] = {"type": "etl", "process_pool_size": 1}
+        pipeline = PipelineBuilder().build(spec)
+
+        etl_executor = pipeline.flows["first"].process_collectors_maps[0].processor.executor
+        self.assertEqual([etl_executor], pipeline.executors)
+
+        pipeline.shutdown()
+        with self.assertRaises(RuntimeError):
+            etl_executor.submit(print)
+
+    def test_unknown_processor(self):
+        spec = yaml.safe_load(pipeline_yml)
+        spec["flows"]["first"]["stages"][0]["processor"]["type"] = "unknown"
+
+        with self.assertRaises(ValueError):
+            PipelineBuilder().build(spec)
+
+    def test_shared_retry_wrapper(self):
+        spec = yaml.safe_load(pipeline_yml)
+        spec["flows"]["first"]["retry"] = {"endpoint": "testnet", "failure_threshold": 3}
+        spec["flows"]["second"]["retry"] = {"endpoint": "testnet"}
+        pipeline = PipelineBuilder().build(spec)
+
+        retry_wrapper = pipeline.flows["first"].retry_wrapper
+        self.assertIs(retry_wrapper, pipeline.flows["second"].retry_wrapper)
+        self.assertEqual(3, retry_wrapper.circuit_breaker.failure_threshold)
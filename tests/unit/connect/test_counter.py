@@ -0,0 +1,77 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from ekspiper.collector.ledger_range import LedgerRangeCompletionCollector
+from ekspiper.connect.counter import (
+    LedgerRangeDataSource,
+    LedgerRangeScheduler,
+    PartitionedCounterDataSource,
+)
+
+
+class PartitionedCounterDataSourceTest(unittest.IsolatedAsyncioTestCase):
+    async def test_shard_until_end_count(self):
+        counter = PartitionedCounterDataSource(
+            starting_count=10,
+            shard_index=1,
+            shard_size=3,
+            end_count=2,
+        )
+        counter.start()
+
+        self.assertEqual([10, 7, 4], [i async for i in counter])
+
+
+class LedgerRangeSchedulerTest(unittest.IsolatedAsyncioTestCase):
+    async def test_workers_cover_the_range(self):
+        scheduler = LedgerRangeScheduler(start_index=1, end_index=25, chunk_size=10, is_descending=False)
+        sources = [LedgerRangeDataSource(scheduler, worker_id=str(i)) for i in range(3)]
+
+        async def _aconsume(source):
+            return [i async for i in source]
+
+        indices = await asyncio.gather(*[_aconsume(s) for s in sources])
+
+        self.assertEqual(list(range(1, 26)), sorted(sum(indices, [])))
+        # chunks are aligned on multiples of chunk_size and leased in ascending order
+        self.assertEqual([1, 10, 20], sorted(worker_indices[0] for worker_indices in indices))
+
+    def test_work_stealing(self):
+        scheduler = LedgerRangeScheduler(start_index=19, end_index=10, chunk_size=10)
+
+        self.assertEqual(19, scheduler.next_index("slow"))
+        # no chunk left; steal the second half of what remains of 'slow'
+        self.assertEqual(14, scheduler.next_index("idle"))
+        self.assertEqual([18, 17, 16, 15], [scheduler.next_index("slow") for _ in range(4)])
+        self.assertEqual([13, 12, 11, 10], [scheduler.next_index("idle") for _ in range(4)])
+
+        self.assertIsNone(scheduler.next_index("slow"))
+        self.assertIsNone(scheduler.next_index("idle"))
+
+    def test_completed_chunks_are_skipped(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            completed_file = os.path.join(tmp_dir, "completed.jsonl")
+            scheduler = LedgerRangeScheduler(start_index=29, end_index=1, chunk_size=10, completed_file=completed_file)
+            for _ in range(10):
+                scheduler.complete(scheduler.next_index("worker"))
+            self.assertEqual(1, scheduler.completed_chunk_count)
+
+            # the next run starts from a later ledger
+            scheduler = LedgerRangeScheduler(start_index=35, end_index=1, chunk_size=10, completed_file=completed_file)
+            self.assertEqual([35, 34, 33, 32, 31, 30, 19], [scheduler.next_index("worker") for _ in range(7)])
+
+    async def test_completed_once_written(self):
+        scheduler = LedgerRangeScheduler(start_index=2, end_index=1, chunk_size=10)
+        collector = LedgerRangeCompletionCollector(scheduler)
+        self.assertEqual([2, 1], [scheduler.next_index("worker") for _ in range(2)])
+
+        # a transaction may be written before its ledger record
+        await collector.acollect_output({"_LedgerIndex": 2, "hash": "A"})
+        await collector.acollect_output({"ledger_index": 2, "transaction_count": 2})
+        await collector.acollect_output({"ledger_index": 1, "transaction_count": 0})
+        self.assertEqual(0, scheduler.completed_chunk_count)
+
+        await collector.acollect_output({"_LedgerIndex": 2, "hash": "B"})
+        self.assertEqual(1, scheduler.completed_chunk_count)
@@ -0,0 +1,66 @@
+import os
+import tempfile
+import unittest
+
+from xrpl.models.currencies import XRP, IssuedCurrency
+from xrpl.models.requests import BookOffers
+
+from ekspiper.connect.dead_letter import (
+    DeadLetterDataSource,
+    DeadLetterLog,
+    build_dead_letter,
+)
+from ekspiper.util.callable import RetryExhaustedError
+
+
+class DeadLetterTest(unittest.IsolatedAsyncioTestCase):
+    async def test_log_and_replay(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "dead_letters.jsonl")
+            dead_letter_log = DeadLetterLog(path)
+            await dead_letter_log.put(build_dead_letter(
+                entry=72959850,
+                error=RetryExhaustedError(5, ValueError("lgrNotFound")),
+                flow="ledger_details",
+                stage="fetch",
+            ))
+            await dead_letter_log.put(build_dead_letter(
+                entry={"ledger_index": 1},
+                error=ValueError("bad"),
+                flow="other",
+            ))
+
+            source = DeadLetterDataSource(path, rate_per_s=1000, flow="ledger_details")
+            source.start()
+            entries = [e async for e in source]
+
+            self.assertEqual([72959850], entries)
+
+    async def test_request_round_trip(self):
+        book_offers = BookOffers(
+            ledger_index=100,
+            taker_gets=XRP(),
+            taker_pays=IssuedCurrency(currency="USD", issuer="rvYAfWj5gh67oV6fW32ZzP3Aw4Eubs59B"),
+        )
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "dead_letters.jsonl")
+            await DeadLetterLog(path).put(build_dead_letter(
+                entry=book_offers,
+                error=ValueError("tooBusy"),
+                flow="book_offers",
+            ))
+
+            source = DeadLetterDataSource(path, rate_per_s=1000)
+            source.start()
+            entries = [e async for e in source]
+
+            self.assertEqual([book_offers], entries)
+            self.assertIsInstance(entries[0], BookOffers)
+
+    def test_build_dead_letter_attempt_count(self):
+        dead_letter = build_dead_letter(
+            entry=1,
+            error=RetryExhaustedError(5, ValueError("lgrNotFound")),
+        )
+        self.assertEqual(5, dead_letter["attempt_count"])
+        self.assertEqual("ValueError: lgrNotFound", dead_letter["error"])
@@ -0,0 +1,105 @@
+import asyncio
+import unittest
+
+from xrpl.asyncio.clients.async_client import AsyncClient
+from xrpl.models.requests import Ledger, ServerInfo
+from xrpl.models.response import Response, ResponseStatus
+
+from ekspiper.connect.endpoint_pool import EndpointPoolClient
+
+
+class _TestClient(AsyncClient):
+    def __init__(self, url, missing_ledger_indices=(), is_down=False, delay_s=0, validated_seq=1000):
+        super().__init__(url)
+        self.missing_ledger_indices = set(missing_ledger_indices)
+        self.validated_seq = validated_seq
+        self.is_down = is_down
+        self.delay_s = delay_s
+        self.requests = []
+
+    async def request_impl(self, request):
+        self.requests.append(request)
+        await asyncio.sleep(self.delay_s)
+        if self.is_down:
+            raise ConnectionError("down")
+        if isinstance(request, ServerInfo):
+            return Response(status=ResponseStatus.SUCCESS, result={"info": {"validated_ledger": {"seq": self.validated_seq}}})
+        if request.ledger_index in self.missing_ledger_indices:
+            return Response(status=ResponseStatus.ERROR, result={"error": "lgrNotFound"})
+        return Response(status=ResponseStatus.SUCCESS, result={"ledger_index": request.ledger_index})
+
+
+class EndpointPoolClientTest(unittest.IsolatedAsyncioTestCase):
+    async def test_least_outstanding(self):
+        clients = [_TestClient("http://a/", delay_s=0.05), _TestClient("http://b/", delay_s=0.05)]
+        pool = EndpointPoolClient(clients)
+
+        await asyncio.gather(*[pool.request(Ledger(ledger_index=i)) for i in range(10)])
+        await pool.aclose()
+
+        self.assertEqual([5, 5], [len([r for r in c.requests if isinstance(r, Ledger)]) for c in clients])
+
+    async def test_failover_and_probe(self):
+        down_client = _TestClient("http://a/", is_down=True)
+        up_client = _TestClient("http://b/", delay_s=0.01)
+        pool = EndpointPoolClient([down_client, up_client], max_failure_count=2, probe_interval_s=0.05)
+
+        for i in range(5):
+            response = await pool.request(Ledger(ledger_index=i))
+            self.assertEqual(i, response.result["ledger_index"])
+
+        # ejected after the second failure, then left alone
+        self.assertEqual(2, len([r for r in down_client.requests if isinstance(r, Ledger)]))
+        self.assertTrue(pool.endpoints[0].is_ejected)
+
+        down_client.is_down = False
+        await asyncio.sleep(0.15)
+        self.assertFalse(pool.endpoints[0].is_ejected)
+        self.assertIsInstance(down_client.requests[-1], ServerInfo)
+        await pool.aclose()
+
+    async def test_lgr_not_found_historical(self):
+        partial_history_client = _TestClient("http://a/", missing_ledger_indices=range(100))
+        full_history_client = _TestClient("http://b/", delay_s=0.01)
+        pool = EndpointPoolClient([partial_history_client, full_history_client], probe_interval_s=0.05)
+
+        # a recent ledger not found yet does not eject the node
+        partial_history_client.missing_ledger_indices.add(1000)
+        response = await pool.request(Ledger(ledger_index=1000))
+        self.assertEqual(1000, response.result["ledger_index"])
+        self.assertFalse(pool.endpoints[0].is_ejected)
+
+        response = await pool.request(Ledger(ledger_index=50))
+        self.assertEqual(50, response.result["ledger_index"])
+        self.assertTrue(pool.endpoints[0].is_ejected)
+
+        # the probe asks for the missing ledger, so the node stays out
+        await asyncio.sleep(0.15)
+        self.assertTrue(pool.endpoints[0].is_ejected)
+        self.assertEqual(50, partial_history_client.requests[-1].ledger_index)
+        await pool.aclose()
+
+    async def test_all_down(self):
+        pool = EndpointPoolClient([_TestClient("http://a/", is_down=True), _TestClient("http://b/", is_down=True)])
+
+        with self.assertRaises(ConnectionError):
+            await pool.request(Ledger(ledger_index=1))
+        await pool.aclose()
+
+    async def test_latest_ledger_from_server_info(self):
+        partial_history_client = _TestClient("http://a/", missing_ledger_indices=[50], validated_seq=2000)
+        full_history_client = _TestClient("http://b/", delay_s=0.01, validated_seq=2000)
+        pool = EndpointPoolClient([partial_history_client, full_history_client], probe_interval_s=0.05)
+
+        # judged against the validated ledger even before any recent one is fetched
+        response = await pool.request(Ledger(ledger_index=50))
+        self.assertEqual(50, response.result["ledger_index"])
+        self.assertEqual(2000, pool.latest_ledger_index)
+        self.assertTrue(pool.endpoints[0].is_ejected)
+
+        # refreshed in the background
+        full_history_client.validated_seq = 2100
+        partial_history_client.validated_seq = 2100
+        await asyncio.sleep(0.15)
+        self.assertEqual(2100, pool.latest_ledger_index)
+        await pool.aclose()
@@ -0,0 +1,84 @@
+import asyncio
+import unittest
+
+from prometheus_client import CollectorRegistry
+from xrpl.asyncio.clients.async_client import AsyncClient
+from xrpl.models.requests import Ledger
+from xrpl.models.response import Response, ResponseStatus
+
+from ekspiper.connect.hedge import HedgedClient
+from ekspiper.metric.prom import HedgeMetrics
+
+
+class _TestClient(AsyncClient):
+    def __init__(self, delays_s):
+        super().__init__("http://localhost:51234/")
+        self.delays_s = list(delays_s)
+        self.request_count = 0
+        self.cancelled_count = 0
+
+    async def request_impl(self, request):
+        delay_s = self.delays_s[self.request_count % len(self.delays_s)]
+        self.request_count += 1
+        try:
+            await asyncio.sleep(delay_s)
+        except asyncio.CancelledError:
+            self.cancelled_count += 1
+            raise
+        return Response(status=ResponseStatus.SUCCESS, result={"ledger_index": request.ledger_index})
+
+
+class HedgedClientTest(unittest.IsolatedAsyncioTestCase):
+    async def test_hedge_slow_request(self):
+        registry = CollectorRegistry()
+        # the first request is slow, its duplicate is not
+        client = _TestClient([1, 0.01])
+        hedged_client = HedgedClient(client, initial_delay_s=0.05, metrics=HedgeMetrics(registry, "test"))
+
+        start_time = asyncio.get_running_loop().time()
+        response = await hedged_client.request(Ledger(ledger_index=1))
+
+        self.assertEqual(1, response.result["ledger_index"])
+        self.assertLess(asyncio.get_running_loop().time() - start_time, 0.5)
+        await asyncio.sleep(0)
+        self.assertEqual(2, client.request_count)
+        self.assertEqual(1, client.cancelled_count)
+        self.assertEqual(1, registry.get_sample_value("rx_hedge_won_total", {"name": "test"}))
+        # the caller waited for the delay and the duplicate, not the duplicate alone
+        self.assertEqual(1, len(hedged_client.latencies))
+        self.assertGreaterEqual(hedged_client.latencies[0], 0.05)
+
+    async def test_latency_of_failures(self):
+        class _FailingClient(_TestClient):
+            async def request_impl(self, request):
+                await super().request_impl(request)
+                raise ConnectionError("simulated connection error")
+
+        hedged_client = HedgedClient(_FailingClient([0.02]), initial_delay_s=1)
+
+        with self.assertRaises(ConnectionError):
+            await hedged_client.request(Ledger(ledger_index=1))
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(hedged_client.request(Ledger(ledger_index=2)), 0.01)
+
+        self.assertEqual(2, len(hedged_client.latencies))
+        self.assertGreaterEqual(hedged_client.latencies[0], 0.02)
+
+    async def test_delay_from_percentile(self):
+        hedged_client = HedgedClient(_TestClient([0.01]), min_sample_count=5, min_delay_s=0)
+        hedged_client.latencies.extend([0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0])
+
+        self.assertEqual(1.0, hedged_client.hedge_delay_s())
+        hedged_client.percentile = 0.5
+        self.assertEqual(0.6, hedged_client.hedge_delay_s())
+
+    async def test_max_hedge_ratio(self):
+        client = _TestClient([0.03])
+        hedged_client = HedgedClient(client, initial_delay_s=0.01, max_hedge_ratio=0.1, min_sample_count=1000)
+
+        await asyncio.gather(*[hedged_client.request(Ledger(ledger_index=i)) for i in range(50)])
+
+        # the balance caps the burst, the 50 requests earn at most 5 more
+        hedge_count = client.request_count - 50
+        self.assertGreater(hedge_count, 0)
+        self.assertLessEqual(hedge_count, 2 + 5)
@@ -0,0 +1,53 @@
+import asyncio
+import unittest
+
+from prometheus_client import CollectorRegistry
+
+from ekspiper.connect.queue import QueueSourceSink
+from ekspiper.metric.prom import QueueMetrics
+
+
+class QueueSourceSinkTest(unittest.IsolatedAsyncioTestCase):
+    async def test_blocks_at_high_watermark(self):
+        registry = CollectorRegistry()
+        q = QueueSourceSink(
+            maxsize=4,
+            low_watermark_ratio=0.5,
+            metrics=QueueMetrics(registry, "test"),
+        )
+        for i in range(4):
+            await q.put(i)
+
+        blocked_put = asyncio.create_task(q.put(4))
+        await asyncio.sleep(0.01)
+        self.assertFalse(blocked_put.done())
+
+        # still above the low watermark
+        self.assertEqual(0, await q.__anext__())
+        await asyncio.sleep(0.01)
+        self.assertFalse(blocked_put.done())
+
+        self.assertEqual(1, await q.__anext__())
+        await asyncio.wait_for(blocked_put, 1)
+
+        q.stop()
+        self.assertEqual([2, 3, 4], [e async for e in q])
+        self.assertEqual(1, registry.get_sample_value("rx_queue_blocked_put_total", {"name": "test"}))
+        self.assertEqual(0, registry.get_sample_value("rx_queue_depth", {"name": "test"}))
+
+    async def test_blocks_at_max_bytes(self):
+        q = QueueSourceSink(
+            max_bytes=10,
+            size_func=len,
+        )
+        await q.put("12345")
+        await q.put("123456")
+        self.assertEqual(11, q.size_bytes)
+
+        blocked_put = asyncio.create_task(q.put("1"))
+        await asyncio.sleep(0.01)
+        self.assertFalse(blocked_put.done())
+
+        self.assertEqual("12345", await q.__anext__())
+        await asyncio.wait_for(blocked_put, 1)
+        self.assertEqual(7, q.size_bytes)
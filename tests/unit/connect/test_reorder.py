@@ -0,0 +1,81 @@
+import asyncio
+import unittest
+
+from prometheus_client import CollectorRegistry
+
+from ekspiper.connect.reorder import ReorderSourceSink, ledger_index_key
+from ekspiper.metric.prom import ReorderBufferMetrics
+
+
+class ReorderSourceSinkTest(unittest.IsolatedAsyncioTestCase):
+    async def test_releases_in_key_order(self):
+        source_sink = ReorderSourceSink(start_key=1)
+        for ledger_index in [3, 1, 5, 2, 4]:
+            await source_sink.put({"ledger_index": ledger_index})
+        source_sink.stop()
+
+        outputs = [ledger_index_key(e) async for e in source_sink]
+
+        self.assertEqual([1, 2, 3, 4, 5], outputs)
+
+    async def test_seeded_start_key(self):
+        source_sink = ReorderSourceSink()
+        source_sink.seed(1)
+        source_sink.seed(2)
+        # the fetch of 1 completes after 2
+        for ledger_index in [2, 1]:
+            await source_sink.put(ledger_index)
+        source_sink.stop()
+
+        outputs = [e async for e in source_sink]
+
+        self.assertEqual([1, 2], outputs)
+
+    async def test_descending_order(self):
+        source_sink = ReorderSourceSink(start_key=10, incr_by=-1)
+        for ledger_index in [8, 9, 10]:
+            await source_sink.put(ledger_index)
+        source_sink.stop()
+
+        outputs = [e async for e in source_sink]
+
+        self.assertEqual([10, 9, 8], outputs)
+
+    async def test_skips_gap_after_timeout(self):
+        registry = CollectorRegistry()
+        source_sink = ReorderSourceSink(
+            start_key=1,
+            gap_timeout_s=0.05,
+            metrics=ReorderBufferMetrics(registry, "test"),
+        )
+        await source_sink.put(1)
+        await source_sink.put(3)
+
+        self.assertEqual(1, await source_sink.__anext__())
+        self.assertEqual(3, await asyncio.wait_for(source_sink.__anext__(), 1))
+        self.assertEqual(1, registry.get_sample_value(
+            "rx_reorder_gap_skipped_total", {"name": "test"}))
+
+        # the late entry is still delivered
+        await source_sink.put(2)
+        self.assertEqual(2, await source_sink.__anext__())
+
+    async def test_put_blocks_when_buffer_is_full(self):
+        source_sink = ReorderSourceSink(start_key=1, max_buffer_size=2)
+        await source_sink.put(3)
+        await source_sink.put(4)
+
+        blocked_put = asyncio.create_task(source_sink.put(5))
+        await asyncio.sleep(0.01)
+        self.assertFalse(blocked_put.done())
+
+        # the expected key is accepted while the consumer is waiting on it
+        await source_sink.put(1)
+        self.assertEqual(1, await source_sink.__anext__())
+        await source_sink.put(2)
+        self.assertEqual(2, await source_sink.__anext__())
+        self.assertEqual(3, await source_sink.__anext__())
+
+        await asyncio.wait_for(blocked_put, 1)
+        source_sink.stop()
+        self.assertEqual([4, 5], [e async for e in source_sink])
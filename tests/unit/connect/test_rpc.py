@@ -0,0 +1,188 @@
+import asyncio
+import time
+import unittest
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from prometheus_client import CollectorRegistry
+from xrpl.asyncio.clients import XRPLRequestFailureException
+from xrpl.asyncio.clients.async_client import AsyncClient
+from xrpl.models.requests import Ledger
+from xrpl.models.response import Response, ResponseStatus
+
+from ekspiper.connect.rpc import (
+    BatchNotSupportedError,
+    PooledJsonRpcClient,
+    RateLimitedClient,
+    get_json_rpc_client,
+)
+from ekspiper.metric.prom import ConnectionMetrics, RateLimiterMetrics
+from ekspiper.util.callable import RPCResponseError
+from ekspiper.util.rate_limit import TokenBucketRateLimiter, get_rate_limiter
+
+
+class _TestClient(AsyncClient):
+    def __init__(self):
+        super().__init__("http://localhost:51234/")
+        self.request_count = 0
+
+    async def request_impl(self, request):
+        self.request_count += 1
+        return Response(status=ResponseStatus.SUCCESS, result={"ledger_index": request.ledger_index})
+
+
+class TokenBucketRateLimiterTest(unittest.IsolatedAsyncioTestCase):
+    async def test_burst_then_rate(self):
+        rate_limiter = TokenBucketRateLimiter(rate_per_s=50, burst=5)
+
+        start_time = time.monotonic()
+        for _ in range(5):
+            await rate_limiter.acquire()
+        self.assertLess(time.monotonic() - start_time, 0.05)
+
+        # the next 5 have to wait for the refill at 50/s
+        await asyncio.gather(*[rate_limiter.acquire() for _ in range(5)])
+        self.assertGreaterEqual(time.monotonic() - start_time, 0.09)
+
+    def test_shared_per_url(self):
+        self.assertIs(get_rate_limiter("http://localhost:1/"), get_rate_limiter("http://localhost:1/"))
+        self.assertIsNot(get_rate_limiter("http://localhost:1/"), get_rate_limiter("http://localhost:2/"))
+
+    def test_metrics_passed_in(self):
+        registry = CollectorRegistry()
+        client = RateLimitedClient(_TestClient(), metrics=RateLimiterMetrics(registry, "test"))
+
+        asyncio.run(client.rate_limiter.acquire())
+
+        self.assertIs(client.rate_limiter, get_rate_limiter(_TestClient().url))
+        self.assertEqual(1, registry.get_sample_value("rx_rate_limiter_acquired_total", {"name": "test"}))
+
+    def test_shared_across_loops(self):
+        rate_limiter = TokenBucketRateLimiter(rate_per_s=1000, burst=2)
+
+        # ie. a script calling asyncio.run more than once
+        asyncio.run(rate_limiter.acquire())
+        asyncio.run(rate_limiter.acquire())
+
+        self.assertLess(rate_limiter.tokens, 1)
+
+
+class RateLimitedClientTest(unittest.IsolatedAsyncioTestCase):
+    async def test_request(self):
+        client = _TestClient()
+        rate_limited_client = RateLimitedClient(client, TokenBucketRateLimiter(rate_per_s=1000, burst=1))
+
+        response = await rate_limited_client.request(Ledger(ledger_index=10))
+
+        self.assertEqual(10, response.result["ledger_index"])
+        self.assertEqual(1, client.request_count)
+
+
+class PooledJsonRpcClientTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        async def handle(request):
+            body = await request.json()
+            if isinstance(body, list):
+                # like rippled, which only takes JSON objects
+                return web.Response(status=400, text="Unable to parse request")
+            if body["method"] == "batch":
+                return web.json_response({"result": [
+                    {"status": "success", "ledger_index": b["params"][0]["ledger_index"]}
+                    for b in body["params"]
+                ]})
+            if body["params"][0]["ledger_index"] == 503:
+                return web.Response(status=503, text="overloaded")
+            return web.json_response({"result": {"status": "success", "ledger_index": body["params"][0]["ledger_index"]}})
+
+        app = web.Application()
+        app.router.add_post("/", handle)
+        self.server = TestServer(app)
+        await self.server.start_server()
+
+    async def asyncTearDown(self):
+        await self.server.close()
+
+    async def test_connection_reuse(self):
+        registry = CollectorRegistry()
+        client = PooledJsonRpcClient(str(self.server.make_url("/")), metrics=ConnectionMetrics(registry, "test"))
+
+        for ledger_index in [1, 2, 3]:
+            response = await client.request(Ledger(ledger_index=ledger_index))
+            self.assertEqual(ledger_index, response.result["ledger_index"])
+
+        with self.assertRaises(XRPLRequestFailureException) as cm:
+            await client.request(Ledger(ledger_index=503))
+        self.assertEqual(503, cm.exception.error)
+        await client.aclose()
+
+        self.assertEqual(1, registry.get_sample_value("rx_http_connections_created_total", {"name": "test"}))
+        self.assertEqual(3, registry.get_sample_value("rx_http_connections_reused_total", {"name": "test"}))
+
+    async def test_shared_client_metrics(self):
+        registry = CollectorRegistry()
+        url = str(self.server.make_url("/"))
+        # a client obtained without metrics first, then with
+        client = get_json_rpc_client(url)
+        self.assertIs(client, get_json_rpc_client(url, metrics=ConnectionMetrics(registry, "test")))
+
+        await client.request(Ledger(ledger_index=1))
+        await client.aclose()
+
+        self.assertEqual(1, registry.get_sample_value("rx_http_connections_created_total", {"name": "test"}))
+
+    async def test_batch(self):
+        client = PooledJsonRpcClient(str(self.server.make_url("/")))
+
+        responses = await client.request_batch_impl([Ledger(ledger_index=i) for i in [7, 8]])
+        await client.aclose()
+
+        self.assertEqual([7, 8], [r.result["ledger_index"] for r in responses])
+
+    async def test_batch_turned_down(self):
+        async def handle(request):
+            return web.Response(status=400, text="Unable to parse request")
+
+        app = web.Application()
+        app.router.add_post("/", handle)
+        server = TestServer(app)
+        await server.start_server()
+        client = PooledJsonRpcClient(str(server.make_url("/")))
+
+        with self.assertRaises(BatchNotSupportedError):
+            await client.request_batch_impl([Ledger(ledger_index=i) for i in [7, 8]])
+        await client.aclose()
+        await server.close()
+
+    async def test_batch_busy(self):
+        responses = iter([
+            web.Response(status=429, text="Too Many Requests"),
+            web.Response(status=502, text="<html>Bad Gateway</html>"),
+            web.json_response({"result": {"error": "tooBusy", "status": "error"}}),
+            web.json_response({"result": {"error": "unknownCmd", "status": "error"}}),
+        ])
+
+        async def handle(request):
+            return next(responses)
+
+        app = web.Application()
+        app.router.add_post("/", handle)
+        server = TestServer(app)
+        await server.start_server()
+        client = PooledJsonRpcClient(str(server.make_url("/")))
+        requests = [Ledger(ledger_index=i) for i in [7, 8]]
+
+        # retryable, not a refusal
+        with self.assertRaises(XRPLRequestFailureException) as cm:
+            await client.request_batch_impl(requests)
+        self.assertEqual(429, cm.exception.error)
+        with self.assertRaises(XRPLRequestFailureException) as cm:
+            await client.request_batch_impl(requests)
+        self.assertEqual(502, cm.exception.error)
+        with self.assertRaises(RPCResponseError) as cm:
+            await client.request_batch_impl(requests)
+        self.assertEqual("tooBusy", cm.exception.error)
+
+        with self.assertRaises(BatchNotSupportedError):
+            await client.request_batch_impl(requests)
+        await client.aclose()
+        await server.close()
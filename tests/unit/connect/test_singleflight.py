@@ -0,0 +1,105 @@
+import asyncio
+import unittest
+
+from prometheus_client import CollectorRegistry
+from xrpl.asyncio.clients.async_client import AsyncClient
+from xrpl.models.currencies import XRP, IssuedCurrency
+from xrpl.models.requests import BookOffers, Ledger
+from xrpl.models.response import Response, ResponseStatus
+
+from ekspiper.connect.singleflight import SingleflightClient
+from ekspiper.metric.prom import SingleflightMetrics
+
+
+class _TestClient(AsyncClient):
+    def __init__(self, delay_s=0.05):
+        super().__init__("http://localhost:51234/")
+        self.delay_s = delay_s
+        self.requests = []
+        self.cancelled_count = 0
+
+    async def request_impl(self, request):
+        self.requests.append(request)
+        try:
+            await asyncio.sleep(self.delay_s)
+        except asyncio.CancelledError:
+            self.cancelled_count += 1
+            raise
+        return Response(status=ResponseStatus.SUCCESS, result={
+            "ledger_index": request.ledger_index,
+            "validated": isinstance(request.ledger_index, int),
+            "ledger": {"transactions": []},
+        })
+
+
+class SingleflightClientTest(unittest.IsolatedAsyncioTestCase):
+    async def test_coalesce_in_flight(self):
+        registry = CollectorRegistry()
+        client = _TestClient()
+        singleflight_client = SingleflightClient(client, memo_ttl_s=0, metrics=SingleflightMetrics(registry, "test"))
+
+        responses = await asyncio.gather(
+            *[singleflight_client.request(Ledger(ledger_index=i % 2, transactions=True)) for i in range(10)],
+        )
+
+        self.assertEqual(2, len(client.requests))
+        self.assertEqual([i % 2 for i in range(10)], [r.result["ledger_index"] for r in responses])
+        # each caller has its own result
+        responses[0].result["ledger"]["transactions"].append("changed")
+        self.assertEqual([], responses[2].result["ledger"]["transactions"])
+        self.assertEqual(8, registry.get_sample_value(
+            "rx_singleflight_coalesced_total",
+            {"name": "test", "kind": "in_flight"},
+        ))
+        self.assertEqual(0.8, registry.get_sample_value("rx_singleflight_dedup_ratio", {"name": "test"}))
+
+    async def test_distinct_book_offers(self):
+        client = _TestClient()
+        singleflight_client = SingleflightClient(client)
+        usd = IssuedCurrency(currency="USD", issuer="rvYAfWj5gh67oV6fW32ZzP3Aw4Eubs59B")
+        eur = IssuedCurrency(currency="EUR", issuer="rvYAfWj5gh67oV6fW32ZzP3Aw4Eubs59B")
+
+        await asyncio.gather(
+            singleflight_client.request(BookOffers(ledger_index=1, taker_gets=XRP(), taker_pays=usd)),
+            singleflight_client.request(BookOffers(ledger_index=1, taker_gets=XRP(), taker_pays=usd)),
+            singleflight_client.request(BookOffers(ledger_index=1, taker_gets=XRP(), taker_pays=eur)),
+            singleflight_client.request(BookOffers(ledger_index=2, taker_gets=XRP(), taker_pays=usd)),
+        )
+
+        self.assertEqual(3, len(client.requests))
+
+    async def test_memo(self):
+        client = _TestClient(delay_s=0)
+        singleflight_client = SingleflightClient(client, memo_ttl_s=0.1)
+
+        await singleflight_client.request(Ledger(ledger_index=1))
+        await singleflight_client.request(Ledger(ledger_index=1))
+        # the latest validated ledger changes; never memoized
+        await singleflight_client.request(Ledger(ledger_index="validated"))
+        await singleflight_client.request(Ledger(ledger_index="validated"))
+        self.assertEqual(3, len(client.requests))
+
+        await asyncio.sleep(0.15)
+        await singleflight_client.request(Ledger(ledger_index=1))
+        self.assertEqual(4, len(client.requests))
+
+    async def test_cancel(self):
+        client = _TestClient(delay_s=0.1)
+        singleflight_client = SingleflightClient(client)
+
+        first = asyncio.create_task(singleflight_client.request(Ledger(ledger_index=1)))
+        second = asyncio.create_task(singleflight_client.request(Ledger(ledger_index=1)))
+        await asyncio.sleep(0.01)
+        first.cancel()
+
+        # the other caller still gets its answer
+        self.assertEqual(1, (await second).result["ledger_index"])
+        self.assertEqual(0, client.cancelled_count)
+
+        third = asyncio.create_task(singleflight_client.request(Ledger(ledger_index=2)))
+        await asyncio.sleep(0.01)
+        third.cancel()
+        await asyncio.gather(third, return_exceptions=True)
+        await asyncio.sleep(0)
+        self.assertEqual(1, client.cancelled_count)
+        self.assertEqual({}, singleflight_client.flights)
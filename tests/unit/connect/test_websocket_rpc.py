@@ -0,0 +1,82 @@
+import asyncio
+import json
+import unittest
+
+import websockets
+from xrpl.models.requests import Ledger
+
+from ekspiper.connect.websocket_rpc import MultiplexedWebsocketClient
+
+
+class MultiplexedWebsocketClientTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.connection_count = 0
+        self.answered_indices = []
+        answer_tasks = set()
+
+        async def answer(websocket, message):
+            await asyncio.sleep(0.05 if message["ledger_index"] == 1 else 0)
+            self.answered_indices.append(message["ledger_index"])
+            await websocket.send(json.dumps({
+                "id": message["id"],
+                "status": "success",
+                "type": "response",
+                "result": {"ledger_index": message["ledger_index"]},
+            }))
+
+        async def handle(websocket, *args):
+            self.connection_count += 1
+            async for raw_message in websocket:
+                message = json.loads(raw_message)
+                # drop the first connection with the request in flight
+                if self.connection_count == 1 and message["ledger_index"] == 3:
+                    await websocket.close()
+                    return
+                # never answered
+                if message["ledger_index"] == 4:
+                    continue
+
+                # answer each message on its own, so that the later ones overtake the slow one
+                task = asyncio.create_task(answer(websocket, message))
+                answer_tasks.add(task)
+                task.add_done_callback(answer_tasks.discard)
+
+        self.server = await websockets.serve(handle, "127.0.0.1", 0)
+        port = self.server.sockets[0].getsockname()[1]
+        self.client = MultiplexedWebsocketClient(
+            "ws://127.0.0.1:%d" % port,
+            connection_count=1,
+            reconnect_delay_s=0.01,
+        )
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def test_multiplexed_requests(self):
+        responses = await asyncio.gather(*[
+            self.client.request(Ledger(ledger_index=i)) for i in [1, 2]
+        ])
+
+        self.assertEqual([1, 2], [r.result["ledger_index"] for r in responses])
+        # answered in reverse order of arrival
+        self.assertEqual([2, 1], self.answered_indices)
+
+    async def test_resend_after_reconnect(self):
+        response = await self.client.request(Ledger(ledger_index=3))
+
+        self.assertEqual(3, response.result["ledger_index"])
+        self.assertEqual(2, self.connection_count)
+
+    async def test_close_fails_pending_requests(self):
+        request_task = asyncio.create_task(self.client.request(Ledger(ledger_index=4)))
+        while not self.client.pending:
+            await asyncio.sleep(0.01)
+
+        await self.client.aclose()
+
+        with self.assertRaises(RuntimeError):
+            await asyncio.wait_for(request_task, 1)
+        with self.assertRaises(RuntimeError):
+            await self.client.request(Ledger(ledger_index=1))
@@ -0,0 +1,183 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from xrpl.asyncio.clients.async_client import AsyncClient
+from xrpl.models.response import Response, ResponseStatus
+
+from ekspiper.connect.queue import QueueSourceSink
+from ekspiper.util.callable import RetryWrapper
+from ekspiper.connect.xrpledger import (
+    LedgerCreationDataSource,
+    TransactionStreamDataSource,
+    parse_validated_ledgers,
+)
+
+
+class ParseValidatedLedgersTest(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual([(32570, 75000000), (75000002, 75000002)], parse_validated_ledgers("32570-75000000,75000002"))
+        self.assertEqual([], parse_validated_ledgers("empty"))
+        self.assertEqual([], parse_validated_ledgers(None))
+
+
+class LedgerCreationDataSourceTest(unittest.IsolatedAsyncioTestCase):
+    async def test_gap_backfill(self):
+        backfill_sink = QueueSourceSink(name="backfill")
+        data_source = LedgerCreationDataSource(backfill_sink=backfill_sink, last_ledger=99)
+        data_source.backfill_task = asyncio.create_task(data_source._abackfill())
+
+        # the subscription answer, then a jump after a reconnect
+        await data_source._aon_ledger({"result": {"ledger_index": 100, "validated_ledgers": "1-100"}})
+        await data_source._aon_ledger({"ledger_index": 101})
+        await data_source._aon_ledger({"result": {"ledger_index": 101}})
+        await data_source._aon_ledger({"ledger_index": 105, "validated_ledgers": "1-105"})
+        await data_source._aon_ledger({"ledger_index": 106})
+
+        self.assertEqual([100, 101, 105, 106], [data_source.async_queue.get_nowait() for _ in range(4)])
+        self.assertTrue(data_source.async_queue.empty())
+        self.assertEqual([(1, 105)], data_source.validated_ranges)
+
+        await asyncio.sleep(0.01)
+        self.assertEqual(0, data_source.pending_backfill_count())
+        self.assertEqual([102, 103, 104], [await backfill_sink.__anext__() for _ in range(3)])
+        data_source.stop()
+
+    async def test_first_ledger_callback(self):
+        first_ledgers = []
+        data_source = LedgerCreationDataSource(
+            backfill_sink=QueueSourceSink(name="backfill"),
+            last_ledger=9,
+            first_ledger_callback=first_ledgers.append,
+        )
+
+        await data_source._aon_ledger({"ledger_index": 13})
+        await data_source._aon_ledger({"ledger_index": 14})
+
+        self.assertEqual([13], first_ledgers)
+
+    async def test_seeded_backfill_without_sink(self):
+        data_source = LedgerCreationDataSource(last_ledger=9)
+        data_source.backfill_task = asyncio.create_task(data_source._abackfill())
+
+        await data_source._aon_ledger({"ledger_index": 13})
+        await asyncio.sleep(0.01)
+
+        self.assertEqual([13, 10, 11, 12], [data_source.async_queue.get_nowait() for _ in range(4)])
+        data_source.stop()
+
+
+class _TestClient(AsyncClient):
+    def __init__(self,
+                 errors=None,
+                 ):
+        super().__init__("http://localhost:51234/")
+        self.ledger_indices = []
+        # errors answered in turn before succeeding
+        self.errors = list(errors or [])
+
+    async def request_impl(self, request):
+        self.ledger_indices.append(request.ledger_index)
+        if self.errors:
+            return Response(status=ResponseStatus.ERROR, result={"error": self.errors.pop(0)})
+        return Response(status=ResponseStatus.SUCCESS, result={
+            "ledger": {"ledger_index": str(request.ledger_index), "parent_hash": "P", "transactions": []},
+            "ledger_index": request.ledger_index,
+        })
+
+
+class _FastRetryWrapper(RetryWrapper):
+    async def aretry(self, entry, func_handler, **kwargs):
+        return await super().aretry(entry, func_handler, max_retry_count=2, base_sleep_s=0, is_mute_stacktrace=True)
+
+
+def _transaction(ledger_index, transaction_index):
+    return {
+        "type": "transaction",
+        "validated": True,
+        "ledger_index": ledger_index,
+        "transaction": {"hash": "%d-%d" % (ledger_index, transaction_index)},
+        "meta": {"TransactionIndex": transaction_index},
+    }
+
+
+class TransactionStreamDataSourceTest(unittest.IsolatedAsyncioTestCase):
+    async def test_batches_and_fallback(self):
+        rpc_client = _TestClient()
+        data_source = TransactionStreamDataSource(rpc_client=rpc_client)
+
+        messages = [
+            # the subscription answer: fetched
+            {"result": {"ledger_index": 10}},
+            {"type": "ledgerClosed", "ledger_index": 11, "ledger_hash": "H11", "ledger_time": 1, "txn_count": 2},
+            _transaction(11, 1),
+            _transaction(11, 0),
+            # one transaction short: fetched
+            {"type": "ledgerClosed", "ledger_index": 12, "ledger_hash": "H12", "ledger_time": 2, "txn_count": 2},
+            _transaction(12, 0),
+            # 13 never announced: fetched
+            {"type": "ledgerClosed", "ledger_index": 14, "ledger_hash": "H14", "ledger_time": 4, "txn_count": 0},
+            {"type": "ledgerClosed", "ledger_index": 15, "ledger_hash": "H15", "ledger_time": 5, "txn_count": 0},
+        ]
+        for message in messages:
+            await data_source._aon_message(message)
+
+        ledgers = [await data_source.__anext__() for _ in range(5)]
+
+        self.assertEqual([10, 11, 12, 13, 14], [ledger["ledger_index"] for ledger in ledgers])
+        self.assertEqual([10, 12, 13], rpc_client.ledger_indices)
+        self.assertEqual(["11-0", "11-1"], [t["hash"] for t in ledgers[1]["ledger"]["transactions"]])
+        self.assertEqual("11", ledgers[1]["ledger"]["ledger_index"])
+        self.assertEqual({"TransactionIndex": 0}, ledgers[1]["ledger"]["transactions"][0]["metaData"])
+        # 15 is still open
+        self.assertTrue(data_source.async_queue.empty())
+
+    async def test_fetch_header(self):
+        rpc_client = _TestClient()
+        data_source = TransactionStreamDataSource(rpc_client=rpc_client, is_fetch_header=True)
+
+        for message in [
+            {"type": "ledgerClosed", "ledger_index": 11, "ledger_hash": "H11", "ledger_time": 1, "txn_count": 1},
+            _transaction(11, 0),
+            {"type": "ledgerClosed", "ledger_index": 12, "ledger_hash": "H12", "ledger_time": 2, "txn_count": 0},
+        ]:
+            await data_source._aon_message(message)
+
+        ledger = await data_source.__anext__()
+        self.assertEqual([11], rpc_client.ledger_indices)
+        self.assertEqual("P", ledger["ledger"]["parent_hash"])
+        self.assertEqual(["11-0"], [t["hash"] for t in ledger["ledger"]["transactions"]])
+
+    @mock.patch("ekspiper.util.callable.random.randrange", return_value=0)
+    async def test_fetch_retried_until_fetched(self, _):
+        rpc_client = _TestClient(errors=["tooBusy"] * 3)
+        data_source = TransactionStreamDataSource(
+            rpc_client=rpc_client,
+            reconnect_delay_s=0,
+            retry_wrapper=_FastRetryWrapper(),
+        )
+
+        await data_source._aon_message({"result": {"ledger_index": 10}})
+        await data_source._aon_message({"type": "ledgerClosed", "ledger_index": 11, "txn_count": 0})
+
+        ledger = await asyncio.wait_for(data_source.__anext__(), 5)
+        self.assertEqual(10, ledger["ledger_index"])
+        self.assertEqual([10] * 4, rpc_client.ledger_indices)
+
+    async def test_fatal_fetch_dead_lettered(self):
+        dead_letter_sink = QueueSourceSink()
+        rpc_client = _TestClient(errors=["lgrNotFound"])
+        data_source = TransactionStreamDataSource(rpc_client=rpc_client, dead_letter_sink=dead_letter_sink)
+
+        await data_source._aon_message({"result": {"ledger_index": 10}})
+        await data_source._aon_message({"type": "ledgerClosed", "ledger_index": 11, "txn_count": 0})
+        await data_source._aon_message({"type": "ledgerClosed", "ledger_index": 12, "txn_count": 0})
+
+        # 10 is given up on, 11 is fetched
+        ledger = await asyncio.wait_for(data_source.__anext__(), 5)
+        self.assertEqual(11, ledger["ledger_index"])
+
+        dead_letter_sink.stop()
+        dead_letters = [e async for e in dead_letter_sink]
+        self.assertEqual([10], [e["entry"] for e in dead_letters])
+        self.assertEqual("fetch_ledger", dead_letters[0]["stage"])
@@ -1,6 +1,21 @@
+import asyncio
+import io
 import unittest
+from contextlib import redirect_stderr
+from unittest import mock
 
-from ekspiper.util.callable import RetryWrapper
+from xrpl.asyncio.clients import XRPLRequestFailureException
+
+from ekspiper.util.callable import (
+    CircuitBreaker,
+    FatalError,
+    MalformedEntryError,
+    RPCResponseError,
+    RetryBudget,
+    RetryExhaustedError,
+    RetryWrapper,
+    is_retryable_error,
+)
 
 
 class RetryWrapperTest(unittest.IsolatedAsyncioTestCase):
@@ -26,3 +41,118 @@ class RetryWrapperTest(unittest.IsolatedAsyncioTestCase):
         )
 
         self.assertEqual(expected_value, output)
+
+    async def test_fatal_error_is_not_retried(self):
+        called = 0
+
+        async def wrappable_func(input: int) -> str:
+            nonlocal called
+            called += 1
+            raise FatalError("simulated fatal error")
+
+        retry_wrapper = RetryWrapper[int, str]()
+        with self.assertRaises(FatalError):
+            await retry_wrapper.aretry(1, func_handler=wrappable_func, is_mute_stacktrace=True)
+
+        self.assertEqual(1, called)
+
+    @mock.patch("ekspiper.util.callable.random.randrange", return_value=0)
+    async def test_retry_prints_stacktrace(self, _):
+        called = 0
+
+        async def wrappable_func(input: int) -> str:
+            nonlocal called
+            called += 1
+            if called == 1:
+                raise ValueError("simulated value error")
+            return str(input)
+
+        retry_wrapper = RetryWrapper[int, str]()
+        stderr = io.StringIO()
+        with redirect_stderr(stderr):
+            output = await retry_wrapper.aretry(
+                1,
+                func_handler=wrappable_func,
+                is_mute_stacktrace=False,
+                base_sleep_s=0,
+            )
+
+        self.assertEqual("1", output)
+        self.assertIn("Traceback", stderr.getvalue())
+        self.assertIn("simulated value error", stderr.getvalue())
+
+    def test_error_classification(self):
+        self.assertFalse(is_retryable_error(RPCResponseError("no ledger", error="lgrNotFound")))
+        self.assertFalse(is_retryable_error(RPCResponseError("bad params", error="invalidParams")))
+        self.assertFalse(is_retryable_error(RPCResponseError("bad index", error="lgrIdxMalformed")))
+        self.assertFalse(is_retryable_error(XRPLRequestFailureException({"error": "lgrNotFound"})))
+        self.assertFalse(is_retryable_error(MalformedEntryError("missing ledger index")))
+        self.assertTrue(is_retryable_error(RPCResponseError("busy", error="slowDown")))
+        self.assertTrue(is_retryable_error(XRPLRequestFailureException({"error": 503})))
+        self.assertTrue(is_retryable_error(ValueError("anything else")))
+
+    async def test_cancelled_probe_releases_its_slot(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout_s=0, half_open_max_probes=1)
+        breaker.record_failure()
+        retry_wrapper = RetryWrapper[int, str](circuit_breaker=breaker)
+
+        async def wrappable_func(input: int) -> str:
+            await asyncio.sleep(10)
+            return str(input)
+
+        task = asyncio.create_task(retry_wrapper.aretry(1, func_handler=wrappable_func, is_mute_stacktrace=True))
+        await asyncio.sleep(0.01)
+        self.assertEqual(CircuitBreaker.HALF_OPEN, breaker.state)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+        # the next probe can go through
+        self.assertEqual(0, breaker.probes_in_flight)
+        self.assertTrue(breaker.allow_request())
+
+    async def test_exhausted_retry_budget(self):
+        called = 0
+
+        async def wrappable_func(input: int) -> str:
+            nonlocal called
+            called += 1
+            raise ValueError("simulated value error")
+
+        retry_wrapper = RetryWrapper[int, str](
+            retry_budget=RetryBudget(ratio=0, min_retries_per_s=0, max_balance=0),
+        )
+        with self.assertRaises(RetryExhaustedError) as cm:
+            await retry_wrapper.aretry(1, func_handler=wrappable_func, is_mute_stacktrace=True)
+
+        self.assertEqual(1, called)
+        self.assertEqual(1, cm.exception.attempt_count)
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def test_opens_after_consecutive_failures(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout_s=60)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        self.assertEqual(CircuitBreaker.CLOSED, breaker.state)
+
+        breaker.record_failure()
+        self.assertEqual(CircuitBreaker.OPEN, breaker.state)
+        self.assertFalse(breaker.allow_request())
+
+    def test_half_open_probes(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout_s=0, half_open_max_probes=1)
+        breaker.record_failure()
+
+        # the reset timeout has passed; only one probe goes through
+        self.assertTrue(breaker.allow_request())
+        self.assertEqual(CircuitBreaker.HALF_OPEN, breaker.state)
+        self.assertFalse(breaker.allow_request())
+
+        breaker.record_failure()
+        self.assertEqual(CircuitBreaker.OPEN, breaker.state)
+
+        self.assertTrue(breaker.allow_request())
+        breaker.record_success()
+        self.assertEqual(CircuitBreaker.CLOSED, breaker.state)
+        self.assertTrue(breaker.allow_request())
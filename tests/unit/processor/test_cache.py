@@ -0,0 +1,115 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from prometheus_client import CollectorRegistry
+
+from ekspiper.metric.prom import LedgerCacheMetrics
+from ekspiper.processor.base import EntryProcessor
+from ekspiper.processor.cache import CachingLedgerFetchProcessor
+
+
+class _TestFetchProcessor(EntryProcessor):
+    def __init__(self):
+        self.fetched_indices = []
+
+    async def aprocess(self, entry):
+        self.fetched_indices.append(entry)
+        return [{
+            "ledger": {"ledger_index": str(entry), "transactions": [{"hash": "A" * 64}] * 10},
+            "ledger_index": entry,
+            # the open ledger is not validated yet
+            "validated": entry != 5,
+        }]
+
+
+class CachingLedgerFetchProcessorTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+
+    async def test_read_through(self):
+        registry = CollectorRegistry()
+        fetch_processor = _TestFetchProcessor()
+        processor = CachingLedgerFetchProcessor(
+            fetch_processor,
+            cache_dir=self.cache_dir.name,
+            network="testnet",
+            metrics=LedgerCacheMetrics(registry, "testnet"),
+        )
+
+        first = await processor.aprocess(10)
+        second = await processor.aprocess(10)
+        await processor.aprocess(5)
+        await processor.aprocess(5)
+
+        self.assertEqual(first, second)
+        self.assertEqual([10, 5, 5], fetch_processor.fetched_indices)
+        self.assertEqual(1, registry.get_sample_value("rx_ledger_cache_hits_total", {"name": "testnet"}))
+        self.assertTrue(os.path.exists(os.path.join(self.cache_dir.name, "testnet", "0", "10.json.gz")))
+
+        # a new run reads what the previous one wrote
+        fetch_processor = _TestFetchProcessor()
+        processor = CachingLedgerFetchProcessor(fetch_processor, cache_dir=self.cache_dir.name, network="testnet")
+        self.assertEqual(first, await processor.aprocess(10))
+        self.assertEqual([], fetch_processor.fetched_indices)
+        self.assertEqual(1, len(processor.entries))
+
+    async def test_write_only(self):
+        fetch_processor = _TestFetchProcessor()
+        processor = CachingLedgerFetchProcessor(
+            fetch_processor,
+            cache_dir=self.cache_dir.name,
+            network="testnet",
+            is_read_through=False,
+        )
+
+        await processor.aprocess(10)
+        await processor.aprocess(10)
+
+        self.assertEqual([10, 10], fetch_processor.fetched_indices)
+        self.assertEqual(1, len(processor.entries))
+
+    async def test_lru_eviction(self):
+        fetch_processor = _TestFetchProcessor()
+        processor = CachingLedgerFetchProcessor(fetch_processor, cache_dir=self.cache_dir.name, network="testnet")
+        await processor.aprocess(1)
+        entry_size = processor.size_bytes
+        processor.max_size_bytes = entry_size * 2
+
+        await processor.aprocess(2)
+        # touching 1 makes 2 the least recently used
+        await processor.aprocess(1)
+        await processor.aprocess(3)
+
+        self.assertEqual(2, len(processor.entries))
+        self.assertLessEqual(processor.size_bytes, processor.max_size_bytes)
+        await processor.aprocess(1)
+        await processor.aprocess(2)
+        self.assertEqual([1, 2, 3, 2], fetch_processor.fetched_indices)
+
+    async def test_corrupt_file(self):
+        fetch_processor = _TestFetchProcessor()
+        processor = CachingLedgerFetchProcessor(fetch_processor, cache_dir=self.cache_dir.name, network="testnet")
+        await processor.aprocess(10)
+        with open(os.path.join(self.cache_dir.name, "testnet", "0", "10.json.gz"), "wb") as f:
+            f.write(b"not gzip")
+
+        await processor.aprocess(10)
+
+        self.assertEqual([10, 10], fetch_processor.fetched_indices)
+
+    async def test_store_failure(self):
+        fetch_processor = _TestFetchProcessor()
+        processor = CachingLedgerFetchProcessor(fetch_processor, cache_dir=self.cache_dir.name, network="testnet")
+
+        # ie. disk full
+        with mock.patch("ekspiper.processor.cache.json.dump", side_effect=OSError("No space left on device")):
+            outputs = await processor.aprocess(10)
+
+        self.assertEqual(10, outputs[0]["ledger_index"])
+        self.assertEqual([], os.listdir(os.path.join(self.cache_dir.name, "testnet", "0")))
+        self.assertEqual(0, processor.size_bytes)
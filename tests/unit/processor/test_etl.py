@@ -1,11 +1,16 @@
 import unittest
 
+from ekspiper.processor.base import BatchEntryError
 from ekspiper.processor.etl import (
+    ETLTemplateProcessor,
+    ProcessPoolETLProcessor,
+    Transformer,
+    Validator,
     XRPLGenericTransformer,
     GenericValidator,
     XRPLObjectTransformer,
 )
-from ekspiper.schema.xrp import XRPLObjectSchema
+from ekspiper.schema.xrp import XRPLObjectSchema, XRPLTransactionSchema
 
 
 class ETLTests(unittest.TestCase):
@@ -299,3 +304,74 @@ class ETLTests(unittest.TestCase):
 
         assert transformed_dict is not test_dict
         self.assertDictEqual(transformed_dict, answer_dict)
+
+
+class _FailingTransformer(Transformer):
+    def transform(self, data_entry):
+        if data_entry == "BAD":
+            raise ValueError("simulated value error")
+        return data_entry.lower()
+
+
+class ProcessPoolETLProcessorTests(unittest.IsolatedAsyncioTestCase):
+
+    async def test_matches_in_loop_etl(self):
+        entries = [
+            {
+                "Account": "r3Vh9ZmQxd3C5CPEB8q7VbRuMPxwuC634n",
+                "Amount": str(i),
+                "NotInTheSchema": "Hello Not Here",
+            } for i in range(7)
+        ]
+        etl_processor = ETLTemplateProcessor(
+            validator=GenericValidator(XRPLTransactionSchema.SCHEMA),
+            transformer=XRPLGenericTransformer(XRPLTransactionSchema.SCHEMA),
+        )
+        pool_processor = ProcessPoolETLProcessor(
+            etl_steps=[
+                GenericValidator(XRPLTransactionSchema.SCHEMA),
+                XRPLGenericTransformer(XRPLTransactionSchema.SCHEMA),
+            ],
+            max_workers=2,
+            chunk_size=3,
+        )
+        try:
+            outputs = await pool_processor.aprocess_batch(entries)
+        finally:
+            pool_processor.shutdown()
+
+        self.assertEqual(await etl_processor.aprocess_batch(entries), outputs)
+        self.assertEqual({"currency": "XRP", "issuer": "", "value": "6"}, outputs[6]["Amount"])
+
+    async def test_batch_hands_back_failures(self):
+        pool_processor = ProcessPoolETLProcessor(
+            etl_steps=[Validator(), _FailingTransformer()],
+            max_workers=1,
+            chunk_size=2,
+        )
+        try:
+            with self.assertRaises(BatchEntryError) as cm:
+                await pool_processor.aprocess_batch(["A", "BAD", "C", "D"])
+        finally:
+            pool_processor.shutdown()
+
+        self.assertEqual(["a", "c", "d"], cm.exception.outputs)
+        self.assertEqual(["BAD"], [e for e, _ in cm.exception.failed_entries])
+
+
+class ETLTemplateProcessorTests(unittest.IsolatedAsyncioTestCase):
+
+    async def test_batch_hands_back_failures(self):
+        etl_processor = ETLTemplateProcessor(
+            validator=Validator(),
+            transformer=_FailingTransformer(),
+        )
+
+        with self.assertRaises(BatchEntryError) as cm:
+            await etl_processor.aprocess_batch(["A", "BAD", "C"])
+
+        self.assertEqual(["a", "c"], cm.exception.outputs)
+        self.assertEqual(["BAD"], [e for e, _ in cm.exception.failed_entries])
+        # a single entry fails with its own error
+        with self.assertRaises(ValueError):
+            await etl_processor.aprocess_batch(["BAD"])
@@ -1,10 +1,21 @@
+import asyncio
 import json
 import unittest
 
+from prometheus_client import CollectorRegistry
+from xrpl.asyncio.clients.async_client import AsyncClient
+
 from xrpl.models.currencies import XRP, IssuedCurrency
 from xrpl.models.requests.book_offers import BookOffers
+from xrpl.models.response import Response, ResponseStatus
 
-from ekspiper.processor.fetch_book_offers import BuildBookOfferRequestsProcessor
+from ekspiper.metric.prom import BookOffersCacheMetrics, BookOffersFetchMetrics
+from ekspiper.processor.base import BatchEntryError, EntryProcessor
+from ekspiper.processor.fetch_book_offers import (
+    BuildBookOfferRequestsProcessor,
+    CachingBookOffersFetchProcessor,
+    XRPLFetchBookOffersProcessor,
+)
 
 sample_transaction_json = """
 {
@@ -142,3 +153,175 @@ class BookOfferProcessorsTest(unittest.IsolatedAsyncioTestCase):
         for actual_value, expected_value in zip(book_offer_requests, expected_output):
             self.assertEqual(actual_value.taker_gets, expected_value.taker_gets)
             self.assertEqual(actual_value.taker_pays, expected_value.taker_pays)
+
+
+class _TestFetchProcessor(EntryProcessor):
+    def __init__(self):
+        self.fetched = []
+
+    async def aprocess(self, entry):
+        self.fetched.append(entry)
+        await asyncio.sleep(0.02)
+        return [{"ledger_index": entry.ledger_index, "offers": []}]
+
+
+USD = IssuedCurrency(currency="USD", issuer="rvYAfWj5gh67oV6fW32ZzP3Aw4Eubs59B")
+EUR = IssuedCurrency(currency="EUR", issuer="rvYAfWj5gh67oV6fW32ZzP3Aw4Eubs59B")
+
+
+class CachingBookOffersFetchProcessorTest(unittest.IsolatedAsyncioTestCase):
+    async def test_refetch_interval(self):
+        registry = CollectorRegistry()
+        fetch_processor = _TestFetchProcessor()
+        processor = CachingBookOffersFetchProcessor(
+            fetch_processor,
+            min_refetch_interval_ledgers=10,
+            metrics=BookOffersCacheMetrics(registry, "test"),
+        )
+
+        # the book is touched in every ledger
+        outputs = []
+        for ledger_index in range(100, 125):
+            outputs.extend(await processor.aprocess(BookOffers(ledger_index=ledger_index, taker_gets=XRP(), taker_pays=USD)))
+
+        self.assertEqual([100, 110, 120], [e.ledger_index for e in fetch_processor.fetched])
+        self.assertEqual(100, outputs[9]["ledger_index"])
+        self.assertEqual(110, outputs[10]["ledger_index"])
+        self.assertEqual(22, registry.get_sample_value("rx_book_offers_requests_total", {"name": "test", "outcome": "hit"}))
+
+        # each caller has its own messages
+        outputs[0]["offers"].append("changed")
+        self.assertEqual([], outputs[1]["offers"])
+
+    async def test_older_ledger(self):
+        fetch_processor = _TestFetchProcessor()
+        processor = CachingBookOffersFetchProcessor(fetch_processor, min_refetch_interval_ledgers=10)
+
+        await processor.aprocess(BookOffers(ledger_index=110, taker_gets=XRP(), taker_pays=USD))
+        # behind the snapshot; not served the newer one
+        messages = await processor.aprocess(BookOffers(ledger_index=105, taker_gets=XRP(), taker_pays=USD))
+        self.assertEqual(105, messages[0]["ledger_index"])
+
+        # the snapshot stays on the newest ledger
+        messages = await processor.aprocess(BookOffers(ledger_index=112, taker_gets=XRP(), taker_pays=USD))
+        self.assertEqual(110, messages[0]["ledger_index"])
+        self.assertEqual([110, 105], [e.ledger_index for e in fetch_processor.fetched])
+
+    async def test_merge_across_ledgers(self):
+        fetch_processor = _TestFetchProcessor()
+        processor = CachingBookOffersFetchProcessor(fetch_processor, min_refetch_interval_ledgers=5, max_concurrency=1)
+
+        outputs = await asyncio.gather(
+            processor.aprocess(BookOffers(ledger_index=100, taker_gets=XRP(), taker_pays=EUR)),
+            processor.aprocess(BookOffers(ledger_index=100, taker_gets=XRP(), taker_pays=USD)),
+            # waiting behind EUR; merged into one fetch at 104
+            processor.aprocess(BookOffers(ledger_index=102, taker_gets=XRP(), taker_pays=USD)),
+            processor.aprocess(BookOffers(ledger_index=104, taker_gets=XRP(), taker_pays=USD)),
+            # too far ahead of the request at 100; fetched on its own
+            processor.aprocess(BookOffers(ledger_index=107, taker_gets=XRP(), taker_pays=USD)),
+        )
+
+        self.assertEqual(
+            [(100, EUR), (104, USD), (107, USD)],
+            [(e.ledger_index, e.taker_pays) for e in fetch_processor.fetched],
+        )
+        self.assertEqual([100, 104, 104, 104, 107], [o[0]["ledger_index"] for o in outputs])
+
+
+class _TestClient(AsyncClient):
+    """
+    Serves books of `offer_count` offers, `limit` at a time.
+    """
+
+    def __init__(self, offer_count):
+        super().__init__("http://localhost:51234/")
+        self.offer_count = offer_count
+        self.requests = []
+        self.in_flight_count = 0
+        self.max_in_flight_count = 0
+
+    async def request_impl(self, request):
+        self.requests.append(request)
+        self.in_flight_count += 1
+        self.max_in_flight_count = max(self.max_in_flight_count, self.in_flight_count)
+        await asyncio.sleep(0.01)
+        self.in_flight_count -= 1
+
+        start = request.marker or 0
+        end = min(start + request.limit, self.offer_count)
+        result = {
+            "ledger_index": 100 if request.ledger_index == "validated" else request.ledger_index,
+            "offers": [{"Sequence": i, "TakerPays": request.taker_pays.to_dict()} for i in range(start, end)],
+            "validated": True,
+        }
+        if end < self.offer_count:
+            result["marker"] = end
+        return Response(status=ResponseStatus.SUCCESS, result=result)
+
+
+class XRPLFetchBookOffersProcessorTest(unittest.IsolatedAsyncioTestCase):
+    async def test_follow_markers(self):
+        registry = CollectorRegistry()
+        client = _TestClient(offer_count=25)
+        processor = XRPLFetchBookOffersProcessor(
+            rpc_client=client,
+            page_size=10,
+            metrics=BookOffersFetchMetrics(registry, "test"),
+        )
+
+        messages = await processor.aprocess(BookOffers(ledger_index="validated", taker_gets=XRP(), taker_pays=USD))
+
+        self.assertEqual(1, len(messages))
+        self.assertEqual(list(range(25)), [o["Sequence"] for o in messages[0]["offers"]])
+        self.assertNotIn("marker", messages[0])
+        # the next pages stay on the ledger of the first one
+        self.assertEqual(["validated", 100, 100], [r.ledger_index for r in client.requests])
+        self.assertEqual(3, registry.get_sample_value("rx_book_offers_pages_total", {"name": "test"}))
+        self.assertLess(0, registry.get_sample_value("rx_book_offers_bytes_total", {"name": "test"}))
+
+    async def test_stream_pages(self):
+        processor = XRPLFetchBookOffersProcessor(
+            rpc_client=_TestClient(offer_count=25),
+            page_size=10,
+            max_page_count=2,
+            is_stream_pages=True,
+        )
+
+        pages = await processor.aprocess(BookOffers(ledger_index=100, taker_gets=XRP(), taker_pays=USD))
+
+        self.assertEqual([10, 10], [len(p["offers"]) for p in pages])
+
+    async def test_concurrent_books(self):
+        client = _TestClient(offer_count=30)
+        processor = XRPLFetchBookOffersProcessor(rpc_client=client, page_size=10, max_concurrency=2)
+
+        messages = await processor.aprocess_batch([
+            BookOffers(ledger_index=100, taker_gets=XRP(), taker_pays=USD),
+            BookOffers(ledger_index=100, taker_gets=XRP(), taker_pays=EUR),
+            BookOffers(ledger_index=100, taker_gets=XRP(), taker_pays=USD),
+        ])
+
+        self.assertEqual(2, len(messages))
+        self.assertEqual([30, 30], [len(m["offers"]) for m in messages])
+        self.assertEqual(6, len(client.requests))
+        self.assertEqual(2, client.max_in_flight_count)
+
+    async def test_batch_hands_back_failures(self):
+        class _FailingClient(_TestClient):
+            async def request_impl(self, request):
+                if request.taker_pays == EUR:
+                    raise RuntimeError("boom")
+                return await super().request_impl(request)
+
+        processor = XRPLFetchBookOffersProcessor(rpc_client=_FailingClient(offer_count=5), page_size=10)
+
+        with self.assertRaises(BatchEntryError) as cm:
+            await processor.aprocess_batch([
+                BookOffers(ledger_index=100, taker_gets=XRP(), taker_pays=USD),
+                BookOffers(ledger_index=100, taker_gets=XRP(), taker_pays=EUR),
+            ])
+
+        messages = cm.exception.outputs
+        self.assertEqual(1, len(messages))
+        self.assertEqual(USD.to_dict(), messages[0]["offers"][0]["TakerPays"])
+        self.assertEqual([EUR], [e.taker_pays for e, _ in cm.exception.failed_entries])
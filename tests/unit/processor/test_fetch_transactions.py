@@ -0,0 +1,145 @@
+import os
+import tempfile
+import unittest
+
+from xrpl.asyncio.clients.async_client import AsyncClient
+from xrpl.models.response import Response, ResponseStatus
+
+from ekspiper.connect.endpoint_pool import EndpointPoolClient
+from ekspiper.connect.hedge import HedgedClient
+from ekspiper.connect.rpc import BatchNotSupportedError
+from ekspiper.connect.singleflight import SingleflightClient
+from ekspiper.processor.fetch_transactions import (
+    LedgerIndexProcessor,
+    XRPLBatchFetchLedgerDetailsProcessor,
+    read_last_ledger_index,
+)
+
+
+def _response(ledger_index: int) -> Response:
+    if ledger_index in _TestClient.failing_indices:
+        return Response(status=ResponseStatus.ERROR, result={"error": "slowDown"})
+    return Response(status=ResponseStatus.SUCCESS, result={"ledger_index": ledger_index})
+
+
+class _TestClient(AsyncClient):
+    failing_indices = set()
+
+    def __init__(self):
+        super().__init__("http://localhost:51234/")
+        self.requested_indices = []
+
+    async def request_impl(self, request):
+        self.requested_indices.append(request.ledger_index)
+        return _response(request.ledger_index)
+
+
+class _TestBatchClient(_TestClient):
+    async def request_batch_impl(self, requests):
+        self.requested_indices.append([r.ledger_index for r in requests])
+        return [_response(r.ledger_index) for r in requests]
+
+
+class _TestNoBatchClient(_TestClient):
+    async def request_batch_impl(self, requests):
+        raise BatchNotSupportedError("no batch")
+
+
+class XRPLBatchFetchLedgerDetailsProcessorTest(unittest.IsolatedAsyncioTestCase):
+    def tearDown(self):
+        _TestClient.failing_indices = set()
+
+    async def test_batch_retries_only_failed_parts(self):
+        client = _TestBatchClient()
+        processor = XRPLBatchFetchLedgerDetailsProcessor(rpc_client=client)
+
+        _TestClient.failing_indices = {2}
+        with self.assertRaisesRegex(ValueError, "slowDown"):
+            await processor.aprocess_batch([1, 2, 3])
+
+        _TestClient.failing_indices = set()
+        messages = await processor.aprocess_batch([1, 2, 3])
+
+        self.assertEqual([1, 2, 3], [m["ledger_index"] for m in messages])
+        self.assertEqual([[1, 2, 3], [2]], client.requested_indices)
+        self.assertEqual(0, len(processor.fetched))
+
+    async def test_batch_larger_than_kept_count(self):
+        client = _TestBatchClient()
+        processor = XRPLBatchFetchLedgerDetailsProcessor(rpc_client=client, max_kept_count=3)
+
+        _TestClient.failing_indices = {5}
+        with self.assertRaisesRegex(ValueError, "slowDown") as cm:
+            await processor.aprocess_batch([1, 2, 3, 4, 5])
+        self.assertEqual("slowDown", cm.exception.error)
+        self.assertEqual([2, 3, 4], list(processor.fetched))
+
+        _TestClient.failing_indices = set()
+        messages = await processor.aprocess_batch([1, 2, 3, 4, 5])
+
+        self.assertEqual([1, 2, 3, 4, 5], [m["ledger_index"] for m in messages])
+        self.assertEqual(0, len(processor.fetched))
+
+    async def test_falls_back_to_single_requests(self):
+        client = _TestNoBatchClient()
+        processor = XRPLBatchFetchLedgerDetailsProcessor(rpc_client=client)
+
+        messages = await processor.aprocess_batch([{"ledger_index": 5}, 6])
+
+        self.assertEqual([5, 6], [m["ledger_index"] for m in messages])
+        self.assertEqual([5, 6], client.requested_indices)
+        self.assertFalse(processor.is_batch_supported)
+
+    async def test_batch_through_wrappers(self):
+        client = _TestBatchClient()
+        processor = XRPLBatchFetchLedgerDetailsProcessor(
+            rpc_client=SingleflightClient(HedgedClient(EndpointPoolClient([client]))),
+        )
+
+        messages = await processor.aprocess_batch([1, 2])
+        await processor.rpc_client.aclose()
+
+        self.assertEqual([1, 2], [m["ledger_index"] for m in messages])
+        self.assertEqual([[1, 2]], client.requested_indices)
+
+    async def test_wrapped_client_without_batches(self):
+        client = _TestClient()
+        processor = XRPLBatchFetchLedgerDetailsProcessor(rpc_client=SingleflightClient(client))
+
+        messages = await processor.aprocess_batch([1, 2])
+
+        self.assertEqual([1, 2], [m["ledger_index"] for m in messages])
+        self.assertEqual([1, 2], client.requested_indices)
+        self.assertFalse(processor.is_batch_supported)
+
+
+class LedgerIndexProcessorTest(unittest.TestCase):
+    def test_low_watermark(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            index_file_path = os.path.join(tmp_dir, "ledgers.txt")
+            with open(index_file_path, "w") as f:
+                f.write("1000\n")
+            processor = LedgerIndexProcessor(index_file_path)
+
+            # back up at 1200; 1001 to 1199 are being backfilled
+            for ledger_index in range(1200, 1300):
+                processor.process(ledger_index)
+            for ledger_index in range(1001, 1150):
+                processor.process(ledger_index)
+
+            # a restart now resumes from the missing ledgers, not the tip;
+            # the file is written every 100 ledgers
+            self.assertEqual(1149, processor.watermark)
+            self.assertEqual(1100, read_last_ledger_index(index_file_path))
+
+            for ledger_index in range(1150, 1200):
+                processor.process(ledger_index)
+            self.assertEqual(1299, processor.watermark)
+            self.assertEqual(set(), processor.completed)
+
+    def test_give_up_on_missing_ledger(self):
+        processor = LedgerIndexProcessor(max_pending_count=3)
+        for ledger_index in [10, 12, 13, 14, 15]:
+            processor.process(ledger_index)
+
+        self.assertEqual(15, processor.watermark)
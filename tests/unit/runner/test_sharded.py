@@ -0,0 +1,76 @@
+import multiprocessing
+import unittest
+
+from ekspiper.runner.sharded import ShardProgress, ShardProgressProcessor, ShardedProcessRunner
+
+
+async def _acount_shard(shard_index: int,
+                        shard_size: int,
+                        progress: ShardProgress,
+                        ):
+    for i in range(shard_index, 10, shard_size):
+        # skip what the crashed run already did
+        if i < progress.checkpoint.value:
+            continue
+        if shard_index == 1 and i == 5 and progress.restart_count.value == 0:
+            raise RuntimeError("simulated crash")
+
+        progress.increment()
+        progress.set_checkpoint(i + 1)
+
+
+async def _afail_shard(shard_index: int,
+                       shard_size: int,
+                       progress: ShardProgress,
+                       ):
+    raise RuntimeError("simulated crash")
+
+
+class ShardedProcessRunnerTest(unittest.TestCase):
+    def test_run_with_restart(self):
+        runner = ShardedProcessRunner(
+            shard_main=_acount_shard,
+            shard_size=2,
+            restart_delay_s=0,
+            poll_interval_s=0.05,
+            mp_start_method="fork",
+        )
+
+        self.assertTrue(runner.run())
+        self.assertEqual(10, runner.processed_count())
+        self.assertEqual(0, runner.progresses[0].restart_count.value)
+        self.assertEqual(1, runner.progresses[1].restart_count.value)
+
+    def test_gives_up(self):
+        runner = ShardedProcessRunner(
+            shard_main=_afail_shard,
+            shard_size=1,
+            max_restart_count=2,
+            restart_delay_s=0,
+            poll_interval_s=0.05,
+            mp_start_method="fork",
+        )
+
+        self.assertFalse(runner.run())
+        self.assertEqual({0}, runner.failed_shards)
+        self.assertEqual(2, runner.progresses[0].restart_count.value)
+
+
+class ShardProgressProcessorTest(unittest.IsolatedAsyncioTestCase):
+    async def test_counts_from_checkpoint(self):
+        progress = ShardProgress(multiprocessing.get_context("spawn"))
+        processor = ShardProgressProcessor(progress, incr_by=-1)
+        for ledger_index in [100, 98, 99, 97]:
+            await processor.aprocess(ledger_index)
+
+        self.assertEqual(4, progress.processed_count.value)
+        # 99 finishing after 98 does not pull the checkpoint back
+        self.assertEqual(97, progress.checkpoint.value)
+
+        # the restarted shard resumes behind the checkpoint
+        processor = ShardProgressProcessor(progress, incr_by=-1)
+        for ledger_index in [99, 98, 97, 96, 95]:
+            await processor.aprocess(ledger_index)
+
+        self.assertEqual(6, progress.processed_count.value)
+        self.assertEqual(95, progress.checkpoint.value)
@@ -2,10 +2,14 @@ import asyncio
 import unittest
 from typing import Any, List, Tuple
 
-from ekspiper.collector.output import OutputCollector
+from prometheus_client import CollectorRegistry
+
+from ekspiper.collector.output import BatchOutputCollector, OutputCollector
 from ekspiper.connect.queue import QueueSourceSink
-from ekspiper.processor.base import EntryProcessor
+from ekspiper.metric.prom import FlowMetrics
+from ekspiper.processor.base import BatchEntryError, BatchEntryProcessor, EntryProcessor
 from ekspiper.template.processor import TemplateFlow, ProcessCollectorsMap
+from ekspiper.util.concurrency import AIMDConcurrencyController
 
 
 class _TestStringProcessor(EntryProcessor):
@@ -29,6 +33,11 @@ class _TestOutputCollector(OutputCollector):
             self.outputs.append(self.prefix + v)
 
 
+class _NoRetryWrapper:
+    async def aretry(self, entry, func_handler, **kwargs):
+        return await func_handler(entry)
+
+
 class TemplateFlowTest(unittest.IsolatedAsyncioTestCase):
 
     async def test_template_processor(self):
@@ -70,3 +79,399 @@ class TemplateFlowTest(unittest.IsolatedAsyncioTestCase):
 
         for c, expected_output in zip(output_collectors, expected_outputs):
             self.assertEqual(expected_output, c.outputs)
+
+    async def test_template_processor_max_in_flight(self):
+        in_flight_count = 0
+        max_seen_in_flight = 0
+
+        class _SlowProcessor(EntryProcessor):
+            async def aprocess(self,
+                               entry: str,
+                               ) -> List[str]:
+                nonlocal in_flight_count, max_seen_in_flight
+                in_flight_count += 1
+                max_seen_in_flight = max(max_seen_in_flight, in_flight_count)
+                await asyncio.sleep(0.01)
+                in_flight_count -= 1
+                return [entry]
+
+        output_collector = _TestOutputCollector(prefix="")
+        template_flow = TemplateFlow(
+            process_collectors_maps=[
+                ProcessCollectorsMap(
+                    processor=_SlowProcessor(),
+                    collectors=[output_collector],
+                )
+            ],
+            max_in_flight=3,
+        )
+
+        q = QueueSourceSink()
+        for i in range(10):
+            await q.put(str(i))
+        q.stop()
+
+        await template_flow.aexecute(
+            message_iterator=q,
+        )
+
+        self.assertEqual(3, max_seen_in_flight)
+        self.assertEqual(
+            sorted(str(i) for i in range(10)),
+            sorted(output_collector.outputs),
+        )
+
+    async def test_template_processor_concurrency_controller(self):
+        in_flight_count = 0
+        max_seen_in_flight = 0
+
+        class _SlowProcessor(EntryProcessor):
+            async def aprocess(self,
+                               entry: str,
+                               ) -> List[str]:
+                nonlocal in_flight_count, max_seen_in_flight
+                in_flight_count += 1
+                max_seen_in_flight = max(max_seen_in_flight, in_flight_count)
+                await asyncio.sleep(0.01)
+                in_flight_count -= 1
+                if entry == "0":
+                    raise asyncio.TimeoutError()
+                return [entry]
+
+        concurrency_controller = AIMDConcurrencyController(initial_limit=4, window_size=100)
+        output_collector = _TestOutputCollector(prefix="")
+        template_flow = TemplateFlow(
+            process_collectors_maps=[
+                ProcessCollectorsMap(
+                    processor=_SlowProcessor(),
+                    collectors=[output_collector],
+                )
+            ],
+            concurrency_controller=concurrency_controller,
+        )
+        template_flow.retry_wrapper = _NoRetryWrapper()
+
+        q = QueueSourceSink()
+        for i in range(10):
+            await q.put(str(i))
+        q.stop()
+
+        await template_flow.aexecute(
+            message_iterator=q,
+        )
+
+        # the window follows the controller, which halved it on the timeout
+        self.assertEqual(4, max_seen_in_flight)
+        self.assertEqual(2, concurrency_controller.limit)
+        self.assertEqual(
+            sorted(str(i) for i in range(1, 10)),
+            sorted(output_collector.outputs),
+        )
+
+    async def test_template_processor_max_in_flight_isolates_errors(self):
+        class _FailingProcessor(EntryProcessor):
+            async def aprocess(self,
+                               entry: str,
+                               ) -> List[str]:
+                if entry == "BAD":
+                    raise ValueError("simulated value error")
+                return [entry]
+
+        output_collector = _TestOutputCollector(prefix="")
+        template_flow = TemplateFlow(
+            process_collectors_maps=[
+                ProcessCollectorsMap(
+                    processor=_FailingProcessor(),
+                    collectors=[output_collector],
+                )
+            ],
+            max_in_flight=2,
+        )
+        # fail fast instead of sleeping between retries
+        template_flow.retry_wrapper = _NoRetryWrapper()
+
+        q = QueueSourceSink()
+        for entry in ["A", "BAD", "B", "C"]:
+            await q.put(entry)
+        q.stop()
+
+        await template_flow.aexecute(
+            message_iterator=q,
+        )
+
+        self.assertEqual(["A", "B", "C"], sorted(output_collector.outputs))
+
+    async def test_template_processor_micro_batching(self):
+        batches = []
+
+        class _BatchProcessor(BatchEntryProcessor):
+            async def aprocess_batch(self,
+                                     entries: List[str],
+                                     ) -> List[str]:
+                batches.append(list(entries))
+                return [e.lower() for e in entries]
+
+        class _TestBatchOutputCollector(BatchOutputCollector):
+            def __init__(self):
+                self.outputs = []
+
+            async def acollect_outputs(self,
+                                       entries: List[str],
+                                       ):
+                self.outputs.append(entries)
+
+        class _TestSingleOutputCollector(OutputCollector):
+            def __init__(self):
+                self.outputs = []
+
+            async def acollect_output(self,
+                                      entry: str,
+                                      ):
+                self.outputs.append(entry)
+
+        batch_collector = _TestBatchOutputCollector()
+        single_collector = _TestSingleOutputCollector()
+        template_flow = TemplateFlow(
+            process_collectors_maps=[
+                ProcessCollectorsMap(
+                    processor=_BatchProcessor(),
+                    collectors=[batch_collector, single_collector],
+                ),
+                ProcessCollectorsMap(
+                    processor=_TestStringProcessor(),
+                    collectors=[batch_collector],
+                ),
+            ],
+            max_batch_size=2,
+            max_linger_s=0.01,
+        )
+
+        q = QueueSourceSink()
+        for entry in ["ONE", "TWO", "THREE"]:
+            await q.put(entry)
+        q.stop()
+
+        await template_flow.aexecute(
+            message_iterator=q,
+        )
+
+        self.assertEqual([["ONE", "TWO"], ["THREE"]], batches)
+        self.assertEqual([
+            ["one", "two"],
+            [("ONE_a", "ONE_b"), ("TWO_a", "TWO_b")],
+            ["three"],
+            [("THREE_a", "THREE_b")],
+        ], batch_collector.outputs)
+        self.assertEqual(["one", "two", "three"], single_collector.outputs)
+
+    async def test_template_processor_metrics(self):
+        registry = CollectorRegistry()
+        output_collector = _TestOutputCollector(prefix="")
+        template_flow = TemplateFlow(
+            process_collectors_maps=[
+                ProcessCollectorsMap(
+                    processor=_TestStringProcessor(),
+                    collectors=[output_collector],
+                    name="split",
+                )
+            ],
+            name="test_flow",
+            metrics=FlowMetrics(registry),
+        )
+
+        q = QueueSourceSink()
+        for entry in ["ONE", "TWO"]:
+            await q.put(entry)
+        q.stop()
+
+        await template_flow.aexecute(
+            message_iterator=q,
+        )
+
+        labels = {"flow": "test_flow", "stage": "split"}
+        self.assertEqual(2, registry.get_sample_value("rx_flow_messages_in_total", labels))
+        self.assertEqual(2, registry.get_sample_value("rx_flow_messages_out_total", labels))
+        self.assertEqual(0, registry.get_sample_value("rx_flow_errors_total", labels))
+        self.assertEqual(2, registry.get_sample_value("rx_flow_processor_latency_seconds_count", labels))
+        self.assertEqual(2, registry.get_sample_value(
+            "rx_flow_collector_latency_seconds_count",
+            dict(labels, collector="_TestOutputCollector"),
+        ))
+
+    async def test_template_processor_dead_letter(self):
+        class _FailingProcessor(EntryProcessor):
+            async def aprocess(self,
+                               entry: str,
+                               ) -> List[str]:
+                if entry == "BAD":
+                    raise ValueError("simulated value error")
+                return [entry]
+
+        dead_letter_sink = QueueSourceSink()
+        output_collector = _TestOutputCollector(prefix="")
+        template_flow = TemplateFlow(
+            process_collectors_maps=[
+                ProcessCollectorsMap(
+                    processor=_FailingProcessor(),
+                    collectors=[output_collector],
+                    name="fail_on_bad",
+                ),
+                ProcessCollectorsMap(
+                    processor=_TestStringProcessor(),
+                    collectors=[output_collector],
+                ),
+            ],
+            name="test_flow",
+            dead_letter_sink=dead_letter_sink,
+        )
+        template_flow.retry_wrapper = _NoRetryWrapper()
+
+        q = QueueSourceSink()
+        for entry in ["A", "BAD"]:
+            await q.put(entry)
+        q.stop()
+
+        await template_flow.aexecute(
+            message_iterator=q,
+        )
+
+        # the second stage still ran for the failed message
+        self.assertEqual(["A", "A_a", "A_b", "BAD_a", "BAD_b"], output_collector.outputs)
+
+        dead_letter_sink.stop()
+        dead_letters = [e async for e in dead_letter_sink]
+        self.assertEqual(1, len(dead_letters))
+        self.assertEqual("BAD", dead_letters[0]["entry"])
+        self.assertEqual("test_flow", dead_letters[0]["flow"])
+        self.assertEqual("fail_on_bad", dead_letters[0]["stage"])
+        self.assertEqual("ValueError: simulated value error", dead_letters[0]["error"])
+
+    async def test_template_processor_batch_dead_letter(self):
+        class _FailingBatchProcessor(BatchEntryProcessor):
+            async def aprocess_batch(self,
+                                     entries: List[str],
+                                     ) -> List[str]:
+                if "BAD" in entries:
+                    raise ValueError("simulated value error")
+                return [e.lower() for e in entries]
+
+        class _TestSingleOutputCollector(OutputCollector):
+            def __init__(self):
+                self.outputs = []
+
+            async def acollect_output(self,
+                                      entry: str,
+                                      ):
+                self.outputs.append(entry)
+
+        dead_letter_sink = QueueSourceSink()
+        output_collector = _TestSingleOutputCollector()
+        template_flow = TemplateFlow(
+            process_collectors_maps=[
+                ProcessCollectorsMap(
+                    processor=_FailingBatchProcessor(),
+                    collectors=[output_collector],
+                    name="fail_on_bad",
+                ),
+            ],
+            max_batch_size=3,
+            max_linger_s=0.01,
+            dead_letter_sink=dead_letter_sink,
+        )
+        template_flow.retry_wrapper = _NoRetryWrapper()
+
+        q = QueueSourceSink()
+        for entry in ["A", "BAD", "C"]:
+            await q.put(entry)
+        q.stop()
+
+        await template_flow.aexecute(
+            message_iterator=q,
+        )
+
+        # only the failing message of the batch is dead-lettered
+        self.assertEqual(["a", "c"], output_collector.outputs)
+        dead_letter_sink.stop()
+        self.assertEqual(["BAD"], [e["entry"] async for e in dead_letter_sink])
+
+    async def test_template_processor_batch_entry_error(self):
+        class _PartlyFailingBatchProcessor(BatchEntryProcessor):
+            def __init__(self):
+                self.single_entries = []
+
+            async def aprocess(self,
+                               entry: str,
+                               ) -> List[str]:
+                self.single_entries.append(entry)
+                if entry == "BAD":
+                    raise ValueError("simulated value error")
+                return [entry.lower()]
+
+            async def aprocess_batch(self,
+                                     entries: List[str],
+                                     ) -> List[str]:
+                raise BatchEntryError(
+                    [e.lower() for e in entries if e != "BAD"],
+                    [(e, ValueError("simulated value error")) for e in entries if e == "BAD"],
+                )
+
+        processor = _PartlyFailingBatchProcessor()
+        output_collector = _TestOutputCollector(prefix="")
+        # no dead-letter sink; the failing message is dropped on its own
+        template_flow = TemplateFlow(
+            process_collectors_maps=[
+                ProcessCollectorsMap(
+                    processor=processor,
+                    collectors=[output_collector],
+                    name="fail_on_bad",
+                ),
+            ],
+            max_batch_size=3,
+            max_linger_s=0.01,
+        )
+        template_flow.retry_wrapper = _NoRetryWrapper()
+
+        q = QueueSourceSink()
+        for entry in ["A", "BAD", "C"]:
+            await q.put(entry)
+        q.stop()
+
+        await template_flow.aexecute(
+            message_iterator=q,
+        )
+
+        self.assertEqual(["a", "c"], output_collector.outputs)
+        # only the failed entry is run again
+        self.assertEqual(["BAD"], processor.single_entries)
+
+    async def test_template_processor_with_stage(self):
+        first_collector = _TestOutputCollector(prefix="first_")
+        second_collector = _TestOutputCollector(prefix="second_")
+        template_flow = TemplateFlow(
+            process_collectors_maps=[
+                ProcessCollectorsMap(
+                    processor=_TestStringProcessor(),
+                    collectors=[first_collector],
+                    name="first",
+                ),
+                ProcessCollectorsMap(
+                    processor=_TestStringProcessor(),
+                    collectors=[second_collector],
+                    name="second",
+                ),
+            ],
+        )
+
+        q = QueueSourceSink()
+        await q.put("A")
+        q.stop()
+
+        await template_flow.with_stage("second").aexecute(
+            message_iterator=q,
+        )
+
+        self.assertEqual([], first_collector.outputs)
+        self.assertEqual(["second_A_a", "second_A_b"], second_collector.outputs)
+        self.assertEqual(2, len(template_flow.process_collectors_maps))
+        with self.assertRaises(ValueError):
+            template_flow.with_stage("unknown")
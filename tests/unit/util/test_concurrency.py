@@ -0,0 +1,47 @@
+import asyncio
+import unittest
+
+import aiohttp
+from xrpl.asyncio.clients import XRPLRequestFailureException
+
+from ekspiper.util.callable import RPCResponseError
+from ekspiper.util.concurrency import AIMDConcurrencyController, is_throttle_error
+
+
+class AIMDConcurrencyControllerTest(unittest.TestCase):
+    def test_additive_increase(self):
+        controller = AIMDConcurrencyController(initial_limit=5, max_limit=6, target_latency_s=1, window_size=2)
+
+        controller.record(0.1)
+        self.assertEqual(5, controller.limit)
+        controller.record(0.1)
+        self.assertEqual(6, controller.limit)
+
+        # capped at the max limit
+        controller.record(0.1)
+        controller.record(0.1)
+        self.assertEqual(6, controller.limit)
+
+    def test_decrease_over_target_latency(self):
+        controller = AIMDConcurrencyController(initial_limit=8, target_latency_s=1, window_size=2)
+
+        controller.record(0.5)
+        controller.record(2.5)
+        self.assertEqual(4, controller.limit)
+
+    def test_throttle_decreases_once_per_cooldown(self):
+        controller = AIMDConcurrencyController(initial_limit=8, decrease_cooldown_s=60)
+
+        controller.record(0.1, asyncio.TimeoutError())
+        controller.record(0.1, RPCResponseError("Error fetching transactions for ledger :1 (slowDown)", error="slowDown"))
+        self.assertEqual(4, controller.limit)
+
+    def test_is_throttle_error(self):
+        self.assertTrue(is_throttle_error(XRPLRequestFailureException({"error": 503})))
+        self.assertTrue(is_throttle_error(XRPLRequestFailureException({"error": "tooBusy"})))
+        self.assertTrue(is_throttle_error(RPCResponseError("Error fetching transactions for ledger :1 (slowDown)", error="slowDown")))
+        self.assertTrue(is_throttle_error(aiohttp.ClientResponseError(None, (), status=429)))
+        self.assertFalse(is_throttle_error(aiohttp.ClientResponseError(None, (), status=500)))
+        self.assertFalse(is_throttle_error(RPCResponseError("Error fetching transactions for ledger :74290503 (lgrNotFound)", error="lgrNotFound")))
+        # the error code is not guessed from the message
+        self.assertFalse(is_throttle_error(ValueError("tooBusy")))
@@ -0,0 +1,167 @@
+import struct
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+
+from xrpl.asyncio.clients.async_client import AsyncClient
+from xrpl.core.binarycodec import encode
+from xrpl.models.response import Response, ResponseStatus
+from xrpl.models.transactions.transaction import Transaction
+
+from ekspiper.processor.fetch_transactions import XRPLFetchLedgerDetailsProcessor
+from ekspiper.util.ledger_codec import decode_binary_ledger, decode_ledger_header, transaction_hash
+
+PAYMENT = {
+    "TransactionType": "Payment",
+    "Account": "rN7n7otQDd6FczFgLdSqtcsAUxDkw6fzRH",
+    "Destination": "rPT1Sjq2YGrBMTttX4GZHjKu9dyfzbpAYe",
+    "Amount": "1000",
+    "Fee": "12",
+    "Sequence": 1,
+    "Flags": 0,
+    "SigningPubKey": "03AB40A0490F9B7ED8DF29D246BF2D6269820A0EE7742ACDD457BEA7C7D0931EDB",
+    "TxnSignature": "3045022100" + "AB" * 32 + "0220" + "CD" * 32,
+}
+META = {
+    "TransactionIndex": 0,
+    "TransactionResult": "tesSUCCESS",
+    "AffectedNodes": [],
+}
+
+# mainnet ledger 72959850, as returned by a binary `ledger` request
+MAINNET_LEDGER_HASH = "128E62F87E422F78EA745D4489CA774D2411C9F024EEB109BD78B19E81A4E61A"
+MAINNET_LEDGER_DATA = (
+    "0459476A01633BD4C037DDF0"
+    "A88DBFB1D7036D6FF8C327C0A0A519D63CC3432CE5B94028C78AF593BD4E097C"
+    "4E81711912CE4A5B01E3D99B7CE61269CA560F795C0C7388E78913878D4F8068"
+    "1BCE6A54FCC4ADDE1BE07E92665A23081AB23798A6E6ADD979157BD1778CAB6A"
+    "2A606CEA2A606CEB0A00"
+)
+MAINNET_TRANSACTION_HASH = "EEC6AA1DA639A4C6C38E31D3D311244700D5BC199454C2AE59AD6555B446F7F8"
+MAINNET_TRANSACTION = {
+    "tx_blob": (
+        "12000722000000002404C5A0CA201B0459476C644000003A3529440065D59BAC48175114000000000000000000000000"
+        "0055534400000000000A20B3C85F482532A9578DBB3950B85CA06594D1684000000000000014732103C71E57783E0651"
+        "DFF647132172980B1F598334255F01DD447184B5D66501E67A74473045022100CC9AA1E70BD47336DFFC9F5A70FD06BF"
+        "53346CD491E819242C6D925CC2BF7EE6022046C128F8750275E3BC7481D035D31BC4575C423D698B9A65FE9C0E81E97B"
+        "59598114521727AB76FD862A0DF5EB6668C8165573FE691C"
+    ),
+    "meta": (
+        "201C00000000F8E51100645612F72282F74D437C2E76C4E57710E63779A1825D5A2090FF894FB9A22AF40AAEE7220000"
+        "00003100000000000000003200000000000000005812F72282F74D437C2E76C4E57710E63779A1825D5A2090FF894FB9"
+        "A22AF40AAE8214521727AB76FD862A0DF5EB6668C8165573FE691CE1E1E3110064564627DFFCFF8B5A265EDBD8AE8C14"
+        "A52325DBFEDAF4F5C32E5B0B6711F888D00AE8365B0B6711F888D00A584627DFFCFF8B5A265EDBD8AE8C14A52325DBFE"
+        "DAF4F5C32E5B0B6711F888D00A0311000000000000000000000000555344000000000004110A20B3C85F482532A9578D"
+        "BB3950B85CA06594D1E1E1E311006F56B177BC0668A17BB1D48EF1D6924ACD94E4A9065CE94011734EE15C4172207EE5"
+        "E82404C5A0CA50104627DFFCFF8B5A265EDBD8AE8C14A52325DBFEDAF4F5C32E5B0B6711F888D00A644000003A352944"
+        "0065D59BAC481751140000000000000000000000000055534400000000000A20B3C85F482532A9578DBB3950B85CA065"
+        "94D18114521727AB76FD862A0DF5EB6668C8165573FE691CE1E1E511006125045947695549C65333B44E8DDDCAC5CE55"
+        "4A27439A4E9110B021D173FB98F6AD33E8729C0B56F709D77D5D72E0C96CB029FCE21F3AF34E70ED0D8DB121B2CF961E"
+        "64E582EEF2E62404C5A0CA2D000000056240000029ABB41577E1E722000000002404C5A0CB2D000000066240000029AB"
+        "B415638114521727AB76FD862A0DF5EB6668C8165573FE691CE1E1F1031000"
+    ),
+}
+
+
+def _ledger_data(seq: int) -> str:
+    return struct.pack(
+        ">IQ32s32s32sIIBB",
+        seq,
+        99_989_000_000_000_000,
+        bytes([1] * 32),
+        bytes([2] * 32),
+        bytes([3] * 32),
+        730_000_000,
+        730_000_003,
+        10,
+        0,
+    ).hex().upper()
+
+
+def _binary_result(seq: int) -> dict:
+    return {
+        "ledger": {
+            "closed": True,
+            "ledger_data": _ledger_data(seq),
+            "transactions": [{"tx_blob": encode(PAYMENT), "meta": encode(META)}],
+        },
+        "ledger_index": seq,
+        "validated": True,
+    }
+
+
+class _TestClient(AsyncClient):
+    def __init__(self):
+        super().__init__("http://localhost:51234/")
+        self.requests = []
+
+    async def request_impl(self, request):
+        self.requests.append(request)
+        return Response(status=ResponseStatus.SUCCESS, result=_binary_result(request.ledger_index))
+
+
+class LedgerCodecTest(unittest.TestCase):
+    def test_header(self):
+        header = decode_ledger_header(_ledger_data(75_000_000))
+
+        self.assertEqual("75000000", header["ledger_index"])
+        self.assertEqual("75000000", header["seqNum"])
+        self.assertEqual("99989000000000000", header["total_coins"])
+        self.assertEqual("01" * 32, header["parent_hash"])
+        self.assertEqual("02" * 32, header["transaction_hash"])
+        self.assertEqual("03" * 32, header["account_hash"])
+        self.assertEqual(730_000_003, header["close_time"])
+        self.assertEqual("2023-Feb-18 01:46:43.000000000 UTC", header["close_time_human"])
+        self.assertEqual(10, header["close_time_resolution"])
+        self.assertEqual(64, len(header["ledger_hash"]))
+
+    def test_mainnet_ledger(self):
+        result = decode_binary_ledger({
+            "ledger": {
+                "closed": True,
+                "ledger_data": MAINNET_LEDGER_DATA,
+                "transactions": [MAINNET_TRANSACTION],
+            },
+            "ledger_index": 72959850,
+            "validated": True,
+        })
+
+        ledger = result["ledger"]
+        self.assertEqual(MAINNET_LEDGER_HASH, result["ledger_hash"])
+        self.assertEqual(MAINNET_LEDGER_HASH, ledger["hash"])
+        self.assertEqual("72959850", ledger["ledger_index"])
+        self.assertEqual("A88DBFB1D7036D6FF8C327C0A0A519D63CC3432CE5B94028C78AF593BD4E097C", ledger["parent_hash"])
+        self.assertEqual("99989401676275184", ledger["total_coins"])
+        self.assertEqual("2022-Jul-12 17:33:31.000000000 UTC", ledger["close_time_human"])
+        self.assertEqual(710962410, ledger["parent_close_time"])
+
+        transaction = ledger["transactions"][0]
+        self.assertEqual(MAINNET_TRANSACTION_HASH, transaction["hash"])
+        self.assertEqual("OfferCreate", transaction["TransactionType"])
+        self.assertEqual("tesSUCCESS", transaction["metaData"]["TransactionResult"])
+        self.assertEqual(4, len(transaction["metaData"]["AffectedNodes"]))
+
+    def test_transaction_hash(self):
+        self.assertEqual(Transaction.from_xrpl(PAYMENT).get_hash(), transaction_hash(encode(PAYMENT)))
+
+    def test_decode_binary_ledger(self):
+        result = decode_binary_ledger(_binary_result(10))
+
+        self.assertEqual(10, result["ledger_index"])
+        self.assertEqual(result["ledger"]["ledger_hash"], result["ledger_hash"])
+        transaction = result["ledger"]["transactions"][0]
+        self.assertEqual("rPT1Sjq2YGrBMTttX4GZHjKu9dyfzbpAYe", transaction["Destination"])
+        self.assertEqual(transaction_hash(encode(PAYMENT)), transaction["hash"])
+        self.assertEqual("tesSUCCESS", transaction["metaData"]["TransactionResult"])
+        self.assertEqual("1000", transaction["metaData"]["delivered_amount"])
+
+
+class BinaryFetchLedgerDetailsTest(unittest.IsolatedAsyncioTestCase):
+    async def test_binary_fetch(self):
+        client = _TestClient()
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            processor = XRPLFetchLedgerDetailsProcessor(rpc_client=client, is_binary=True, decode_executor=executor)
+            result = (await processor.aprocess(10))[0]
+
+        self.assertTrue(client.requests[0].binary)
+        self.assertEqual("10", result["ledger"]["ledger_index"])
+        self.assertEqual("Payment", result["ledger"]["transactions"][0]["TransactionType"])